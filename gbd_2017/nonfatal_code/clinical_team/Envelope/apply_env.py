@@ -159,16 +159,216 @@ def read_tmp_jobs(cores):
     return env_cf
 
 
-def env_merger(df, read_cores=10):
+def read_env_draws(age, sex, years):
+    """
+    read the envelope draws for one age and sex, for the given years.
+    This is the same subset the uncertainty workers read, but for every
+    year at once
+    """
+    env = pd.read_hdf(r"FILEPATH/{}_{}.H5".format(root, int(age), int(sex)))
+    env = env[(env.age_start == age) & (env.sex_id == sex) &
+              (env.year_start.isin(years))].copy()
+    # drop unneeded cols
+    drops = ['measure_id', 'modelable_entity_id',
+             'mean', 'upper', 'lower', 'age_end']
+    env.drop([col for col in drops if col in env.columns], axis=1,
+             inplace=True)
+    return env
+
+
+def read_cf_draws(cf_type, age, sex):
+    """
+    read the smoothed correction factor draws of one type for an age and sex
+    """
+    cf_df = pd.read_csv(r"FILEPATH/{}_{}.csv".format(cf_type, int(age),
+                                                        int(sex)))
+    if "sex" in cf_df.columns:
+        cf_df.rename(columns={'sex': 'sex_id'}, inplace=True)
+    if "Unnamed: 0" in cf_df.columns:
+        cf_df.drop("Unnamed: 0", axis=1, inplace=True)
+    return cf_df
+
+
+def summarize_draws(draws):
+    """
+    median, 2.5th and 97.5th percentiles along the last axis of an array
+    of draws. Missing draws are skipped, like the pandas median and quantile
+    """
+    if np.isnan(draws).any():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            lower, mean, upper = np.nanpercentile(draws, [2.5, 50, 97.5],
+                                                  axis=-1)
+    else:
+        lower, mean, upper = np.percentile(draws, [2.5, 50, 97.5], axis=-1)
+    return mean, lower, upper
+
+
+def env_cf_product(env, cf_df, type_name, max_cells=50000000):
+    """
+    multiply every envelope row by the correction factor of every bundle
+    with the same age and sex, draw by draw, and keep only the median and
+    95% interval of the product.
+
+    The product for all rows is computed on arrays, max_cells draws at a
+    time, instead of merging the draws and multiplying in a DataFrame
+
+    Parameters:
+        env: Pandas DataFrame
+            envelope with "draw_" columns
+        cf_df: Pandas DataFrame
+            correction factors by bundle with "_sm" draw columns
+        type_name: str
+            suffix for the mean, lower and upper columns
+        max_cells: int
+            the most draws to hold in memory at once
+    """
+    draw_cols = env.filter(regex="^draw_").columns
+    cf_cols = cf_df.filter(regex="_sm$").columns
+    assert draw_cols.size == cf_cols.size,\
+        "There are {} envelope draws but {} cf draws".format(draw_cols.size,
+                                                            cf_cols.size)
+    id_cols = [col for col in env.columns if col not in draw_cols]
+
+    # every pair of envelope row and bundle correction factor to multiply
+    left = env[id_cols].reset_index(drop=True)
+    left['env_row'] = np.arange(left.shape[0])
+    right = cf_df[['age_start', 'sex_id', 'bundle_id']].reset_index(drop=True)
+    right['cf_row'] = np.arange(right.shape[0])
+    pairs = left.merge(right, how='inner', on=['age_start', 'sex_id'])
+    assert pairs.shape[0] == env.shape[0] * cf_df.bundle_id.unique().size,\
+        "There are {} rows after the merge and we expect {} rows."\
+        " {} from the envelope * {} bundles".\
+        format(pairs.shape[0],
+               env.shape[0] * cf_df.bundle_id.unique().size,
+               env.shape[0],
+               cf_df.bundle_id.unique().size)
+
+    env_draws = env[draw_cols].values.astype(float)
+    cf_draws = cf_df[cf_cols].values.astype(float)
+    env_rows = pairs['env_row'].values
+    cf_rows = pairs['cf_row'].values
+    summary = np.empty((pairs.shape[0], 3))
+    chunk = max(1, max_cells // max(1, draw_cols.size))
+    for start in range(0, pairs.shape[0], chunk):
+        stop = start + chunk
+        product = env_draws[env_rows[start:stop]] * cf_draws[cf_rows[start:stop]]
+        summary[start:stop] = np.column_stack(summarize_draws(product))
+
+    pairs.drop(['env_row', 'cf_row'], axis=1, inplace=True)
+    for i, stat in enumerate(['mean', 'lower', 'upper']):
+        pairs['{}_{}'.format(stat, type_name)] = summary[:, i]
+    return pairs
+
+
+def age_sex_uncertainty(age, sex, years, max_cells=50000000):
+    """
+    compute the envelope * correction factor uncertainty for one age and
+    sex and all of the years at once. This is the work of every
+    worker_cf_uncertainty.py job for the age and sex, without the
+    temp files
+    """
+    env = read_env_draws(age, sex, years)
+    draw_cols = env.filter(regex="^draw_").columns
+    merge_cols = ['age_start', 'age_group_id', 'sex_id', 'year_start',
+                  'year_end', 'location_id']
+
+    # create raw mean upper lower env values
+    raw_df = env.drop(draw_cols, axis=1)
+    raw_df['mean'], raw_df['lower'], raw_df['upper'] =\
+        summarize_draws(env[draw_cols].values.astype(float))
+
+    env_cf = None
+    for cf_type in ['prevalence', 'incidence', 'indvcf']:
+        cf_df = read_cf_draws(cf_type, age, sex)
+        product = env_cf_product(env, cf_df, cf_type, max_cells=max_cells)
+        if env_cf is None:
+            env_cf = product
+        else:
+            env_cf = env_cf.merge(product[merge_cols +
+                                          ['bundle_id',
+                                           'mean_' + cf_type,
+                                           'lower_' + cf_type,
+                                           'upper_' + cf_type]],
+                                  on=merge_cols + ['bundle_id'])
+
+    env_cf = env_cf.merge(raw_df[merge_cols + ['mean', 'lower', 'upper']],
+                          how='left', on=merge_cols)
+    return env_cf
+
+
+def _age_sex_uncertainty(args):
+    """
+    unpack the arguments for age_sex_uncertainty in a process pool
+    """
+    return age_sex_uncertainty(*args)
+
+
+def run_local_uncertainty(df, cores=5, max_cells=50000000):
+    """
+    compute the product of the envelope and the sampled correction factors
+    in this process, or in a pool of cores local processes, instead of
+    sending out a job for every age, sex and year.
+
+    Returns the summarized draws in the same format as read_tmp_jobs, to be
+    passed to env_merger
+
+    Parameters:
+        df: Pandas DataFrame
+            hospital data, used to find the ages, sexes and years to compute
+        cores: int
+            number of local processes, one age and sex each. 1 runs in this
+            process
+        max_cells: int
+            the most draws each process holds in memory at once
+    """
+    start = time.time()
+    if "age_start" not in df.columns:
+        # switch back to age group id
+        df = hosp_prep.group_id_start_end_switcher(df)
+
+    years = df.year_start.unique().tolist()
+    tasks = [(age, sex, years, max_cells)
+             for age in df.age_start.unique()
+             for sex in df.sex_id.unique()]
+
+    if cores > 1:
+        p = multiprocessing.Pool(min(cores, len(tasks)))
+        dat_list = p.map(_age_sex_uncertainty, tasks)
+        p.close()
+        p.join()
+    else:
+        dat_list = [_age_sex_uncertainty(task) for task in tasks]
+    env_cf = pd.concat(dat_list, ignore_index=True)
+
+    num_cols = ['age_group_id', 'location_id', 'sex_id',
+                'year_start', 'year_end', 'bundle_id']
+    for col in num_cols:
+        env_cf[col] = pd.to_numeric(env_cf[col], errors='raise')
+
+    # drop the age start col
+    env_cf.drop('age_start', axis=1, inplace=True)
+
+    print("local uncertainty finished in {} seconds".format(
+        (time.time()-start)))
+    return env_cf
+
+
+def env_merger(df, read_cores=10, env_df=None):
+
     """
     Merge the env*CF draws onto the hospital data
 
     Parameters:
         df: a Pandas dataframe of hospital data with bundle IDs
         attached
+        read_cores: number of processes to read the temp files with
+        env_df: the env*CF draw quantiles, e.g. from run_local_uncertainty.
+        If None they're read from the temp files the jobs wrote
     """
     # read in the env data
-    env_df = read_tmp_jobs(cores=read_cores)
+    if env_df is None:
+        env_df = read_tmp_jobs(cores=read_cores)
 
     demography = ['location_id', 'year_start', 'year_end',
                   'age_group_id', 'sex_id', 'bundle_id']
@@ -248,31 +448,44 @@ def apply_env_main(df, full_coverage_df,
                    env_path,
                    run_tmp_unc=False,
                    write=False,
-                   read_cores=15):
+                   read_cores=15,
+                   run_local=False,
+                   local_cores=5):
+    """
+    Attach the envelope * CF uncertainty to the hospital data and apply it.
+
+    If run_local is True the uncertainty is computed here with
+    run_local_uncertainty, using local_cores processes, rather than from
+    the temp files of the qsub jobs, and no scheduler is needed
+    """
     back = df.copy()
     starting_bundles = df.bundle_id.unique()
-    # delete existing env*CF files and re-run them again
-    if run_tmp_unc:
-        delete_uncertainty_tmp()
-        make_uncertainty_jobs(df)
+    env_cf = None
+    if run_local:
+        env_cf = run_local_uncertainty(df, cores=local_cores)
+    else:
+        # delete existing env*CF files and re-run them again
+        if run_tmp_unc:
+            delete_uncertainty_tmp()
+            make_uncertainty_jobs(df)
+            job_holder()
+            fix_failed_jobs()
+
+        # hold the script up until all the uncertainty jobs are done
         job_holder()
-        fix_failed_jobs()
-
-    # hold the script up until all the uncertainty jobs are done
-    job_holder()
 
-    # rough check to see if the length of new files is what we'd
-    # expect
-    if run_tmp_unc:
-        check_len = df.age_group_id.unique().size *\
-                df.sex_id.unique().size *\
-                df.year_start.unique().size
-        actual_len = len(glob.glob(r"FILEPATH/*.H5"))
-        assert actual_len == check_len,\
-            "Check the error logs, it looks like something went wrong while re-writing files"
+        # rough check to see if the length of new files is what we'd
+        # expect
+        if run_tmp_unc:
+            check_len = df.age_group_id.unique().size *\
+                    df.sex_id.unique().size *\
+                    df.year_start.unique().size
+            actual_len = len(glob.glob(r"FILEPATH/*.H5"))
+            assert actual_len == check_len,\
+                "Check the error logs, it looks like something went wrong while re-writing files"
 
     print("Merging on the draw quantiles from the envelope * corrections")
-    df = env_merger(df, read_cores=read_cores)
+    df = env_merger(df, read_cores=read_cores, env_df=env_cf)
 
     # apply the hospital envelope
     print("Applying the uncertainty to cause fractions")
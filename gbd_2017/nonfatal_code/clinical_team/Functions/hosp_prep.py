@@ -191,12 +191,63 @@ def year_range(df):
     return df
 
 
+def stack_diagnoses(df, categorical=True):
+    """
+    Takes a dataframe with diagnosis columns named in the format of "dx_*"
+    and reshapes all of them from wide to long in one pass.
+    Returns one row per non-missing diagnosis, with every non diagnosis column
+    of df plus
+        patient_index: the index of the row of df the diagnosis came from
+        diagnosis_position: 1 for the first dx column, 2 for the second, etc
+        diagnosis_id: 1 for primary (dx_1), 2 for secondary and beyond
+        cause_code: the diagnosis, as a categorical if categorical is True
+    Rows are ordered like df, and by diagnosis position within a row. Rows of
+    df with no diagnoses at all are kept once, with null diagnosis columns.
+    """
+    diagnosis_vars = df.columns[df.columns.str.startswith('dx_')]
+    other_vars = df.columns.drop(diagnosis_vars)
+
+    dx = df[diagnosis_vars].values
+    present = pd.notnull(dx)
+    rows, position = np.nonzero(present)  # row major, so ordered like df
+    codes = dx[rows, position]
+    position = position + 1
+    primary = np.asarray(diagnosis_vars == 'dx_1')
+    diagnosis_id = np.where(primary[position - 1], 1, 2)
+
+    # keep rows without any diagnoses, in their place
+    no_dx = np.flatnonzero(~present.any(axis=1))
+    if len(no_dx) > 0:
+        rows = np.concatenate([rows, no_dx])
+        order = np.argsort(rows, kind='mergesort')
+        rows = rows[order]
+        fill = np.full(len(no_dx), np.nan)
+        position = np.concatenate([position, fill])[order]
+        diagnosis_id = np.concatenate([diagnosis_id, fill])[order]
+        codes = np.concatenate([codes, fill.astype(object)])[order]
+
+    if categorical:
+        codes = pd.Categorical(codes)
+    long_df = pd.DataFrame({'patient_index': df.index.values[rows],
+                            'diagnosis_position': position,
+                            'diagnosis_id': diagnosis_id,
+                            'cause_code': codes},
+                           columns=['patient_index', 'diagnosis_position',
+                                    'diagnosis_id', 'cause_code'])
+    long_df = pd.concat([long_df,
+                         df[other_vars].iloc[rows].reset_index(drop=True)],
+                        axis=1)
+    assert long_df.shape[0] == present.sum() + len(no_dx),\
+        "Diagnoses were lost in the reshape from wide to long"
+    return long_df
+
+
 def stack_merger(df):
     """
     Takes a dataframe, and the number of diagnosis variables present.
     Selects only the columns with diagnosis information
-    Pivots along the index of the original dataframe to create a longer form
-    Outer joins this long df with the original wide df
+    Reshapes them to a longer form with stack_diagnoses, which keeps the
+    other columns of the original wide df
     Returns a stacked and merged data frame
     Assumes that the primary diagnosis column in diagnosis_vars is named dx_1
     Assumes that df has columns named in the format of "dx_*".
@@ -212,50 +263,18 @@ def stack_merger(df):
 
     diagnosis_vars = df.columns[df.columns.str.startswith('dx_')]  # find all
     # columns with dx_ at the start
-    diag_df = df[diagnosis_vars]  # select just the dx cols
-
-    # stack diagnosis var subset using index of original df
-    stacked_df = diag_df.set_index([diag_df.index]).stack().reset_index()
-    # rename stacked vars
-    stacked_df = stacked_df.rename(columns={"level_0": "patient_index",
-                                            'level_1': 'diagnosis_id',
-                                            0: 'cause_code'})
-
-    # replace diagnosis_id with codes, 1 for primary, 2 for secondary
-    # and beyond
-    stacked_df['diagnosis_id'] = np.where(stacked_df['diagnosis_id'] ==
-                                          'dx_1', 1, 2)
-    # merge stacked_df with the original df
-    merged_df = stacked_df.merge(df, left_on='patient_index', right_index=True,
-                                 how='outer')
+
+    merged_df = stack_diagnoses(df, categorical=False)
+    merged_df.drop('diagnosis_position', axis=1, inplace=True)
 
     # verify that no data was lost
-    # Check if primary diagnosis value counts are the same
-    assert (diag_df[diagnosis_vars[0]].value_counts() ==
-            merged_df['cause_code'].loc[merged_df['diagnosis_id'] == 1]
-            .value_counts()).all(),\
+    # Check if the number of primary and secondary diagnoses are the same
+    assert (merged_df['diagnosis_id'] == 1).sum() ==\
+        df[diagnosis_vars[0]].notnull().sum(),\
         "Primary Diagnoses counts are not the same before and after"
-    # check if all primary diagnosis are present before and after
-    assert (diag_df[diagnosis_vars[0]].sort_values().values ==
-            merged_df[merged_df['diagnosis_id'] == 1]['cause_code'].dropna()
-            .sort_values().values).all(),\
-        "Not all Primary Diagnoses are present before and after"
-
-    # check if counts of all secondary diagnoses are the same before and after
-    old_second_total = diag_df[diagnosis_vars[1:]]\
-        .apply(pd.Series.value_counts).sum(axis=1)
-    new_second_total = merged_df['cause_code']\
-        .loc[merged_df['diagnosis_id'] == 2].value_counts()
-    assert (old_second_total.sort_index().values ==
-            new_second_total.sort_index().values).all(),\
+    assert (merged_df['diagnosis_id'] == 2).sum() ==\
+        df[diagnosis_vars[1:]].notnull().values.sum(),\
         "The counts of Secondary Diagnoses were not the same before and after"
-    # check if all secondary diagnoses are present before and after
-    assert (old_second_total.sort_index().index ==
-            new_second_total.sort_index().index).all(),\
-        "Not all Secondary Diagnoses are present before and after"
-
-    # drop all the diagnosis features, we don't need them anymore
-    merged_df.drop(diagnosis_vars, axis=1, inplace=True)
 
     # remove missing cause codes this creates
     merged_df = merged_df[merged_df['cause_code'] != ""]
@@ -1423,50 +1442,76 @@ def make_zeros(df, cols_to_square, icd_len=5, etiology='bundle_id'):
     age/sex/cause type(bundle or baby seq) which
     exists in the given dataframe but only the years
     available for each location id
+    The square is built in a single product and the data is placed on it by
+    grid position, rather than squaring each location separately and merging
     """
     if type(cols_to_square) == str:
         cols_to_square = [cols_to_square]
-    def expandgrid(*itrs):
-        # create a template df with every possible combination of
-        #  age/sex/year/location to merge results onto
-        # define a function to expand a template with the cartesian product
-        product = list(itertools.product(*itrs))
-        return({'Var{}'.format(i+1):[x[i] for x in product] for i in range(len(itrs))})
+    # this isn't relevant to injuries now
+    if icd_len == 3:
+        assert False, "This is deprecated, set an icd_len value greater than 3"
 
-    sqr_df = []
     ages = df.age_group_id.unique()
     sexes = df.sex_id.unique()
+    info_cols = ['facility_id', 'nid', 'representative_id', 'source']
+    merge_cols = ['age_group_id', 'sex_id', 'location_id', 'year_start',
+                  etiology, 'year_end'] + info_cols
 
     # get all the unique bundles by source and location_id
     src_loc = df[['source', 'location_id']].drop_duplicates()
     src_bundle = df[['source', etiology]].drop_duplicates()
     loc_bundle = src_bundle.merge(src_loc, how='outer', on='source')
-    # print("loc_bundle df info", loc_bundle.info())
-
-    for loc in df.location_id.unique():
-        # this isn't relevant to injuries now
-        if icd_len == 3:
-            assert False, "This is deprecated, set an icd_len value greater than 3"
-        elif icd_len > 3:
-            cause_type = loc_bundle.loc[loc_bundle.location_id == loc, 'bundle_id'].unique().tolist()
-
-            dat = pd.DataFrame(expandgrid(ages, sexes, [loc],
-                                  df[df.location_id == loc].
-                                  year_start.unique(),
-                                  cause_type))
-            dat.columns = ['age_group_id', 'sex_id', 'location_id', 'year_start',
-                           etiology]
-        sqr_df.append(dat)
-
-    sqr_df = pd.concat(sqr_df)
-    sqr_df['year_end'] = sqr_df['year_start']
+    loc_bundle = loc_bundle[['location_id', etiology]].drop_duplicates()
 
     # get a key to fill in missing values for newly created rows
-    missing_col_key = df[['location_id', 'year_start', 'facility_id', 'nid', 'representative_id', 'source']].copy()
+    missing_col_key = df[['location_id', 'year_start'] + info_cols].copy()
     missing_col_key.drop_duplicates(inplace=True)
 
-    # inner merge sqr and missing col key to get all the column info we lost
-    final_df = sqr_df.merge(missing_col_key, how='inner', on=['location_id', 'year_start'])
+    # every location year (with its column info) gets every bundle found in
+    # that location, then the whole grid is crossed with ages and sexes in
+    # a single product. Grid row i * n_demo + j is base row i with the j-th
+    # age/sex pair
+    base = missing_col_key.merge(loc_bundle, how='inner', on='location_id')
+    base = base.reset_index(drop=True)
+    n_demo = len(ages) * len(sexes)
+    base_rows = np.repeat(np.arange(base.shape[0]), n_demo)
+    sqr_df = pd.DataFrame({'age_group_id': np.tile(np.repeat(ages, len(sexes)),
+                                                   base.shape[0]),
+                           'sex_id': np.tile(sexes, len(ages) * base.shape[0])})
+    for col in ['location_id', 'year_start', etiology] + info_cols:
+        sqr_df[col] = base[col].values[base_rows]
+    sqr_df['year_end'] = sqr_df['year_start']
+    sqr_df = sqr_df[merge_cols]
+
+    # find the grid row of each row of data. Only the small base table is
+    # merged, age and sex are looked up by position
+    base['base_row'] = np.arange(base.shape[0])
+    base_cols = ['location_id', 'year_start', etiology] + info_cols
+    data_rows = df[base_cols].merge(base, how='left', on=base_cols)
+    matched = data_rows['base_row'].notnull().values &\
+        (df['year_end'].values == df['year_start'].values)
+    df_rows = np.flatnonzero(matched)
+    grid_rows = (data_rows['base_row'].values[df_rows].astype(np.int64) *
+                 n_demo +
+                 pd.Index(ages).get_indexer(df['age_group_id'].values[df_rows]) *
+                 len(sexes) +
+                 pd.Index(sexes).get_indexer(df['sex_id'].values[df_rows]))
+
+    # reindex the data against the grid, keeping a zero row for every empty
+    # cell and one row for each row of data in a filled cell
+    empty = np.ones(sqr_df.shape[0], dtype=bool)
+    empty[grid_rows] = False
+    empty = np.flatnonzero(empty)
+    grid_rows = np.concatenate([empty, grid_rows])
+    df_rows = np.concatenate([np.full(len(empty), -1, dtype=np.int64),
+                              df_rows])
+    order = np.argsort(grid_rows, kind='mergesort')
+    value_cols = [col for col in df.columns if col not in merge_cols]
+    final_df = pd.concat(
+        [sqr_df.iloc[grid_rows[order]].reset_index(drop=True),
+         df[value_cols].reset_index(drop=True).reindex(df_rows[order]).\
+            reset_index(drop=True)],
+        axis=1)
 
     # apply age/sex restrictions to the template df
     # apply restrictions requires data at the baby seq level but make_zeros 
@@ -1474,12 +1519,6 @@ def make_zeros(df, cols_to_square, icd_len=5, etiology='bundle_id'):
     # is run at bundle level final_df = apply_restrictions(df=final_df, 
     # col_to_restrict='age_group_id', drop_restricted=True)
 
-    # left merge on our built out template df to create zero rows
-    final_df = final_df.merge(df, how='left', on=['age_group_id',
-                              'sex_id', 'location_id', 'year_start',
-                              'year_end', etiology, 'facility_id',
-                              'nid', 'representative_id',
-                              'source'])
     # fill missing values of the col of interest with zero
     for col in cols_to_square:
         final_df[col] = final_df[col].fillna(0)
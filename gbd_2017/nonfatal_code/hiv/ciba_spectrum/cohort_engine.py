@@ -0,0 +1,219 @@
+# coding: utf-8
+'''
+Array engine for the adult (15-80) HIV+ cohort in cohort_spectrum.py
+
+The dict-of-dicts population in cohort_spectrum.py,
+population[age][year][sex][state][duration][infection year], is held
+here as one dense array per year with axes
+
+    (..., age, sex, CD4 state, ART status, infection cohort)
+
+where ART status 0 is not on ART and 1-3 are the adultARTdurations.
+Any leading axes are batch axes (e.g. draws or locations), so many
+projections can be advanced together in one process.
+
+project_adult_year applies the within-year ART initiation, CD4
+progression and HIV mortality of cohort_spectrum.py (the predicted ART
+coverage path) as tensor operations, giving the same results as the
+nested loops up to floating point rounding.
+'''
+
+import numpy as np
+
+sexes = ['male', 'female']
+noARTCD4states = ['LT50CD4', '50to99CD4', '100to199CD4', '200to249CD4',
+'250to349CD4', '350to500CD4', 'GT500CD4']
+ARTCD4states = ['ART' + c for c in noARTCD4states]
+adultARTdurations = ['LT6Mo', '6to12Mo', 'GT12Mo']
+CD4Caps = np.array([1, 1, 1, 1, .9, .9, .78])
+
+adultAges = np.arange(15, 81)
+# Age group of each adult age for progression and off-ART mortality
+# (15, 25, 35, 45+) and for on-ART mortality (15, 25, 35, 45, 55+)
+noARTAgeGroup = np.minimum((adultAges - 15) // 10, 3)
+onARTAgeGroup = np.minimum((adultAges - 15) // 10, 4)
+
+# Yearly rate of moving on from each of the first two ART durations, which
+# last 6 months
+ARTdurationRate = 12 / 6
+
+timeStep = 10
+
+
+def adult_rates(progressionParameters, noARTmortality, onARTmortality):
+    ''' Arrays of the per-step CD4 progression and off-ART mortality,
+    (age, sex, CD4), and the yearly on-ART mortality, (age, sex, CD4,
+    duration), from the cohort_spectrum.py parameter dicts.'''
+    prog = np.array([[[progressionParameters[15 + 10 * g][sex][c]
+                       for c in noARTCD4states] for sex in sexes]
+                     for g in range(4)])
+    mu = np.array([[[noARTmortality[sex][g][c] for c in noARTCD4states]
+                    for sex in sexes] for g in range(4)])
+    alpha = np.array([[[[onARTmortality[sex][d][g][c]
+                         for d in adultARTdurations] for c in ARTCD4states]
+                       for sex in sexes] for g in range(5)])
+    return prog[noARTAgeGroup], mu[noARTAgeGroup], alpha[onARTAgeGroup]
+
+
+def art_coverage_targets(popByCD4, predARTCoverage, ARTtotal, caps=CD4Caps):
+    ''' Number of adults to have on ART by age, sex, and CD4, so that
+predicted coverage adds up to the total ART count for each sex.
+
+    popByCD4 and predARTCoverage are (..., age, sex, CD4) arrays of PLWH
+(on and off ART) and predicted coverage, ARTtotal is (..., sex). Coverage
+is capped at caps, and any sex with capped groups is rescaled, setting
+groups to full coverage, until no group is covered over 100%.'''
+    pred = np.array(predARTCoverage, dtype=float)
+    pop = np.asarray(popByCD4, dtype=float)
+    ARTtotal = np.asarray(ARTtotal, dtype=float)
+    axes = (-3, -1)
+
+    def by_sex(x):
+        return x[..., np.newaxis, :, np.newaxis]
+
+    denom = (pop * pred).sum(axis=axes)
+    has_denom = denom != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scalar = np.where(has_denom, ARTtotal / denom, 0)
+    percentCovered = by_sex(scalar) * pred
+    capped = (percentCovered > caps) & by_sex(has_denom)
+    pred = np.where(capped, caps, pred)
+    percentCovered = np.where(capped, caps, percentCovered)
+    counts = np.where(by_sex(has_denom), percentCovered * pop, 0)
+
+    rescaling = capped.any(axis=axes)
+    while rescaling.any():
+        full = pred >= 1
+        rescaling &= ~full.all(axis=axes)
+        total = ARTtotal - (pop * full).sum(axis=axes)
+        denom = (pop * pred * ~full).sum(axis=axes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentCovered = by_sex(total / denom) * pred
+        update = ~full & by_sex(rescaling)
+        over = update & (percentCovered > 1)
+        percentCovered = np.where(over, 1, percentCovered)
+        pred = np.where(over, 1, pred)
+        counts = np.where(update, percentCovered * pop, counts)
+        rescaling = over.any(axis=axes)
+    return counts
+
+
+def start_art(noART, need):
+    ''' Move need people (..., age, sex, CD4) off ART into treatment,
+    split over infection cohorts by each cohort's share of the
+    remaining untreated population. noART is updated in place and the
+    number starting in each cohort is returned.
+
+    Cohorts are taken in order, with each share taken of the population
+    left after earlier cohorts started, as in cohort_spectrum.py.'''
+    started = np.zeros(noART.shape)
+    remaining = noART.sum(axis=-1)
+    for i in range(noART.shape[-1]):
+        pop = noART[..., i].copy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(remaining > 0, pop / remaining, 0)
+        started[..., i] = share * need
+        noART[..., i] = np.maximum(0, pop - started[..., i])
+        remaining = remaining - pop + noART[..., i]
+    return started
+
+
+def project_adult_year(population, prog, mu, alpha, ARTtarget,
+                       onARTScalar=1, timeStep=timeStep):
+    ''' Apply one year of ART initiation, CD4 progression, and HIV
+mortality to the adult population, in timeStep steps.
+
+    population: (..., age, sex, CD4, ART status, cohort) array, updated
+        in place
+    prog, mu: (..., age, sex, CD4) per-step progression out of each CD4
+        state and off-ART mortality
+    alpha: (..., age, sex, CD4, duration) yearly on-ART mortality,
+        multiplied by onARTScalar
+    ARTtarget: (..., age, sex, CD4) number to have on ART by the end of
+        the year, e.g. from art_coverage_targets
+
+    Returns HIV deaths in the year with the same shape as population.'''
+    prog = prog[..., np.newaxis]
+    mu = mu[..., np.newaxis]
+    alpha = (alpha * onARTScalar)[..., np.newaxis]
+    deaths = np.zeros(population.shape)
+    noART = population[..., 0, :]
+    onART = population[..., 1:, :]
+
+    for t1 in range(1, timeStep + 1):
+        survivors = (onART.sum(axis=-1) * (1 - alpha[..., 0] / timeStep)
+                     ).sum(axis=-1)
+        need = np.maximum(0, ARTtarget - survivors) / (timeStep - (t1 - 1))
+        started = start_art(noART, need)
+
+        # Off ART: progression in from the next CD4 state up, progression
+        # out and deaths
+        entrants = np.zeros(noART.shape)
+        entrants[..., :-1, :] = noART[..., 1:, :] * prog[..., 1:, :]
+        exits = noART * (prog + mu)
+        deaths[..., 0, :] += np.maximum(0, np.minimum(mu * noART, noART))
+
+        # On ART: new patients start in the first duration, and move up a
+        # duration every 6 months
+        ARTdeaths = onART * alpha / timeStep
+        progressing = onART[..., :2, :] * ARTdurationRate / timeStep
+        ARTentrants = np.concatenate(
+            [started[..., np.newaxis, :], progressing], axis=-2)
+        ARTexits = ARTdeaths.copy()
+        ARTexits[..., :2, :] += progressing
+        deaths[..., 1:, :] += np.maximum(0, np.minimum(ARTdeaths, onART))
+
+        noART[...] = np.maximum(0, noART + entrants - exits)
+        onART[...] = np.maximum(0, onART + ARTentrants - ARTexits)
+    return deaths
+
+
+# Conversion to and from cohort_spectrum.py's population objects
+
+def adult_population_array(population, t, minYear):
+    ''' (age, sex, CD4, ART status, cohort) array of the adult
+    population in year t, for infection cohorts minYear to t-1.'''
+    n = t - minYear
+    return np.array([[[[population[age][t][sex][c][:n]] +
+                       [population[age][t][sex][a][d][:n]
+                        for d in adultARTdurations]
+                       for c, a in zip(noARTCD4states, ARTCD4states)]
+                      for sex in sexes] for age in adultAges], dtype=float)
+
+
+def set_adult_population(population, arr, t, minYear):
+    ''' Write an array from adult_population_array back into population.'''
+    n = t - minYear
+    for i, age in enumerate(adultAges):
+        for s, sex in enumerate(sexes):
+            for k, (c, a) in enumerate(zip(noARTCD4states, ARTCD4states)):
+                population[age][t][sex][c][:n] = arr[i, s, k, 0].tolist()
+                for j, d in enumerate(adultARTdurations):
+                    population[age][t][sex][a][d][:n] = (
+                        arr[i, s, k, j + 1].tolist())
+
+
+def add_adult_deaths(AIDSdeaths, AIDSdeathsCD4, deaths, t, minYear):
+    ''' Add deaths from project_adult_year to the AIDSdeaths (by infection
+    cohort) and AIDSdeathsCD4 (by five year age group) objects.'''
+    n = t - minYear
+    byCohort = deaths.sum(axis=(2, 3))
+    byState = deaths.sum(axis=-1)
+    for i, age in enumerate(adultAges):
+        age5 = age - age % 5
+        for s, sex in enumerate(sexes):
+            cohortDeaths = AIDSdeaths[age][t][sex]
+            for j in range(n):
+                cohortDeaths[j] += byCohort[i, s, j]
+            for k, (c, a) in enumerate(zip(noARTCD4states, ARTCD4states)):
+                AIDSdeathsCD4[age5][t][sex][c] += byState[i, s, k, 0]
+                for j, d in enumerate(adultARTdurations):
+                    AIDSdeathsCD4[age5][t][sex][a][d] += byState[i, s, k, j + 1]
+
+
+def pred_coverage_array(predARTCoverage, t):
+    ''' (age, sex, CD4) array of readPredARTCoverage output for year t.'''
+    return np.array([[[predARTCoverage[t][age][sex][c]
+                       for c in noARTCD4states] for sex in sexes]
+                     for age in adultAges], dtype=float)
+
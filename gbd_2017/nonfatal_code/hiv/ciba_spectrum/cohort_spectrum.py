@@ -64,6 +64,7 @@ else:
 
 sys.path.append(code_path)
 import BeersInterpolation as beers
+import cohort_engine
 
 cohort_groups = ['1B', '2A', '2B']
 if stage == 'stage_1' and group in cohort_groups:
@@ -77,6 +78,9 @@ else:
 detailed_output = True
 art_deaths_output = True
 usePredCoverage = True
+# Project adult ART initiation, progression and mortality with cohort_engine
+# arrays rather than loops over the population object
+useArrayEngine = True
 maxYear = 2017
 if scaleOnART == 'T':
     scaleOnART = True
@@ -2066,6 +2070,9 @@ for run_id in xrange(indiv_run_nums):
     if usePredCoverage == True:  
         predARTCoverage = readPredARTCoverage(ISO)
 
+    if useArrayEngine == True:
+        adultProg, adultMu, adultAlpha = cohort_engine.adult_rates(progressionParameters, noARTmortality, onARTmortality)
+
     # ## Projection
 
     # ## Projection
@@ -2396,7 +2403,12 @@ for run_id in xrange(indiv_run_nums):
             plwhiv +=  sum([sum([sum([sum(population[age][t][sex][c][d]) for d in adultARTdurations]) for c in ARTCD4states]) for age in range(15,81)])
             if currentYearART[sex] > (0.9 * plwhiv):
                 currentYearART[sex] = 0.9 * plwhiv
-        if usePredCoverage == True:    
+        if usePredCoverage == True and useArrayEngine == True:
+            adultPop = cohort_engine.adult_population_array(population, t, minYear)
+            ARTtarget = cohort_engine.art_coverage_targets(adultPop.sum(axis=(3, 4)),
+                cohort_engine.pred_coverage_array(predARTCoverage, t),
+                [currentYearART[sex] for sex in cohort_engine.sexes])
+        elif usePredCoverage == True:    
             popByCD4 = getPopByCD4(population, noARTCD4states)
             ARTCoverageCounts = getPredARTCoverageCounts(popByCD4, predARTCoverage, t, currentYearART, noARTCD4states)
 
@@ -2411,222 +2423,227 @@ for run_id in xrange(indiv_run_nums):
             onARTScalar = np.asscalar(onARTScalar)
         else:
             onARTScalar = 1
-        for t1 in xrange(1, 11):
-            for sex in sexes:
-                if usePredCoverage == False:
-                    eligibleAdults[t - minYear][sex] = 0
-                    for age in xrange(15, 81):
-                            for c in noARTCD4states:
-                                if CD4lowerLimits[c] < adultARTeligibility[t-minYear]:
+        if usePredCoverage == True and useArrayEngine == True:
+            adultDeaths = cohort_engine.project_adult_year(adultPop, adultProg, adultMu, adultAlpha, ARTtarget, onARTScalar, timeStep)
+            cohort_engine.set_adult_population(population, adultPop, t, minYear)
+            cohort_engine.add_adult_deaths(AIDSdeaths, AIDSdeathsCD4, adultDeaths, t, minYear)
+        else:
+            for t1 in xrange(1, 11):
+                for sex in sexes:
+                    if usePredCoverage == False:
+                        eligibleAdults[t - minYear][sex] = 0
+                        for age in xrange(15, 81):
+                                for c in noARTCD4states:
+                                    if CD4lowerLimits[c] < adultARTeligibility[t-minYear]:
+                                        for i in xrange(minYear, t):
+                                            eligibleAdults[t - minYear][sex] += population[age][t][sex][c][i-minYear]
+                                    if sex =='female' and age in xrange(15, 50):
+                                        eligibleAdults[t - minYear][sex] += getEligiblePregnantWomen(age, t)
+
+                        # Use ART survivors to get new adult ART patients
+                        test_aggregate = {25:0, 50:0}
+                        ARTsurvivors = 0
+                        for age in xrange(15, maxAge + 1):
+                            age10 = ((age - (age - 5) % 10) - 15) / 10
+                            if age > 55:
+                                age10 = ((55 - (55 -5) % 10) - 15) / 10
+                            for c in ARTCD4states:
+                                for d in adultARTdurations:
+                                    alpha = onARTmortality[sex][d][age10][c] * onARTScalar
                                     for i in xrange(minYear, t):
-                                        eligibleAdults[t - minYear][sex] += population[age][t][sex][c][i-minYear]
-                                if sex =='female' and age in xrange(15, 50):
-                                    eligibleAdults[t - minYear][sex] += getEligiblePregnantWomen(age, t)
-
-                    # Use ART survivors to get new adult ART patients
-                    test_aggregate = {25:0, 50:0}
-                    ARTsurvivors = 0
-                    for age in xrange(15, maxAge + 1):
-                        age10 = ((age - (age - 5) % 10) - 15) / 10
-                        if age > 55:
-                            age10 = ((55 - (55 -5) % 10) - 15) / 10
-                        for c in ARTCD4states:
-                            for d in adultARTdurations:
-                                alpha = onARTmortality[sex][d][age10][c] * onARTScalar
-                                for i in xrange(minYear, t):
-                                    ARTsurvivors += population[age][t][sex][c][d][i-minYear] * (1 - alpha / timeStep)
-                                # ARTsurvivors += sum(population[age][t][sex][c][d]) * (1 - alpha / timeStep)
-                                if age > 25:
-                                    test_aggregate[50] += sum(population[age][t][sex][c][d])
-                                if age <= 25:
-                                    test_aggregate[25] += sum(population[age][t][sex][c][d])
-
-                    if adultARTCoverageType[t-minYear] == 'percent':
-                        neededART = ARTsurvivors + (currentYearART[sex] - ARTsurvivors) / timeStep * t1
-                    else:
-                        if t1 < math.trunc(timeStep / 2):
-                            neededART = (twoPrevYearsART[sex] + (prevYearART[sex] - twoPrevYearsART[sex]) / timeStep
-                                * (t1 + (timeStep / 2)))
+                                        ARTsurvivors += population[age][t][sex][c][d][i-minYear] * (1 - alpha / timeStep)
+                                    # ARTsurvivors += sum(population[age][t][sex][c][d]) * (1 - alpha / timeStep)
+                                    if age > 25:
+                                        test_aggregate[50] += sum(population[age][t][sex][c][d])
+                                    if age <= 25:
+                                        test_aggregate[25] += sum(population[age][t][sex][c][d])
+
+                        if adultARTCoverageType[t-minYear] == 'percent':
+                            neededART = ARTsurvivors + (currentYearART[sex] - ARTsurvivors) / timeStep * t1
                         else:
-                            neededART = (prevYearART[sex] + (currentYearART[sex] - prevYearART[sex]) / timeStep
-                                * (t1 - (timeStep / 2)))
+                            if t1 < math.trunc(timeStep / 2):
+                                neededART = (twoPrevYearsART[sex] + (prevYearART[sex] - twoPrevYearsART[sex]) / timeStep
+                                    * (t1 + (timeStep / 2)))
+                            else:
+                                neededART = (prevYearART[sex] + (currentYearART[sex] - prevYearART[sex]) / timeStep
+                                    * (t1 - (timeStep / 2)))
 
-                    newART = neededART - ARTsurvivors
-                    if newART < 0:
-                        newART = 0
+                        newART = neededART - ARTsurvivors
+                        if newART < 0:
+                            newART = 0
 
-                    newART = min(newART, eligibleAdults[t-minYear][sex])
-                    prop1 = {}
-                    prop2 = {}
+                        newART = min(newART, eligibleAdults[t-minYear][sex])
+                        prop1 = {}
+                        prop2 = {}
 
-                    for c in noARTCD4states:
-                        eligibleAdultsCD4[c][sex] = 0
-                        prop1[c] = 0
-                        prop2[c] = 0
-                        if CD4lowerLimits[c] < adultARTeligibility[t-minYear]:
-                            for age in xrange(15, maxAge + 1):
-                                eligibleAdultsCD4[c][sex] += sum(population[age][t][sex][c])
-                        else:
-                            eligibleAdultsCD4[c][sex] += eligibleSpecialPops[c][sex]
-                        # IF EACH CD4 CATEGORY GETS THE SAME WEIGHT IN NEW ART:
-                        # Get the proportion of each category by sex beginning treatment
-                        for i in xrange(4):
-                            eligByAge[i][c][sex] = 0
-
-                        if eligibleAdults[t-minYear][sex] > 0:
-                                prop1[c] = newART / eligibleAdults[t-minYear][sex]
-                        else:
+                        for c in noARTCD4states:
+                            eligibleAdultsCD4[c][sex] = 0
                             prop1[c] = 0
+                            prop2[c] = 0
+                            if CD4lowerLimits[c] < adultARTeligibility[t-minYear]:
+                                for age in xrange(15, maxAge + 1):
+                                    eligibleAdultsCD4[c][sex] += sum(population[age][t][sex][c])
+                            else:
+                                eligibleAdultsCD4[c][sex] += eligibleSpecialPops[c][sex]
+                            # IF EACH CD4 CATEGORY GETS THE SAME WEIGHT IN NEW ART:
+                            # Get the proportion of each category by sex beginning treatment
+                            for i in xrange(4):
+                                eligByAge[i][c][sex] = 0
+
+                            if eligibleAdults[t-minYear][sex] > 0:
+                                    prop1[c] = newART / eligibleAdults[t-minYear][sex]
+                            else:
+                                prop1[c] = 0
 
-                        for age in xrange(15, maxAge+1):
-                            age10 = ((age - (age - 5) % 10) - 15) / 10
-                            if age > 45:
-                                age10 = ((45 - (45 -5) % 10) - 15) / 10
-                            for i in xrange(minYear, t):
-                                eligByAge[age10][c][sex] += population[age][t][sex][c][i-minYear]
-
-                        # Calculate all-age noART deaths for each CD4 category
-                        sum1 = 0
-                        sum2 = 0
-                        for a1 in xrange(4):
-                            mu = noARTmortality[sex][a1][c]
-                            sum1 += mu * eligByAge[a1][c][sex]
-                            sum2 += eligByAge[a1][c][sex]
-
-                        # Calculate mortality for each CD4 category
-                        if sum2 > 0:
-                            mortRate[c] = sum1/sum2
-                        else:
-                            mortRate[c] = 0
+                            for age in xrange(15, maxAge+1):
+                                age10 = ((age - (age - 5) % 10) - 15) / 10
+                                if age > 45:
+                                    age10 = ((45 - (45 -5) % 10) - 15) / 10
+                                for i in xrange(minYear, t):
+                                    eligByAge[age10][c][sex] += population[age][t][sex][c][i-minYear]
+
+                            # Calculate all-age noART deaths for each CD4 category
+                            sum1 = 0
+                            sum2 = 0
+                            for a1 in xrange(4):
+                                mu = noARTmortality[sex][a1][c]
+                                sum1 += mu * eligByAge[a1][c][sex]
+                                sum2 += eligByAge[a1][c][sex]
+
+                            # Calculate mortality for each CD4 category
+                            if sum2 > 0:
+                                mortRate[c] = sum1/sum2
+                            else:
+                                mortRate[c] = 0
 
-                    # Get eligible adults by age group, CD4, and sex
-                    sum3 = 0
+                        # Get eligible adults by age group, CD4, and sex
+                        sum3 = 0
 
 
-                    for i in xrange(len(noARTCD4states)):
-                        tempSum = 0
-                        for c1 in noARTCD4states[i:]:
-                            tempSum += eligibleAdultsCD4[c1][sex] * mortRate[c1]
-                        if tempSum > 0:
-                            newPatients[noARTCD4states[i]][sex] = newART * eligibleAdultsCD4[noARTCD4states[i]][sex] * mortRate[noARTCD4states[i]] / tempSum
-                        else:
-                            newPatients[noARTCD4states[i]][sex] = 0
-                        newPatients[noARTCD4states[i]][sex] = min(newPatients[noARTCD4states[i]][sex], eligibleAdultsCD4[noARTCD4states[i]][sex])
-                        sum3 += newPatients[noARTCD4states[i]][sex]
-                        newART -= newPatients[noARTCD4states[i]][sex]
+                        for i in xrange(len(noARTCD4states)):
+                            tempSum = 0
+                            for c1 in noARTCD4states[i:]:
+                                tempSum += eligibleAdultsCD4[c1][sex] * mortRate[c1]
+                            if tempSum > 0:
+                                newPatients[noARTCD4states[i]][sex] = newART * eligibleAdultsCD4[noARTCD4states[i]][sex] * mortRate[noARTCD4states[i]] / tempSum
+                            else:
+                                newPatients[noARTCD4states[i]][sex] = 0
+                            newPatients[noARTCD4states[i]][sex] = min(newPatients[noARTCD4states[i]][sex], eligibleAdultsCD4[noARTCD4states[i]][sex])
+                            sum3 += newPatients[noARTCD4states[i]][sex]
+                            newART -= newPatients[noARTCD4states[i]][sex]
 
-                    # Calculate weighted average of # eligible and mortality
-                    for c in noARTCD4states:
-                        if eligibleAdultsCD4[c][sex] > 0:
-                            prop2[c] = newPatients[c][sex] / eligibleAdultsCD4[c][sex]
-                        else:
-                            prop2[c] = 0
+                        # Calculate weighted average of # eligible and mortality
+                        for c in noARTCD4states:
+                            if eligibleAdultsCD4[c][sex] > 0:
+                                prop2[c] = newPatients[c][sex] / eligibleAdultsCD4[c][sex]
+                            else:
+                                prop2[c] = 0
 
-                        # Average the two proportions to get the distribution of new patients
-                        newPatients[c][sex] = (prop1[c] + prop2[c]) / 2 * eligibleAdultsCD4[c][sex]
+                            # Average the two proportions to get the distribution of new patients
+                            newPatients[c][sex] = (prop1[c] + prop2[c]) / 2 * eligibleAdultsCD4[c][sex]
 
-                for age in xrange(childMaxAge + 1, maxAge + 1):
-                    age5 = age - age % 5
-                    age5_2 = (age - 15) - (age - 15) % 10 + 15
-                    age10 = ((age - (age - 5) % 10) - 15) / 10
-                    if age > 45:
-                        age5_2 = 45 - 45 % 5
-                        age10 = ((45 - (45 - 5) % 10) - 15) / 10
-                    age10_2 = ((age - (age - 5) % 10) - 15) / 10
-                    if age > 55:
-                        age10_2 = ((55 - (55 - 5) % 10) - 15) / 10
-                    GT12MoDeaths = 0
-                    tmp_startart = 0
-                    tmp_noARTpop = 0
-                    tmp_total_share = 0
-                    for c in reversed(xrange(len(noARTCD4states))):
-                        tmp_new_art = 0
-                        tmp_noARTpop_2 = 0
-                        age10_num = (10*(age10 + 1) + 5)
-                        if (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, age10_num + 10)])) > 0:
-                            if age <= 45:
-                                lastTenthCov = sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) / (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, age10_num + 10)]))
-                            else:
-                                lastTenthCov = sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, 81)]) for d in adultARTdurations]) / (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, 81)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, 81)]))
+                    for age in xrange(childMaxAge + 1, maxAge + 1):
+                        age5 = age - age % 5
+                        age5_2 = (age - 15) - (age - 15) % 10 + 15
+                        age10 = ((age - (age - 5) % 10) - 15) / 10
+                        if age > 45:
+                            age5_2 = 45 - 45 % 5
+                            age10 = ((45 - (45 - 5) % 10) - 15) / 10
+                        age10_2 = ((age - (age - 5) % 10) - 15) / 10
+                        if age > 55:
+                            age10_2 = ((55 - (55 - 5) % 10) - 15) / 10
+                        GT12MoDeaths = 0
+                        tmp_startart = 0
+                        tmp_noARTpop = 0
+                        tmp_total_share = 0
+                        for c in reversed(xrange(len(noARTCD4states))):
+                            tmp_new_art = 0
+                            tmp_noARTpop_2 = 0
+                            age10_num = (10*(age10 + 1) + 5)
+                            if (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, age10_num + 10)])) > 0:
+                                if age <= 45:
+                                    lastTenthCov = sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) / (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, age10_num + 10)]))
+                                else:
+                                    lastTenthCov = sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, 81)]) for d in adultARTdurations]) / (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, 81)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, 81)]))
 
-                        else:
-                            lastTenthCov = 0
-                        if usePredCoverage == True:
-                            cd4 = noARTCD4states[c]
-                            targetCoverage = ARTCoverageCounts[sex][age][cd4]
-                            survivors = getARTSurvivors(adultARTdurations,onARTmortality,sex,t,timeStep, population, age, cd4, onARTScalar)
-                        for i in xrange(minYear, t):
-                            startART = 0
-                            if sum(population[age][t][sex][noARTCD4states[c]]) > 0:
-                                tmp_inf_share = population[age][t][sex][noARTCD4states[c]][i-minYear] / sum(population[age][t][sex][noARTCD4states[c]])
                             else:
-                                tmp_inf_share = 0
+                                lastTenthCov = 0
                             if usePredCoverage == True:
-                                startART = max(0.0, tmp_inf_share * (targetCoverage - survivors)/(timeStep - (t1 - 1)))
-                            else:
-                                if eligibleAdultsCD4[noARTCD4states[c]][sex] <= 0:
-                                    startART = 0
+                                cd4 = noARTCD4states[c]
+                                targetCoverage = ARTCoverageCounts[sex][age][cd4]
+                                survivors = getARTSurvivors(adultARTdurations,onARTmortality,sex,t,timeStep, population, age, cd4, onARTScalar)
+                            for i in xrange(minYear, t):
+                                startART = 0
+                                if sum(population[age][t][sex][noARTCD4states[c]]) > 0:
+                                    tmp_inf_share = population[age][t][sex][noARTCD4states[c]][i-minYear] / sum(population[age][t][sex][noARTCD4states[c]])
                                 else:
-                                    if CD4lowerLimits[noARTCD4states[c]] < adultARTeligibility[t-minYear]:
-                                        # SPECIAL POPULATIONS
-                                        startART = tmp_inf_share * min(sum(population[age][t][sex][noARTCD4states[c]]), newPatients[noARTCD4states[c]][sex] * sum(population[age][t][sex][noARTCD4states[c]]) / eligibleAdultsCD4[noARTCD4states[c]][sex])
-                                        tmp_noARTpop += population[age][t][sex][noARTCD4states[c]][i-minYear]
-                                        tmp_noARTpop_2 += population[age][t][sex][noARTCD4states[c]][i-minYear]
-                                tmp_startart += startART
-                                if c == 0:
-                                    tmp_total_share += tmp_inf_share
-                                tmp_new_art += startART
-
-                            sumART += startART
-                            population[age][t][sex][noARTCD4states[c]][i-minYear] -= startART
-                            if population[age][t][sex][noARTCD4states[c]][i-minYear] < 0:
-                                population[age][t][sex][noARTCD4states[c]][i-minYear] = 0
-                            # Calculate noART entrants to and exits from groups
-                            if noARTCD4states[c] == 'GT500CD4':
-                                # This will be incidence
-                                entrants[noARTCD4states[c]][1][i-minYear] = 0
-                            else:
-                                # Use lambda to calculate entrants from one noART HIV+ group to another
-                                entrants[noARTCD4states[c]][1][i-minYear] = population[age][t][sex][noARTCD4states[c+1]][i-minYear] * progressionParameters[age5_2][sex][noARTCD4states[c+1]]
-                            mu = noARTmortality[sex][age10][noARTCD4states[c]]
-                            # Caculate the total number of exits from a group
-                            exits[noARTCD4states[c]][1][i-minYear] = (population[age][t][sex][noARTCD4states[c]][i-minYear] *
-                                (progressionParameters[age5_2][sex][noARTCD4states[c]] + mu)) 
-                            # exits[noARTCD4states[c]][1] = (population[age][t][sex][noARTCD4states[c]] *
-                            #   (lambdaCoeff(age, noARTCD4states[c]) + mu)) + startART
-
-                            temp = min(mu * population[age][t][sex][noARTCD4states[c]][i-minYear], population[age][t][sex][noARTCD4states[c]][i-minYear])
-                            AIDSdeaths[age][t][sex][i-minYear] += max(0, temp)
-                            tempDeaths += temp
-
-                            AIDSdeathsCD4[age5][t][sex][noARTCD4states[c]] += max(0, temp)
-
-                            # Calculate new need for ART
-                            if CD4lowerLimits[noARTCD4states[c]] == adultARTeligibility[t-minYear]:
-                                newlyNeedingART += population[age][t][sex][noARTCD4states[c]][i-minYear] * progressionParameters[age5_2][sex][noARTCD4states[c]]
-                            # Calculate movement in the onART categories
-                            for d in adultARTdurations:
-                                alpha = onARTmortality[sex][d][age10_2][ARTCD4states[c]] * onARTScalar
-                                if d == 'LT6Mo':
-                                    entrants[ARTCD4states[c]][d][i-minYear] = startART
-                                    exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha / timeStep + population[age][t][sex][ARTCD4states[c]][d][i-minYear] * (12 / 6) / timeStep
-                                elif d == '6to12Mo':
-                                    entrants[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]]['LT6Mo'][i-minYear] * (12 / 6) / timeStep
-                                    exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha / timeStep + population[age][t][sex][ARTCD4states[c]][d][i-minYear] * (12 / 6) / timeStep
-                                elif d == 'GT12Mo':
-                                    entrants[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]]['6to12Mo'][i-minYear] * (12 / 6) / timeStep
-                                    exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha /timeStep
-                                    GT12MoDeaths += alpha * population[age][t][sex][ARTCD4states[c]][d][i-minYear] / timeStep
-                                temp = min(alpha * population[age][t][sex][ARTCD4states[c]][d][i-minYear] / timeStep, population[age][t][sex][ARTCD4states[c]][d][i-minYear])
+                                    tmp_inf_share = 0
+                                if usePredCoverage == True:
+                                    startART = max(0.0, tmp_inf_share * (targetCoverage - survivors)/(timeStep - (t1 - 1)))
+                                else:
+                                    if eligibleAdultsCD4[noARTCD4states[c]][sex] <= 0:
+                                        startART = 0
+                                    else:
+                                        if CD4lowerLimits[noARTCD4states[c]] < adultARTeligibility[t-minYear]:
+                                            # SPECIAL POPULATIONS
+                                            startART = tmp_inf_share * min(sum(population[age][t][sex][noARTCD4states[c]]), newPatients[noARTCD4states[c]][sex] * sum(population[age][t][sex][noARTCD4states[c]]) / eligibleAdultsCD4[noARTCD4states[c]][sex])
+                                            tmp_noARTpop += population[age][t][sex][noARTCD4states[c]][i-minYear]
+                                            tmp_noARTpop_2 += population[age][t][sex][noARTCD4states[c]][i-minYear]
+                                    tmp_startart += startART
+                                    if c == 0:
+                                        tmp_total_share += tmp_inf_share
+                                    tmp_new_art += startART
+
+                                sumART += startART
+                                population[age][t][sex][noARTCD4states[c]][i-minYear] -= startART
+                                if population[age][t][sex][noARTCD4states[c]][i-minYear] < 0:
+                                    population[age][t][sex][noARTCD4states[c]][i-minYear] = 0
+                                # Calculate noART entrants to and exits from groups
+                                if noARTCD4states[c] == 'GT500CD4':
+                                    # This will be incidence
+                                    entrants[noARTCD4states[c]][1][i-minYear] = 0
+                                else:
+                                    # Use lambda to calculate entrants from one noART HIV+ group to another
+                                    entrants[noARTCD4states[c]][1][i-minYear] = population[age][t][sex][noARTCD4states[c+1]][i-minYear] * progressionParameters[age5_2][sex][noARTCD4states[c+1]]
+                                mu = noARTmortality[sex][age10][noARTCD4states[c]]
+                                # Caculate the total number of exits from a group
+                                exits[noARTCD4states[c]][1][i-minYear] = (population[age][t][sex][noARTCD4states[c]][i-minYear] *
+                                    (progressionParameters[age5_2][sex][noARTCD4states[c]] + mu)) 
+                                # exits[noARTCD4states[c]][1] = (population[age][t][sex][noARTCD4states[c]] *
+                                #   (lambdaCoeff(age, noARTCD4states[c]) + mu)) + startART
+
+                                temp = min(mu * population[age][t][sex][noARTCD4states[c]][i-minYear], population[age][t][sex][noARTCD4states[c]][i-minYear])
                                 AIDSdeaths[age][t][sex][i-minYear] += max(0, temp)
-                                AIDSdeathsCD4[age5][t][sex][ARTCD4states[c]][d] += max(0, temp)
+                                tempDeaths += temp
 
-                    for c in xrange(len(noARTCD4states)):
-                        # Add entrants and remove exits
-                        for i in xrange(minYear, t):
-                            population[age][t][sex][noARTCD4states[c]][i-minYear] = max(0, population[age][t][sex][noARTCD4states[c]][i-minYear] + entrants[noARTCD4states[c]][1][i-minYear] - exits[noARTCD4states[c]][1][i-minYear])
-                            for d in adultARTdurations:
-                                population[age][t][sex][ARTCD4states[c]][d][i-minYear] = max(0, population[age][t][sex][ARTCD4states[c]][d][i-minYear] + entrants[ARTCD4states[c]][d][i-minYear] - exits[ARTCD4states[c]][d][i-minYear])
+                                AIDSdeathsCD4[age5][t][sex][noARTCD4states[c]] += max(0, temp)
+
+                                # Calculate new need for ART
+                                if CD4lowerLimits[noARTCD4states[c]] == adultARTeligibility[t-minYear]:
+                                    newlyNeedingART += population[age][t][sex][noARTCD4states[c]][i-minYear] * progressionParameters[age5_2][sex][noARTCD4states[c]]
+                                # Calculate movement in the onART categories
+                                for d in adultARTdurations:
+                                    alpha = onARTmortality[sex][d][age10_2][ARTCD4states[c]] * onARTScalar
+                                    if d == 'LT6Mo':
+                                        entrants[ARTCD4states[c]][d][i-minYear] = startART
+                                        exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha / timeStep + population[age][t][sex][ARTCD4states[c]][d][i-minYear] * (12 / 6) / timeStep
+                                    elif d == '6to12Mo':
+                                        entrants[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]]['LT6Mo'][i-minYear] * (12 / 6) / timeStep
+                                        exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha / timeStep + population[age][t][sex][ARTCD4states[c]][d][i-minYear] * (12 / 6) / timeStep
+                                    elif d == 'GT12Mo':
+                                        entrants[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]]['6to12Mo'][i-minYear] * (12 / 6) / timeStep
+                                        exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha /timeStep
+                                        GT12MoDeaths += alpha * population[age][t][sex][ARTCD4states[c]][d][i-minYear] / timeStep
+                                    temp = min(alpha * population[age][t][sex][ARTCD4states[c]][d][i-minYear] / timeStep, population[age][t][sex][ARTCD4states[c]][d][i-minYear])
+                                    AIDSdeaths[age][t][sex][i-minYear] += max(0, temp)
+                                    AIDSdeathsCD4[age5][t][sex][ARTCD4states[c]][d] += max(0, temp)
+
+                        for c in xrange(len(noARTCD4states)):
+                            # Add entrants and remove exits
+                            for i in xrange(minYear, t):
+                                population[age][t][sex][noARTCD4states[c]][i-minYear] = max(0, population[age][t][sex][noARTCD4states[c]][i-minYear] + entrants[noARTCD4states[c]][1][i-minYear] - exits[noARTCD4states[c]][1][i-minYear])
+                                for d in adultARTdurations:
+                                    population[age][t][sex][ARTCD4states[c]][d][i-minYear] = max(0, population[age][t][sex][ARTCD4states[c]][d][i-minYear] + entrants[ARTCD4states[c]][d][i-minYear] - exits[ARTCD4states[c]][d][i-minYear])
 
         updateAllStateTotal(t)                  
         lastAge = 49
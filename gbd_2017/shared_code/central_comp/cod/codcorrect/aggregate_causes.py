@@ -4,6 +4,7 @@ import pandas as pd
 import sys
 import os
 
+from dalynator.hierarchy_aggregator import HierarchyAggregator
 from draw_sources.draw_sources import DrawSink
 
 from codcorrect.core import read_json
@@ -100,39 +101,13 @@ def aggregate_causes(data, index_columns, data_columns, cause_hierarchy):
     """Aggregate causes up the cause hierarchy."""
     logger = logging.getLogger('aggregate_causes.aggregate_causes')
     try:
-
-        # Merge on cause hierarchy
-        cause_hierarchy['level'] = cause_hierarchy['level'].astype('int64')
-        min_level = cause_hierarchy['level'].min()
-        data = data[index_columns + data_columns]
-        data = pd.merge(data,
-                        cause_hierarchy[['cause_id',
-                                         'level',
-                                         'parent_id',
-                                         'most_detailed']
-                                        ],
-                        on='cause_id',
-                        how='left')
-        # Filter down to the most detailed causes
-        data = data.loc[data['most_detailed'] == 1]
-        max_level = data['level'].max()
-        # Loop through and aggregate
-        data = data[index_columns + data_columns]
-        for level in range(max_level, min_level, -1):
-            logging.info("Agg causes level: {}".format(level))
-            data = pd.merge(data,
-                            cause_hierarchy[['cause_id',
-                                             'level',
-                                             'parent_id']
-                                            ],
-                            on='cause_id',
-                            how='left')
-            temp = data.loc[data['level'] == level].copy(deep=True)
-            temp['cause_id'] = temp['parent_id']
-            temp = temp[index_columns + data_columns]
-            temp = temp.groupby(index_columns).sum().reset_index()
-            data = pd.concat([data[index_columns + data_columns], temp]
-                             ).reset_index(drop=True)
+        # Sum the most detailed causes onto all of their ancestors in a
+        # single sparse pass
+        aggregator = HierarchyAggregator.from_hierarchy_df(cause_hierarchy)
+        logging.info("Agg causes levels: {}".format(
+            cause_hierarchy['level'].nunique()))
+        data = aggregator.aggregate(data, index_columns, data_columns,
+                                    dimension='cause_id', leaves_only=True)
 
     except Exception as e:
         logger.exception("Failed to aggregate causes: {}".format(e))
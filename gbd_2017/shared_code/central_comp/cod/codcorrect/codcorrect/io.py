@@ -1,10 +1,12 @@
 import os
 import sys
+import time
 
 import pandas as pd
 import logging
 import subprocess
 import gc
+from multiprocessing import Pool, cpu_count
 
 from transmogrifier.cod import draws
 from transmogrifier.directories import DirectoryNotFoundException
@@ -52,6 +54,34 @@ def handle_bad_index(draws_filepath, key, location_id):
     return (where_clause, None)
 
 
+def read_cod_model_draws(model_version_id, location_id, cause_id, sex_id,
+                         filter_years=None, db_env=None):
+    """Read in the draws of one CODEm/custom model for a location and sex,
+    restricted to the age groups CoDCorrect uses.
+
+    Raises on failure, so it is safe to call from pool workers.
+    """
+    try:
+        data = draws(cause_id, lids=[int(location_id)], sids=[int(sex_id)],
+                     yids=filter_years, status=model_version_id, n_draws='max',
+                     db_env=db_env)
+    except DirectoryNotFoundException:
+        data = draws(cause_id, lids=[int(location_id)], sids=[int(sex_id)],
+                     yids=filter_years, status=model_version_id, n_draws='max',
+                     db_env='prod')
+    data = data[data.age_group_id.isin(list(range(2, 22)) + [30, 31, 32, 235])]
+    return data
+
+
+def log_read_failure(logger, model_version_id, cause_id, location_id, sex_id,
+                     filter_years):
+    logger.exception("Failed to read" + '/n' +
+                     'Problem demographics were mvid {} cause {}, '
+                     'location {}, sex {}, and years {}'
+                     .format(model_version_id, cause_id, location_id,
+                             sex_id, ','.join(str(y) for y in filter_years)))
+
+
 def import_cod_model_draws(model_version_id, location_id, cause_id, sex_id,
                            required_columns, filter_years=None, db_env=None,
                            envelope=None):
@@ -63,22 +93,13 @@ def import_cod_model_draws(model_version_id, location_id, cause_id, sex_id,
     """
     logger = logging.getLogger('io.import_cod_model_draws')
     try:
-        data = draws(cause_id, lids=[int(location_id)], sids=[int(sex_id)],
-                     yids=filter_years, status=model_version_id, n_draws='max',
-                     db_env=db_env)
-    except DirectoryNotFoundException:
-        data = draws(cause_id, lids=[int(location_id)], sids=[int(sex_id)],
-                     yids=filter_years, status=model_version_id, n_draws='max',
-                     db_env='prod')
+        data = read_cod_model_draws(model_version_id, location_id, cause_id,
+                                    sex_id, filter_years=filter_years,
+                                    db_env=db_env)
     except Exception:
-        logger.exception("Failed to read" + '/n' +
-                         'Problem demographics were mvid {} cause {}, '
-                         'location {}, sex {}, and years {}'
-                         .format(model_version_id, cause_id, location_id,
-                                 sex_id, ','.join(str(y) for y in filter_years)
-                                 ))
+        log_read_failure(logger, model_version_id, cause_id, location_id,
+                         sex_id, filter_years)
         sys.exit(1)
-    data = data[data.age_group_id.isin(list(range(2, 22)) + [30, 31, 32, 235])]
     data = add_envelope(data, envelope)
     r = check_data_format(data, required_columns)
     if not r:
@@ -88,6 +109,126 @@ def import_cod_model_draws(model_version_id, location_id, cause_id, sex_id,
     return data
 
 
+def _timed_read(args):
+    """Pool worker: read one model's draws, keeping only the columns
+    CoDCorrect needs and the envelope merge columns. Returns (draws, has
+    envelope, seconds taken)"""
+    (model_version_id, location_id, cause_id, sex_id, keep_columns,
+     filter_years, db_env) = args
+    start = time.time()
+    data = read_cod_model_draws(model_version_id, location_id, cause_id,
+                                sex_id, filter_years=filter_years,
+                                db_env=db_env)
+    has_envelope = 'envelope' in data
+    data = data.loc[:, [c for c in data.columns if c in keep_columns]]
+    return data, has_envelope, time.time() - start
+
+
+def default_n_workers():
+    """Number of read processes to use when none is given: the slots
+    reserved for the job (NSLOTS, set by the scheduler), or the cores on the
+    node outside of a scheduled job"""
+    try:
+        return max(1, int(os.environ['NSLOTS']))
+    except (KeyError, ValueError):
+        return cpu_count()
+
+
+def import_all_cod_model_draws(models, location_id, sex_id, required_columns,
+                               filter_years=None, db_env=None, envelope=None,
+                               n_workers=None, max_in_flight=None):
+    """Import model draws for many CODEm/custom models in parallel.
+
+    Models are read by a pool of n_workers processes. At most max_in_flight
+    reads are queued or finished-but-not-collected at any time, so memory
+    held by the pool stays bounded however many models there are. Each
+    model is trimmed to required_columns as it is read, the envelope
+    is merged once onto all models that need it, and models that fail the
+    format check are dropped, as with import_cod_model_draws.
+
+    Arguments:
+        models (list): (model_version_id, cause_id) tuples
+        location_id, sex_id: demographics to read
+        required_columns (list): columns to keep and check
+        n_workers (int): read processes. Defaults to default_n_workers()
+        max_in_flight (int): most reads outstanding at once. Defaults to
+            twice n_workers
+
+    Returns:
+        DataFrame of all models' draws, in the order of models
+    """
+    logger = logging.getLogger('io.import_all_cod_model_draws')
+    models = [(int(mvid), cause_id) for mvid, cause_id in models]
+    keep_columns = set(required_columns)
+    if envelope is not None:
+        keep_columns.update(envelope.columns)
+    tasks = [(mvid, location_id, cause_id, sex_id, keep_columns,
+              filter_years, db_env) for mvid, cause_id in models]
+    if n_workers is None:
+        n_workers = default_n_workers()
+    if max_in_flight is None:
+        max_in_flight = 2 * n_workers
+    max_in_flight = max(max_in_flight, n_workers)
+
+    with_envelope = []
+    without_envelope = []
+    timings = []
+    start = time.time()
+    pool = Pool(n_workers)
+    try:
+        pending = []
+        for i in range(len(tasks) + 1):
+            # Collect the oldest read once the window is full, or at the end
+            while pending and (len(pending) >= max_in_flight or
+                               i == len(tasks)):
+                (mvid, cause_id), result = pending.pop(0)
+                try:
+                    data, has_envelope, seconds = result.get()
+                except Exception:
+                    log_read_failure(logger, mvid, cause_id, location_id,
+                                     sex_id, filter_years)
+                    sys.exit(1)
+                logger.info("Read model_version_id {} (cause {}): {} rows "
+                            "in {:.1f}s".format(mvid, cause_id, len(data),
+                                                seconds))
+                timings.append((seconds, mvid))
+                data['_model'] = len(timings) - 1
+                if has_envelope:
+                    with_envelope.append(data)
+                else:
+                    without_envelope.append(data)
+            if i < len(tasks):
+                pending.append((models[i],
+                                pool.apply_async(_timed_read, (tasks[i],))))
+    finally:
+        pool.terminate()
+        pool.join()
+    if not timings:
+        return pd.DataFrame(columns=required_columns)
+    logger.info("Read {} models in {:.1f}s, slowest: {}".format(
+        len(timings), time.time() - start,
+        ', '.join('model_version_id {} ({:.1f}s)'.format(mvid, seconds)
+                  for seconds, mvid in sorted(timings, reverse=True)[:5])))
+
+    # Merge the envelope once, then put models back in order
+    if without_envelope:
+        without_envelope = [add_envelope(pd.concat(without_envelope),
+                                         envelope)]
+    data = pd.concat(with_envelope + without_envelope)
+    data = data.sort_values('_model', kind='mergesort').reset_index(drop=True)
+
+    # Drop models that fail the format check
+    data = data.reindex(columns=required_columns + ['_model'])
+    has_nulls = data[required_columns].isnull().any(axis=1)
+    bad_models = data.loc[has_nulls, '_model'].unique()
+    for i in bad_models:
+        logger.warn("model_version_id {} has missing columns or values, "
+                    "dropping it".format(models[i][0]))
+        print(models[i][0], False)
+    data = data.loc[~data['_model'].isin(bad_models), required_columns]
+    return data
+
+
 def add_envelope(df, env):
     if 'envelope' in df or env is None:
         return df
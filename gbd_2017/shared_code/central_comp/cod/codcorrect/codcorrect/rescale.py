@@ -0,0 +1,151 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class CauseFractionRescaler(object):
+    """Rescale cause fractions to be internally consistent with the cause
+    hierarchy, for one location-sex.
+
+    The data is held as a dense (cause x demographic x draw) array, with
+    causes ordered so that each sibling group (causes sharing a parent and a
+    level) is a contiguous block, and a precomputed vector giving the
+    position of each cause's parent. Sibling normalization is then one
+    np.add.reduceat over the cause axis, and the top-down parent
+    multiplication is one fancy-indexed product per level, instead of a
+    groupby-sum + merge per step.
+
+    Cells for causes with no row in a demographic are tracked with a mask and
+    are not part of the output, so results match the row-based rescale: a
+    child row is dropped if its parent has no row in that demographic.
+    """
+
+    def __init__(self, data, index_columns, data_columns,
+                 cause_column='cause_id', parent_cause_column='parent_id',
+                 level_column='level'):
+        """
+        Args:
+            data (DataFrame): cause fractions, with index_columns,
+                parent_cause_column, level_column and data_columns. Rows
+                with a null parent or level are left out, as in a groupby
+            index_columns (list): id columns, including cause_column. Must
+                uniquely identify rows
+            data_columns (list): draw columns
+        """
+        self.index_columns = index_columns
+        self.data_columns = data_columns
+        self.cause_column = cause_column
+        self.parent_cause_column = parent_cause_column
+        self.level_column = level_column
+        self.demographic_columns = [c for c in index_columns
+                                    if c != cause_column]
+
+        data = data.dropna(subset=[parent_cause_column, level_column])
+        id_columns = index_columns + [parent_cause_column, level_column]
+        self.columns = [c for c in data.columns
+                        if c in id_columns + data_columns]
+        self.ids = data[id_columns].reset_index(drop=True)
+
+        # Cause axis, ordered by sibling group
+        causes = self.ids[[cause_column, parent_cause_column, level_column]]
+        causes = causes.drop_duplicates()
+        if causes[cause_column].duplicated().any():
+            raise ValueError("Each {} must have a single {} and {}".format(
+                cause_column, parent_cause_column, level_column))
+        causes = causes.sort_values(
+            [level_column, parent_cause_column, cause_column]
+        ).reset_index(drop=True)
+        self.causes = pd.Index(causes[cause_column].values)
+        self.cause_levels = causes[level_column].values.astype(np.int64)
+        parents = causes[parent_cause_column].values
+        self.parent_index = self.causes.get_indexer(parents)
+
+        # Start of each sibling group along the cause axis
+        new_group = np.ones(len(causes), dtype=bool)
+        new_group[1:] = ((parents[1:] != parents[:-1]) |
+                         (self.cause_levels[1:] != self.cause_levels[:-1]))
+        self.group_starts = np.flatnonzero(new_group)
+        self.cause_group = np.cumsum(new_group) - 1
+
+        # Demographic axis
+        if self.demographic_columns:
+            self.demographic_codes = self.ids.groupby(
+                self.demographic_columns, sort=False).ngroup().values
+        else:
+            self.demographic_codes = np.zeros(len(self.ids), dtype=np.int64)
+        self.cause_codes = self.causes.get_indexer(
+            self.ids[cause_column].values)
+        n_demographics = (self.demographic_codes.max() + 1
+                          if len(self.ids) else 0)
+
+        shape = (len(self.causes), n_demographics, len(data_columns))
+        logger.debug("Rescaling a {} cause fraction array".format(shape))
+        self.present = np.zeros(shape[:2], dtype=bool)
+        self.present[self.cause_codes, self.demographic_codes] = True
+        self.values = np.zeros(shape)
+        self.values[self.cause_codes, self.demographic_codes] = (
+            data[data_columns].values)
+
+    def _normalize_siblings(self, fill_value=None):
+        """Divide each cell by its sibling group total. If fill_value is
+        given, cells that come out null are set to it"""
+        totals = np.add.reduceat(self.values, self.group_starts, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.values /= totals[self.cause_group]
+        if fill_value is not None:
+            self.values[np.isnan(self.values) &
+                        self.present[:, :, np.newaxis]] = fill_value
+        self.values[~self.present] = 0
+
+    def rescale_siblings(self):
+        """Rescale to 1 within each group of siblings in a demographic.
+
+        NOTE: the intermediate totals CANNOT be 0 or else this can cause
+              problems multiplying down the hierarchy later. Groups with a 0
+              total are made equal across siblings and then rescaled.
+        """
+        if len(self.causes):
+            self._normalize_siblings(fill_value=1)
+            self._normalize_siblings()
+
+    def rescale_to_parents(self):
+        """Run down the hierarchy one level at a time, multiplying each
+        child by its (already rescaled) parent. Children whose parent has no
+        row in a demographic are dropped"""
+        if not len(self.causes):
+            return
+        for level in range(self.cause_levels.min() + 1,
+                           self.cause_levels.max() + 1):
+            children = np.flatnonzero(self.cause_levels == level)
+            parents = self.parent_index[children]
+            orphans = children[parents < 0]
+            self.present[orphans] = False
+            self.values[orphans] = 0
+            children = children[parents >= 0]
+            parents = parents[parents >= 0]
+            self.present[children] &= self.present[parents]
+            self.values[children] *= self.values[parents]
+
+    def rescale(self):
+        """Rescale siblings to 1, then propagate parents down the
+        hierarchy"""
+        self.rescale_siblings()
+        self.rescale_to_parents()
+        return self
+
+    def get_data(self):
+        """Return the rescaled rows, ordered by level, as a DataFrame of
+        index_columns, parent, level and data_columns in their input order"""
+        keep = self.present[self.cause_codes, self.demographic_codes]
+        rows = np.flatnonzero(keep)
+        levels = self.cause_levels[self.cause_codes[rows]]
+        rows = rows[np.argsort(levels, kind='mergesort')]
+        values = self.values[self.cause_codes[rows],
+                             self.demographic_codes[rows]]
+        return pd.concat(
+            [self.ids.iloc[rows].reset_index(drop=True),
+             pd.DataFrame(values, columns=self.data_columns)],
+            axis=1)[self.columns]
@@ -1,14 +1,16 @@
 import sys
 
+import numpy as np
 import pandas as pd
 import logging
 import argparse
 
 from codcorrect.core import Envelope, read_json
-from codcorrect.io import (import_cod_model_draws, read_envelope_draws,
+from codcorrect.io import (import_all_cod_model_draws, read_envelope_draws,
                            save_hdf)
 from codcorrect.error_check import tag_zeros, check_data_format
 from codcorrect.error_check import missing_check, exclusivity_check
+from codcorrect.rescale import CauseFractionRescaler
 from codcorrect.restrictions import expand_id_set
 import codcorrect.log_utilities as cc_log_utils
 
@@ -92,25 +94,21 @@ def read_helper_files(parent_dir, location_id, sex_id):
 
 
 def read_all_model_draws(best_models, required_columns, filter_years=None,
-                         env_df=None):
-    """Reads in all CODEm models for a specific sex and location_id. Also logs
-    which models it couldn't open.
+                         env_df=None, n_workers=None):
+    """Reads in all CODEm models for a specific sex and location_id, several
+    at a time. Also logs how long each model took to read and which models it
+    couldn't open. n_workers defaults to the slots reserved for the job.
 
     Returns:
         a DataFrame with the CODEm draws
     """
     # Read in best models
-    data = []
-    for i in best_models.index:
-        model_version_id = int(best_models.loc[i, 'model_version_id'])
-        cause_id = best_models.loc[i, 'cause_id']
-        temp_data = import_cod_model_draws(model_version_id, location_id,
-                                           cause_id, sex_id,
-                                           required_columns,
-                                           filter_years=filter_years,
-                                           envelope=env_df)
-        data.append(temp_data)
-    data = pd.concat(data)
+    models = list(zip(best_models['model_version_id'],
+                      best_models['cause_id']))
+    data = import_all_cod_model_draws(models, location_id, sex_id,
+                                      required_columns,
+                                      filter_years=filter_years,
+                                      envelope=env_df, n_workers=n_workers)
 
     # DataFrame shouldn't be empty
     logger = logging.getLogger('correct.read_all_model_draws')
@@ -181,9 +179,12 @@ def format_for_rescale(data, eligible_data, index_columns, data_columns,
         # Keep just the variables we need
         data = data.loc[:, index_columns + [envelope_column] + data_columns]
         # Convert to cause fractions
-        for data_column in data_columns:
-            data[data_column] = (data[data_column] / data[envelope_column])
-            data[data_column] = data[data_column].fillna(0)
+        cause_fractions = (data[data_columns].values /
+                           data[[envelope_column]].values)
+        cause_fractions[np.isnan(cause_fractions)] = 0
+        data = pd.concat(
+            [data[index_columns].reset_index(drop=True),
+             pd.DataFrame(cause_fractions, columns=data_columns)], axis=1)
         # Merge on hierarchy variables
         data = pd.merge(data,
                         eligible_data[index_columns + ['level', 'parent_id']],
@@ -197,78 +198,6 @@ def format_for_rescale(data, eligible_data, index_columns, data_columns,
     return data, model_data
 
 
-def rescale_group(data, groupby_columns, data_columns):
-    """Rescale column to 1
-
-    Takes a set of columns and rescales to 1 in groups defined by the groupby
-    columns.
-
-    NOTE: the intermediate total column CANNOT have a value of 0 or else this
-          can cause problems aggregating up the hierarchy later. If this
-          happens, make the all values within that group equal and resume.
-    """
-    # Make totals
-    temp = data[groupby_columns + data_columns].copy(deep=True)
-    temp = temp.groupby(groupby_columns)[data_columns].sum().reset_index()
-    rename_columns = {'{}'.format(d): '{}_total'.format(d)
-                      for d in data_columns}
-    temp = temp.rename(columns=rename_columns)
-    # Attempt to rescale
-    data = pd.merge(data, temp, on=groupby_columns)
-    for data_column in data_columns:
-        data[data_column] = (data[data_column] /
-                             data['{}_total'.format(data_column)])
-    data = data.drop(['{}_total'.format(d) for d in data_columns], axis=1)
-    # Fill in problem cells
-    data[data_columns] = data[data_columns].fillna(1)
-    # Remake totals
-    temp = data[groupby_columns + data_columns].copy(deep=True)
-    temp = temp.groupby(groupby_columns)[data_columns].sum().reset_index()
-    temp = temp.rename(columns=rename_columns)
-    # Rescale
-    data = pd.merge(data, temp, on=groupby_columns)
-    for data_column in data_columns:
-        data[data_column] = (data[data_column] /
-                             data['{}_total'.format(data_column)])
-    data = data.drop(['{}_total'.format(d) for d in data_columns], axis=1)
-    return data
-
-
-def rescale_to_parent(data, index_columns, data_columns, cause_column,
-                      parent_cause_column, level_column, level):
-    """Rescales child data to be internally consistent with parent data.
-
-    This function is called once for every level of the hierarchy.
-
-    It subsets out all data for that level, & merges on the parent cause data.
-    Then it overwrites the child adjusted values with the product of the parent
-    and child adjusted values so that the data is internally consistent.
-
-    Data MUST BE IN CAUSE FRACTION space in order for this to work.
-
-    Returns: Entire DataFrame with adjusted child data.
-    """
-    parent_keep_columns = list(set(index_columns + [cause_column] +
-                                   data_columns))
-    merge_columns = list(set(list(set(index_columns) - set([cause_column])) +
-                             [parent_cause_column]))
-    temp_child = data.loc[data[level_column] == level].copy(deep=True)
-    temp_parent = data.loc[data[cause_column].isin(
-        temp_child[parent_cause_column]
-        .drop_duplicates())].copy(deep=True)
-    temp_parent = temp_parent.loc[:, parent_keep_columns]
-    parent_rename_columns = {'cause_id': 'parent_id'}
-    for data_column in data_columns:
-        parent_rename_columns[data_column] = '{}_parent'.format(data_column)
-    temp_parent = temp_parent.rename(columns=parent_rename_columns)
-    temp_child = pd.merge(temp_child, temp_parent, on=merge_columns)
-    for data_column in data_columns:
-        temp_child[data_column] = (temp_child[data_column] *
-                                   temp_child['{}_parent'.format(data_column)])
-        temp_child.drop('{}_parent'.format(data_column), axis=1, inplace=True)
-    return pd.concat([data.loc[data['level'] != level], temp_child])
-
-
 def rescale_data(data, index_columns, data_columns, cause_column='cause_id',
                  parent_cause_column='parent_id', level_column='level'):
     """Rescales data to make it internally consistent within hierarchy.
@@ -279,40 +208,43 @@ def rescale_data(data, index_columns, data_columns, cause_column='cause_id',
     Then runs down cause hierarchy and rescales each level according to the
     parent.
 
+    Data MUST BE IN CAUSE FRACTION space in order for this to work.
+
     Returns a scaled DataFrame
     """
-    # Rescale
-    data = rescale_group(data,
-                         list(set(index_columns) - set([cause_column])) +
-                         [parent_cause_column, level_column],
-                         data_columns)
-    # Propagate down levels
-    for level in (range(data[level_column].min() +
-                        1, data[level_column].max() + 1)):
-        data = rescale_to_parent(data, index_columns, data_columns,
-                                 cause_column, parent_cause_column,
-                                 level_column, level)
-    return data
+    rescaler = CauseFractionRescaler(data, index_columns, data_columns,
+                                     cause_column=cause_column,
+                                     parent_cause_column=parent_cause_column,
+                                     level_column=level_column)
+    return rescaler.rescale().get_data()
 
 
 def convert_to_deaths(data, data_columns, envelope):
     """Multiplies death draws by envelope."""
     logger = logging.getLogger('correct.convert_to_deaths')
     try:
-        # Merge on envelope data
+        # Match each row to its envelope row
         envelope_data = envelope.data
-        envelope_data = envelope_data[envelope.index_columns + data_columns]
-        rename_columns = {d: '{}_env'.format(d) for d in data_columns}
-        envelope_data = envelope_data.rename(columns=rename_columns)
-        data = pd.merge(data, envelope_data,
-                        on=envelope.index_columns,
-                        how='left')
-        # Convert to death space
-        for data_column in data_columns:
-            data[data_column] = (data[data_column] *
-                                 data['{}_env'.format(data_column)])
-        # Drop old columns
-        data = data.drop(['{}_env'.format(d) for d in data_columns], axis=1)
+        rows = pd.merge(
+            data[envelope.index_columns].assign(_row=np.arange(len(data))),
+            envelope_data[envelope.index_columns].assign(
+                _env=np.arange(len(envelope_data))),
+            on=envelope.index_columns,
+            how='left')
+        # Convert to death space, rows with no envelope become null
+        envelope_draws = np.vstack(
+            [envelope_data[data_columns].values.astype(float),
+             np.full((1, len(data_columns)), np.nan)])
+        env_rows = rows['_env'].fillna(-1).values.astype(np.int64)
+        deaths = (data[data_columns].values[rows['_row'].values] *
+                  envelope_draws[env_rows])
+        columns = list(data.columns)
+        other_columns = [c for c in columns if c not in data_columns]
+        data = pd.concat(
+            [data[other_columns].iloc[rows['_row'].values]
+             .reset_index(drop=True),
+             pd.DataFrame(deaths, columns=data_columns)], axis=1)
+        data = data[columns]
 
     except Exception as e:
         logger.exception('Failed to convert to death space: {}'.format(e))
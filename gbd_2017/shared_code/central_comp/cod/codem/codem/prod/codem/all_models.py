@@ -1,4 +1,5 @@
 import space_time_smoothing as space
+import spacetime as ST
 import numpy as np
 import pandas as pd
 import multiprocessing as mp
@@ -30,10 +31,12 @@ class All_Models:
                         lambda_no_data, zeta, zeta_no_data):
         tempAge = sorted(list(df.age.unique()))
         df["ageC"] = np.array([tempAge.index(x) for x in list(df.age)])
+        location_index = ST.LocationIndex(df)
         for i in range(len(self.all_models)):
             self.all_models[i].spacetime_predictions(df, knockouts[i], omega,
                                                      lambda_data, lambda_no_data,
-                                                     zeta, zeta_no_data)
+                                                     zeta, zeta_no_data,
+                                                     location_index)
 
     def reset_residuals(self, df, knockouts, response_list):
         '''
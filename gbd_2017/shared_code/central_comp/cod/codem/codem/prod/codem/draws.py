@@ -4,6 +4,7 @@ from pymc import gp
 from numexpr import evaluate as EV
 import multiprocessing as mp
 import re
+import gpr_smooth as gpr
 
 
 def adjust_predictions(matrix, linear_floor, df_sub, response):
@@ -134,70 +135,18 @@ def gpr_draws_map(inputs):
     return new_gpr_draws(ko_gpr_data, df, ca_df, draws)
 
 
-def new_gpr_draws(df2, response, amplitude, prior, scale, has_data, draws):
+def new_ko_gpr_draws(df, ko, amplitude, preds, variance, response_list, scale, draws):
     '''
-    (data frame, str, float, data frame, int, int) -> array
+    (data frame, data frame, dict, array, series, list of str, float, list)
+        -> array
 
-    Using the input parameters given above runs an instance of gaussian process
-    smoothing in order to account for years where we do not have data. The data
-    frame (df2) is specific to a location-age.
+    Makes GPR draws for one knockout pattern, draws[i] draws for each
+    response i, with the batched GPR engine in gpr_smooth.
     '''
-    all_indices = df2.index
-    data_indices = df2[(df2.ix[:, -4])].index
-    years = df2.loc[all_indices]["year"].values
-    data = pd.DataFrame({"year": years, "prior": prior})
-    data.sort_values("year", inplace=True)
-    data.drop_duplicates(inplace=True)
-
-    def mean_function(x):
-        return np.interp(x, data.year.values, data.prior.values)
-    M = gp.Mean(mean_function)
-    C = gp.Covariance(eval_fun=gp.matern.euclidean, diff_degree=2,
-                      amp=amplitude, scale=scale)
-    df4 = df2.loc[data_indices]
-    if has_data:
-        gp.observe(M=M, C=C, obs_mesh=df4.year.values,
-                   obs_vals=df4[response].values,
-                   obs_V=(df4[response + "_sd"].values)**2 +
-                   df4[response + "_nsv"].values)
-    ca_draws = np.array([gp.Realization(M, C)(years) for d in range(draws)]).T
-    return ca_draws
-
-
-def age_group_gpr_draw(ca_df, age_amplitude, preds, response_list, scale, draws):
-    has_data = ca_df.ix[:, -4].sum() > 0
-    var_type = ca_df.variance_type.values[0]
-    preds = np.hstack([new_gpr_draws(ca_df, response_list[i],
-                                     age_amplitude[var_type][i], preds[:, i],
-                                     scale, has_data, draws[i])
-                       for i in range(len(draws)) if draws[i] != 0])
-    return preds
-
-
-def age_group_gpr_draw_map(inputs):
-    ca_df, age_amplitude, preds, response_list, scale, draws = inputs
-    return age_group_gpr_draw(ca_df, age_amplitude, preds, response_list, scale, draws)
-
-
-def new_ko_gpr_draws(df, ko, amplitude, preds, variance, response_list, scale, draws):
     df2 = pd.concat([df, ko, variance], axis=1)
-    random_draws = np.zeros((len(df2), sum(draws))).astype("float32")
     ca_df = df2.loc[ko.ix[:, 2], ["location_id", "age"]].drop_duplicates()
-    inputs = [{"df": df2.loc[(df2.age == ca_df.age[i]) &
-                             (df2.location_id == ca_df.location_id[i])],
-               "age": ca_df.age[i], "loc": ca_df.location_id[i]}
-              for i in ca_df.index.values]
-    inputs = [(inputs[i]["df"], amplitude[inputs[i]["age"]],
-               preds[inputs[i]["df"].index.values, :],
-               response_list, scale, draws)
-              for i in range(len(inputs))]
-    p = mp.Pool(30)
-    new_draws = p.map(age_group_gpr_draw_map, inputs)
-    p.close()
-    p.join()
-    for i in range(len(new_draws)):
-        random_draws[inputs[i][0].index.values, :] = new_draws[i]
-    return random_draws
+    return gpr.batched_gpr(df2, ca_df, amplitude, preds, response_list,
+                           scale, draws=draws)
 
 
 def new_ko_gpr_draw_map(inputs):
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 from model_list import Model_List
 from model import Model
+from spacetime import LocationIndex
 import multiprocessing as mp
 import json
 
@@ -220,13 +221,15 @@ def apply_smoothing(list_of_model_lists, df, ko_all, omega_age_smooth,
     '''
     tempAge = list(df.age.unique())
     df["ageC"] = np.array([tempAge.index(x) for x in list(df.age)])
+    location_index = LocationIndex(df)
     for i in range(len(list_of_model_lists)):
         list_of_model_lists[i].spacetime_predictions(df, ko_all[i],
                                                      omega_age_smooth,
                                                      lambda_time_smooth,
                                                      lambda_time_smooth_nodata,
                                                      zeta_space_smooth,
-                                                     zeta_space_smooth_nodata)
+                                                     zeta_space_smooth_nodata,
+                                                     location_index)
     return None
 
 
@@ -3,83 +3,51 @@ import numpy as np
 from numexpr import evaluate as EV
 
 
-def cartesian(arrays, out=None):
-    '''
-    (list of array_like, array) -> array
-
-    2-D array of shape (M, len(arrays)) containing cartesian products formed of
-    input arrays.
-    '''
-
-    arrays = [np.asarray(x) for x in arrays]
-    dtype = arrays[0].dtype
-
-    n = np.prod([x.size for x in arrays])
-    if out is None:
-        out = np.zeros([n, len(arrays)], dtype=dtype)
-
-    m = n / arrays[0].size
-    out[:, 0] = np.repeat(arrays[0], m)
-    if arrays[1:]:
-        cartesian(arrays[1:], out=out[0:m, 1:])
-        for j in xrange(1, arrays[0].size):
-            out[j * m:(j + 1) * m, 1:] = out[0:m, 1:]
-    return out
-
-
-def year_trend_rmse(unit_df, ln_predictions, year, adjacent_years):
-    '''
-    (data frame, array, float, list of int) -> array
-
-    For a given year and all adjacent years finds the RMSE of the slopes
-    between years referred to as the trend. An array with a number of columns
-    equal to the number of models in a given knockout. The unit data frame
-    (unit_df) refers to a data frame for a specific location age.
-    '''
-    errors = np.vstack([slope_rmse(unit_df, ln_predictions, year, y2)
-                        for y2 in adjacent_years])
-    return errors
-
-
-def slope_rmse(unit_df, ln_predictions, year1, year2):
-    '''
-    (data frame, array, float, float) -> array
-
-    Given a location age data frame (unit_df) and two years finds the slope
-    between the two years in log rate space and compares the expected to the
-    observed values to generate a trend RMSE. The number of columns corresponds
-    to the number of models for a given knockout while the rows correspond to
-    the unique pair combination of data points for each year (year1 & year2).
-    '''
-    year1_df = unit_df[(unit_df.year == year1)]
-    year2_df = unit_df[(unit_df.year == year2)]
-    diffs = cartesian([year1_df.index.values, year2_df.index.values])
-    obs_change = np.array([year2_df.loc[y[1], "ln_rate"] -
-                           year1_df.loc[y[0], "ln_rate"] for y in diffs])
-    obs_slope = obs_change / float(year2 - year1)
-    est_change = np.array([ln_predictions[y[1], :] - ln_predictions[y[0], :]
-                           for y in diffs])
-    est_slope = est_change / float(year2 - year1)
-    return (est_slope - obs_slope[..., np.newaxis])**2
-
-
-def country_age_trend(unit_df, window, ln_predictions):
-    '''
-    (data frame, float, array) -> array
-
-    Get the trend errors for a given country age. If no data within the window
-    exists return an array of NaNs that we will get rid of later.
-    '''
-    years = sorted(unit_df.year.unique())
-    adjacent_years = [[year + i + 1 for i in range(window)
-                       if year + i + 1 in years] for year in years]
-    if any([len(a) > 0 for a in adjacent_years]):
-        errors = np.vstack([year_trend_rmse(unit_df, ln_predictions,
-                                            years[i], adjacent_years[i]) for i
-                            in range(len(years)) if len(adjacent_years[i]) > 0])
-    else:
-        errors = np.array([np.nan for x in range(ln_predictions.shape[1])])
-    return errors
+def trend_pairs(df, window):
+    '''
+    (data frame, int) -> (array, array, array, array)
+
+    Find every pair of data points in a data frame that are from the same
+    location age and are between 1 and window years apart. Returns the index
+    of the earlier and of the later point of each pair, the number of years
+    between them, and the observed slope between them in log rate space. The
+    pairs only depend on the data, so for a knockout pattern they are found
+    once and then used to get the trend of every model.
+    '''
+    points = df[["location_id", "age", "year", "ln_rate"]].copy()
+    points["row"] = df.index.values
+    first, second, years_apart = [], [], []
+    for gap in range(1, window + 1):
+        later = points.copy()
+        later["year"] = later["year"] - gap
+        pairs = points.merge(later, on=["location_id", "age", "year"],
+                             suffixes=("_1", "_2"))
+        first.append(pairs.row_1.values)
+        second.append(pairs.row_2.values)
+        years_apart.append(np.repeat(float(gap), len(pairs)))
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+    years_apart = np.concatenate(years_apart)
+    obs_slope = (df.loc[second, "ln_rate"].values -
+                 df.loc[first, "ln_rate"].values) / years_apart
+    return first, second, years_apart, obs_slope
+
+
+def pair_trend_rmse(pairs, ln_predictions):
+    '''
+    (tuple of arrays, array) -> array
+
+    Given the pairs of data points found by trend_pairs compares the expected
+    to the observed slope of every pair for all models at once. Pairs with a
+    missing value for any model are dropped. Returns the RMSE of trend in an
+    array of length equal to the number of columns of ln_predictions.
+    '''
+    first, second, years_apart, obs_slope = pairs
+    est_slope = ((ln_predictions[second, :] - ln_predictions[first, :]) /
+                 years_apart[..., np.newaxis])
+    errors = (est_slope - obs_slope[..., np.newaxis])**2
+    errors = errors[~np.isnan(errors).any(axis=1)]
+    return (errors.sum(0) / float(len(errors)))**.5
 
 
 def ko_rmse_out(df, ko, pred_mat):
@@ -116,18 +84,8 @@ def ko_trend_out(df, ko, pred_mat, window):
     the results in an array that is of length equal to the number of models
     present for a single knockout.
     '''
-    df2 = df[ko.ix[:, 1]]
-    locations = df2.location_id.unique()
-    ages = df2.age.unique()
-    trend = []
-    for age in ages:
-        for location in locations:
-            unit_df = df2[(df2.location_id == location) & (df2.age == age)]
-            if len(unit_df) > 1:
-                trend += [country_age_trend(unit_df, window, pred_mat)]
-    trend = np.vstack(trend)
-    trend = trend[~np.isnan(trend).any(axis=1)]
-    return (trend.sum(0) / float(len(trend)))**.5
+    pairs = trend_pairs(df[ko.ix[:, 1]], window)
+    return pair_trend_rmse(pairs, pred_mat)
 
 
 def trend_out_map(inputs):
@@ -169,14 +127,13 @@ def trend_out(list_of_model_lists, data_frame, knockouts, window):
     Calculate the trend of all models across al knockout patterns and average
     the results to be used for ranking at a later time. An array of length
     equal to the number of models in a single instance of class model_list
-    is returned with the mean trend.
+    is returned with the mean trend. Each knockout is a handful of array
+    operations so they are run in process rather than sending the data frame
+    and predictions to a pool.
     '''
-    inputs = [(data_frame, knockouts[i], list_of_model_lists[i].pred_mat,
-               window) for i in range(len(knockouts) - 1)]
-    p = mp.Pool(20)
-    trend_all = np.array(p.map(trend_out_map, inputs))
-    p.close()
-    p.join()
+    trend_all = np.array([ko_trend_out(data_frame, knockouts[i],
+                                       list_of_model_lists[i].pred_mat, window)
+                          for i in range(len(knockouts) - 1)])
     return np.median(trend_all, axis=0)
 
 
@@ -188,12 +145,13 @@ def single_coverage_out(draw_preds, df, ln_rate_nsv, ko_vector):
     :return:
     '''
 
+    ln_rate = df.ln_rate.values[ko_vector]
+    draw_preds = draw_preds[ko_vector]
     mean_draw = draw_preds.mean(axis=1)
     std_draw = draw_preds.std(axis=1)
-    var = 1.96 * np.sqrt(df.ln_rate_sd**2 + ln_rate_nsv
-                         + std_draw**2)
-    values = (df.ln_rate <= mean_draw + var) & (df.ln_rate >= mean_draw - var)
-    values = values[ko_vector]
+    var = 1.96 * np.sqrt(df.ln_rate_sd.values[ko_vector]**2 +
+                         ln_rate_nsv[ko_vector] + std_draw**2)
+    values = (ln_rate <= mean_draw + var) & (ln_rate >= mean_draw - var)
     return values.sum() / float(len(values))
 
 
@@ -258,16 +216,5 @@ def trend_in(df, ko, pred_vec, window):
     the results in an array that is of length equal to the number of models
     present for a single knockout.
     '''
-    df2 = df[ko]
-    pred_vec = pred_vec[:, np.newaxis]
-    locations = df2.location_id.unique()
-    ages = df2.age.unique()
-    trend = []
-    for age in ages:
-        for location in locations:
-            unit_df = df2[(df2.location_id == location) & (df2.age == age)]
-            if len(unit_df) > 1:
-                trend += [country_age_trend(unit_df, window, pred_vec)]
-    trend = np.vstack(trend)
-    trend = trend[~np.isnan(trend).any(axis=1)]
-    return (trend.sum(0) / float(len(trend)))**.5
+    pairs = trend_pairs(df[ko], window)
+    return pair_trend_rmse(pairs, pred_vec[:, np.newaxis])
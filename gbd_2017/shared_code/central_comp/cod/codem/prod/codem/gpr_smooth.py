@@ -2,7 +2,7 @@ import pandas as pd
 import multiprocessing as mp
 import numpy as np
 import re
-from pymc import gp
+from scipy.special import gamma, kv
 pd.set_option('chained', None)
 
 
@@ -67,33 +67,127 @@ def variance_map(inputs):
     return find_variance_type(df, ko)
 
 
-def gpr(df2, response, amplitude, prior, scale, has_data):
+def matern(x, y, amp, scale, diff_degree=2.):
     '''
-    (data frame, str, float, data frame, int, int) -> array
+    (array, array, float, float, float) -> array
 
-    Using the input parameters given above runs an instance of gaussian process
-    smoothing in order to account for years where we do not have data. The data
-    frame (df2) is specific to a location-age.
+    Matern covariance between every point of x and every point of y, with the
+    same parametrization as pymc's gp.matern.euclidean.
     '''
-    all_indices = df2.index
-    data_indices = df2[(df2.ix[:, -4])].index
-    years = df2.loc[all_indices]["year"].values
-    data = pd.DataFrame({"year": years, "prior": prior})
-    data.sort_values("year", inplace=True)
-    data.drop_duplicates(inplace=True)
+    t = np.abs(np.subtract.outer(x, y)).astype(float) / scale
+    arg = 2. * np.sqrt(diff_degree) * t
+    with np.errstate(invalid="ignore"):
+        cov = (0.5**(diff_degree - 1.) / gamma(diff_degree) *
+               arg**diff_degree * kv(diff_degree, arg))
+    cov[t == 0] = 1.
+    return cov * amp**2
 
-    def mean_function(x):
-        return np.interp(x, data.year.values, data.prior.values)
-    M = gp.Mean(mean_function)
-    C = gp.Covariance(eval_fun=gp.matern.euclidean, diff_degree=2,
-                      amp=amplitude, scale=scale)
-    df4 = df2.loc[data_indices]
-    if has_data:
-        gp.observe(M=M, C=C, obs_mesh=df4.year.values,
-                   obs_vals=df4[response].values,
-                   obs_V=(df4[response + "_sd"].values)**2 +
-                   df4[response + "_nsv"].values)
-    return M(df2.year.values)
+
+def gpr_batch(years, priors, obs_index, obs_vals, obs_var, amplitude, scale,
+              draws=0):
+    '''
+    (array, array, array, array, array, float, float, int) -> (array, array)
+
+    Gaussian process smoothing for a batch of location-ages that share the
+    same years, years of data and Matern parameters. The prior covariance is
+    built once for the batch, each location-age's observation covariance is
+    factored once in a single batched Cholesky, and both the predictions and
+    the draws come from that factorization.
+
+    years is the (n,) sorted array of years to predict, priors the (g, n)
+    prior means of the g location-ages, obs_index the (k,) positions in years
+    of the data points, and obs_vals and obs_var the (g, k) data and data
+    variance. Returns the (g, n) posterior means and (g, n, draws) draws.
+    '''
+    cov = matern(years, years, amplitude, scale)
+    mean = priors.astype(float)
+    if len(obs_index):
+        k = len(obs_index)
+        obs_cov = cov[np.ix_(obs_index, obs_index)]
+        cross_cov = cov[obs_index, :]
+        system = obs_cov + obs_var[:, :, np.newaxis] * np.eye(k)
+        try:
+            chol = np.linalg.cholesky(system)
+        except np.linalg.LinAlgError:
+            chol = np.linalg.cholesky(system + 1e-8 * amplitude**2 * np.eye(k))
+        inv_chol = np.linalg.inv(chol)
+        weights = np.matmul(inv_chol, cross_cov)
+        resid = np.einsum("gij,gj->gi", inv_chol, obs_vals - mean[:, obs_index])
+        mean = mean + np.einsum("gkn,gk->gn", weights, resid)
+        cov = cov - np.matmul(weights.transpose(0, 2, 1), weights)
+    else:
+        cov = cov[np.newaxis]
+    if not draws:
+        return mean, None
+    eigval, eigvec = np.linalg.eigh(cov)
+    root = eigvec * np.sqrt(np.clip(eigval, 0, None))[:, np.newaxis, :]
+    noise = np.random.normal(size=(len(mean), len(years), draws))
+    return mean, mean[:, :, np.newaxis] + np.matmul(root, noise)
+
+
+def batched_gpr(df2, ca_df, amplitude, preds, response_list, scale,
+                draws=None):
+    '''
+    (data frame, data frame, dict, array, list of str, float, list of int)
+        -> array
+
+    Runs GPR for every location-age in ca_df, given a data frame (df2) with
+    the data, knockout and variance type for a single knockout pattern.
+    Location-ages are grouped by their years, years of data, variance type and
+    age so that each group is smoothed with one call to gpr_batch. Returns the
+    smoothed predictions, one column per response, or if draws is given,
+    draws[i] columns of draws for each response i.
+    '''
+    train_var = [c for c in df2.columns if re.search(r"ko[0-9]+_train", c)][0]
+    labels = df2.index.values
+    year = df2.year.values
+    train = df2[train_var].values.astype(bool)
+    var_type = df2.variance_type.values
+    rows = df2.reset_index(drop=True).reset_index().merge(
+        ca_df, on=["location_id", "age"]).groupby(
+        ["location_id", "age"])["index"].apply(np.asarray)
+
+    # Group location-ages with the same years and years of data
+    groups = {}
+    for (location, age), pos in rows.iteritems():
+        years, first, inverse = np.unique(year[pos], return_index=True,
+                                          return_inverse=True)
+        obs = pos[train[pos]]
+        obs = obs[np.argsort(year[obs], kind="mergesort")]
+        key = (age, var_type[pos[0]], tuple(years), tuple(year[obs]))
+        groups.setdefault(key, []).append((pos, pos[first], inverse, obs))
+
+    if draws is None:
+        out = np.zeros(preds.shape).astype("float32")
+    else:
+        out = np.zeros((len(df2), sum(draws))).astype("float32")
+    start = 0
+    for i, response in enumerate(response_list):
+        n_draws = draws[i] if draws is not None else 0
+        if draws is not None and n_draws == 0:
+            continue
+        obs_var_all = df2[response + "_sd"].values**2 + \
+            df2[response + "_nsv"].values
+        for (age, vtype, years, obs_years), members in groups.items():
+            years = np.array(years)
+            obs_index = np.searchsorted(years, obs_years)
+            priors = np.array([preds[labels[first], i]
+                               for _, first, _, _ in members])
+            obs_vals = np.array([df2[response].values[obs]
+                                 for _, _, _, obs in members])
+            obs_var = np.array([obs_var_all[obs] for _, _, _, obs in members])
+            mean, realizations = gpr_batch(
+                years, priors, obs_index, obs_vals.reshape(len(members), -1),
+                obs_var.reshape(len(members), -1), amplitude[age][vtype][i],
+                scale, n_draws)
+            for j, (pos, _, inverse, _) in enumerate(members):
+                if draws is None:
+                    out[labels[pos], i] = mean[j, inverse]
+                else:
+                    out[labels[pos], start:start + n_draws] = \
+                        realizations[j, inverse, :]
+        start += n_draws
+    return out
 
 
 def calculate_nsv(df, ko, simple_ln, simple_lt, residuals, variance):
@@ -161,44 +255,18 @@ def nsv_map(inputs):
 
 
 def new_gpr(df, ko, amplitude, preds, variance, response_list, scale, parallel):
+    '''
+    (data frame, data frame, dict, array, series, list of str, float, bool)
+        -> array
+
+    Smooths the space-time predictions for one knockout pattern with GPR.
+    All location-ages are smoothed in process with batched_gpr, so parallel
+    is no longer used.
+    '''
     df2 = pd.concat([df, ko, variance], axis=1)
-    gp_smooth = np.zeros(preds.shape).astype("float32")
     ca_df = df2.loc[(ko.ix[:, 1]) | (ko.ix[:, 2]),
                     ["location_id", "age"]].drop_duplicates()
-    inputs = [{"df": df2.loc[(df2.age == ca_df.age[i]) &
-                             (df2.location_id == ca_df.location_id[i])],
-               "age": ca_df.age[i], "loc": ca_df.location_id[i]}
-              for i in ca_df.index.values]
-    inputs = [(inputs[i]["df"], amplitude[inputs[i]["age"]],
-               preds[inputs[i]["df"].index.values, :], response_list, scale)
-              for i in range(len(inputs))]
-    if parallel:
-        p = mp.Pool(30)
-        new_preds = p.map(age_group_gpr_map, inputs)
-        p.close()
-        p.join()
-    else:
-        new_preds = map(age_group_gpr_map, inputs)
-    for i in range(len(new_preds)):
-        gp_smooth[inputs[i][0].index.values, :] = new_preds[i]
-    return gp_smooth
-
-
-def age_group_gpr_map(inputs):
-    ca_df, age_amplitude, preds, response_list, scale = inputs
-    return age_group_gpr(ca_df, age_amplitude, preds, response_list, scale)
-
-
-def age_group_gpr(ca_df, age_amplitude, preds, response_list, scale):
-    train_var = filter(lambda x: re.search(
-        r"ko[0-9]+_train", x), ca_df.columns)[0]
-    has_data = ca_df[train_var].sum() > 0
-    new_pred = np.zeros(preds.shape).astype("float32")
-    var_type = ca_df.variance_type.values[0]
-    for i in range(len(response_list)):
-        new_pred[:, i] = gpr(ca_df, response_list[i], age_amplitude[var_type][i],
-                             preds[:, i], scale, has_data)
-    return new_pred
+    return batched_gpr(df2, ca_df, amplitude, preds, response_list, scale)
 
 
 def new_gpr_map(inputs):
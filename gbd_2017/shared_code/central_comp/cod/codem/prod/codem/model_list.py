@@ -63,7 +63,7 @@ class Model_List:
 
     def single_st(self, indices, sReg, df, ko, omega_age_smooth, lambda_time_smooth,
                   lambda_time_smooth_nodata, zeta_space_smooth,
-                  zeta_space_smooth_nodata):
+                  zeta_space_smooth_nodata, location_index=None):
         '''
 
         Applies a single instance of spacetime weighting for a single super
@@ -73,7 +73,7 @@ class Model_List:
         pos = self.super_region_positions(indices, sReg, df, ko)
         st = ST.spacetime(indices, sReg, df, ko, omega_age_smooth, lambda_time_smooth,
                           lambda_time_smooth_nodata, zeta_space_smooth,
-                          zeta_space_smooth_nodata)
+                          zeta_space_smooth_nodata, location_index)
         residuals = self.res_mat[pos["train_rows"], :]
         ln_rate_adj = df[ko.ix[:, 0]]["ln_rate"].values[pos["train_rows"]]
         new_res = np.dot(st.T, residuals)
@@ -91,12 +91,16 @@ class Model_List:
 
     def spacetime_predictions(self, df, ko, omega_age_smooth, lambda_time_smooth,
                               lambda_time_smooth_nodata, zeta_space_smooth,
-                              zeta_space_smooth_nodata):
+                              zeta_space_smooth_nodata, location_index=None):
         '''
         Applies space time to all super regions in sequence. Only regions which
         appear in the training set have spacetime smoothing applied to them.
+        The location index (ST.LocationIndex of df) can be shared between
+        knockouts so that their xi and lambda weights are reused.
         '''
         chunk_size = 5000
+        if location_index is None:
+            location_index = ST.LocationIndex(df)
         self.st_smooth_mat = np.zeros(self.pred_mat.shape).astype("float32")
         super_regions = df[ko.ix[:, 0]
                            ]["super_region"].drop_duplicates().values
@@ -111,7 +115,8 @@ class Model_List:
             for chunk_num in range(num_chunks):
                 self.single_st(indices[chunk_num], sr, df, ko, omega_age_smooth,
                                lambda_time_smooth, lambda_time_smooth_nodata,
-                               zeta_space_smooth, zeta_space_smooth_nodata)
+                               zeta_space_smooth, zeta_space_smooth_nodata,
+                               location_index)
         self.st_smooth_mat = self.pred_mat + self.st_smooth_mat
 
     def reset_residuals(self, response_list, ko, df):
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 from numexpr import evaluate as EV
@@ -16,11 +18,9 @@ def location_depth(full, train):
     had representation in the training model to the sub-national, country,
     region, super region or no representation.
     '''
-    D = {d: train[d].unique() for d in ["super_region", "region",
-                                        "country_id", "location_id"]}
     level = np.array([((full.location_id != full.country_id) &
-                       (full.location_id.map(lambda x: x in D["location_id"]))).values]
-                     + [full[d].map(lambda x: x in D[d]).values for d in
+                       (full.location_id.isin(train.location_id.unique()))).values]
+                     + [full[d].isin(train[d].unique()).values for d in
                         ["country_id", "region", "super_region"]]).astype(np.int8)
     return level.sum(axis=0)
 
@@ -47,6 +47,47 @@ def calc_xi_vec(depth, zeta_space_smooth, zeta_space_smooth_nodata):
     return xi_vec
 
 
+def xi_table(zeta_space_smooth, zeta_space_smooth_nodata):
+    '''
+    (float, float) -> array
+
+    The xi vector from calc_xi_vec for every depth from 0 to 4, as a 5 by 4
+    array so that the xi vectors of many observations can be looked up at once
+    by indexing with their depths.
+    '''
+    return np.array([calc_xi_vec(depth, zeta_space_smooth,
+                                 zeta_space_smooth_nodata)
+                     for depth in range(5)]).astype(float)
+
+
+def xi_matrix(depths, non_rep, only_non_rep, zeta_space_smooth,
+              zeta_space_smooth_nodata):
+    '''
+    (array, array, array, float, float) -> array
+
+    Given the depth of each observation, whether its location has non
+    representative data in the training set (non_rep) and whether that is
+    all of the training data for its location (only_non_rep) returns the
+    matrix of xi values described in calculate_xi_matrix.
+    '''
+    base = xi_table(zeta_space_smooth, zeta_space_smooth_nodata)[depths]
+    non_rep = non_rep.astype(float)
+    non_rep_vec = EV(
+        "zeta_space_smooth * (non_rep - non_rep * zeta_space_smooth)")
+    modify_SN = non_rep_vec * (base[:, 0] != 0).astype(int)
+    modify_C = non_rep_vec * (base[:, 0] == 0).astype(int)
+    base[:, 0] = base[:, 0] - modify_SN
+    base[:, 1] = base[:, 1] - modify_C
+    base = np.append(non_rep_vec.reshape(len(base), 1), base, 1)
+    base[only_non_rep & (depths == 3), 0] = \
+        base[only_non_rep & (depths == 3), :][:, [0, 2]].sum(axis=1)
+    base[only_non_rep & (depths == 3), 2] = 0
+    base[only_non_rep & (depths == 4), 0] = \
+        base[only_non_rep & (depths == 4), :][:, [0, 1]].sum(axis=1)
+    base[only_non_rep & (depths == 4), 1] = 0
+    return base
+
+
 def calculate_xi_matrix(full, train, zeta_space_smooth, zeta_space_smooth_nodata):
     '''
     (data frame, data frame, float, float) -> array
@@ -63,31 +104,14 @@ def calculate_xi_matrix(full, train, zeta_space_smooth, zeta_space_smooth_nodata
     representative. Each row sum should add up to 1.
     '''
     depths = location_depth(full, train)
-
-    def f(x): return calc_xi_vec(
-        x, zeta_space_smooth, zeta_space_smooth_nodata)
-    base = np.array(map(f, depths))
-    train_copy = train.set_index("location_id")
     non_rep_loc = train[train.national != 1].location_id.unique()
-    non_rep = full.location_id.map(lambda x: x in non_rep_loc)
-    non_rep_vec = EV(
-        "zeta_space_smooth * (non_rep - non_rep * zeta_space_smooth)")
+    non_rep = full.location_id.isin(non_rep_loc).values
     # keep track of the place that only have no rep data so we can give them the full location weight
     only_non_rep_loc = np.setdiff1d(
         non_rep_loc, train[train.national == 1].location_id.unique())
-    only_non_rep = full.location_id.map(lambda x: x in only_non_rep_loc)
-    modify_SN = non_rep_vec * (base[:, 0] != 0).astype(int)
-    modify_C = non_rep_vec * (base[:, 0] == 0).astype(int)
-    base[:, 0] = base[:, 0] - modify_SN
-    base[:, 1] = base[:, 1] - modify_C
-    base = np.append(non_rep_vec.reshape(len(base), 1), base, 1)
-    base[only_non_rep.values & (depths == 3), 0] = \
-        base[only_non_rep.values & (depths == 3), :][:, [0, 2]].sum(axis=1)
-    base[only_non_rep.values & (depths == 3), 2] = 0
-    base[only_non_rep.values & (depths == 4), 0] = \
-        base[only_non_rep.values & (depths == 4), :][:, [0, 1]].sum(axis=1)
-    base[only_non_rep.values & (depths == 4), 1] = 0
-    return base
+    only_non_rep = full.location_id.isin(only_non_rep_loc).values
+    return xi_matrix(depths, non_rep, only_non_rep, zeta_space_smooth,
+                     zeta_space_smooth_nodata)
 
 
 def calculate_lambda_array(full, train, lambda_time_smooth, lambda_time_smooth_nodata):
@@ -100,11 +124,83 @@ def calculate_lambda_array(full, train, lambda_time_smooth, lambda_time_smooth_n
     Returns an array of length equal to the number of rows in full with
     either lambda_time_smooth or lambda_time_smooth_nodata.
     '''
-    country = train.country_id.unique()
-    have_country_data = full.country_id.map(lambda x: x in country).astype(int)
-    lam = have_country_data.map(
-        lambda x: lambda_time_smooth**(x) * lambda_time_smooth_nodata**(1 - x))
-    return lam.values
+    have_country_data = full.country_id.isin(train.country_id.unique()).values
+    return np.where(have_country_data, lambda_time_smooth,
+                    lambda_time_smooth_nodata)
+
+
+class LocationIndex:
+    '''
+    Integer coded location hierarchy of a data frame used to look up the xi
+    matrix and lambda array of every observation for a training set. Both only
+    depend on which locations have representative and non representative
+    training data, so they are cached on that and reused by every super
+    region and chunk with the same representation. Almost all reuse is
+    within one knockout, so only the max_cached most recently used entries
+    are kept. Assumes that every location belongs to a single country,
+    region and super region.
+    '''
+    def __init__(self, df, max_cached=4):
+        self.location = pd.factorize(df.location_id)[0]
+        self.n_locations = self.location.max() + 1
+        first = np.unique(self.location, return_index=True)[1]
+        self.levels = {}
+        for d in ["country_id", "region", "super_region"]:
+            codes = pd.factorize(df[d])[0]
+            self.levels[d] = (codes, codes[first], codes.max() + 1)
+        self.sub_national = (df.location_id != df.country_id).values
+        self.national = (df.national == 1).values
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+
+    def represented(self, has_data, level):
+        '''
+        (array, str) -> array
+
+        Given a boolean array of which locations have training data returns
+        whether each observation shares the same level with any of them.
+        '''
+        codes, location_codes, n_codes = self.levels[level]
+        present = np.zeros(n_codes, dtype=bool)
+        present[location_codes[has_data]] = True
+        return present[codes]
+
+    def weights(self, train_mask, zeta_space_smooth, zeta_space_smooth_nodata,
+                lambda_time_smooth, lambda_time_smooth_nodata):
+        '''
+        (array, float, float, float, float) -> (array, array)
+
+        Given a boolean array of the rows used to train a model returns the
+        xi matrix and the lambda array for every row of the data frame, as
+        calculate_xi_matrix and calculate_lambda_array would for the rows of
+        a super region compared to the training rows of that super region.
+        '''
+        train_mask = np.asarray(train_mask, dtype=bool)
+        rep = np.bincount(self.location[train_mask & self.national],
+                          minlength=self.n_locations) > 0
+        non_rep = np.bincount(self.location[train_mask & ~self.national],
+                              minlength=self.n_locations) > 0
+        key = (rep.tobytes(), non_rep.tobytes(), zeta_space_smooth,
+               zeta_space_smooth_nodata, lambda_time_smooth,
+               lambda_time_smooth_nodata)
+        if key in self.cache:
+            # Move to the most recently used end
+            self.cache[key] = self.cache.pop(key)
+            return self.cache[key]
+
+        has_data = rep | non_rep
+        depths = (self.sub_national & has_data[self.location]).astype(int)
+        for d in ["country_id", "region", "super_region"]:
+            depths += self.represented(has_data, d)
+        xi_mat = xi_matrix(depths, non_rep[self.location],
+                           (non_rep & ~rep)[self.location],
+                           zeta_space_smooth, zeta_space_smooth_nodata)
+        lam = np.where(self.represented(has_data, "country_id"),
+                       lambda_time_smooth, lambda_time_smooth_nodata)
+        self.cache[key] = (xi_mat.astype("float32"), lam.astype("float32"))
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        return self.cache[key]
 
 
 # Weighting Functions
@@ -126,20 +222,23 @@ def makeS(full, train, var):
 
 
 def timeW(full_sub, train_sub, omega_age_smooth, lambda_time_smooth,
-          lambda_time_smooth_nodata, year_start, year_end):
+          lambda_time_smooth_nodata, year_start, year_end, lam=None):
     '''
     Gets the time age weight of a superregion given a full and training data
     set. Returns a matrix of size equal to the row size of the training data set
     by the row size of the full data set each subsetted by the super region.
     Each cell represents the age by time weight for each observation
-    (the column) for each residual (the row).
+    (the column) for each residual (the row). The lambda array is calculated
+    unless it is given (lam).
     '''
     ageS = makeS(full_sub, train_sub, "ageC").astype(
         "float32")  # make stride of age values
     yearS = makeS(full_sub, train_sub, "year").astype(
         "float32")  # stride of year values
-    l1 = calculate_lambda_array(full_sub, train_sub, lambda_time_smooth,
-                                lambda_time_smooth_nodata).astype("float32")  # assign lambda
+    if lam is None:
+        lam = calculate_lambda_array(full_sub, train_sub, lambda_time_smooth,
+                                     lambda_time_smooth_nodata)
+    l1 = lam.astype("float32")  # assign lambda
     i1 = full_sub.ageC.values.astype("float32")  # age vector
     i2 = full_sub.year.values.astype("float32")  # year vector
     aMax = np.maximum(EV("abs(i2-year_start)"),
@@ -195,7 +294,8 @@ def weight_matrix(valid_positions, xi_vector, weight_matrix):
 
 
 def spacetime(indices, sReg, df, ko, omega_age_smooth, lambda_time_smooth,
-              lambda_time_smooth_nodata, zeta_space_smooth, zeta_space_smooth_nodata):
+              lambda_time_smooth_nodata, zeta_space_smooth, zeta_space_smooth_nodata,
+              location_index=None):
     '''
     Compute the spacetime weight matrix for a super region. Full data set tells
     which values need weights, train data set are the residuals which need
@@ -205,11 +305,20 @@ def spacetime(indices, sReg, df, ko, omega_age_smooth, lambda_time_smooth,
     train_sub = df[(df.super_region == sReg) & (ko.ix[:, 0])]
     year_start = np.min(df.year)
     year_end = np.max(df.year)
+    if location_index is None:
+        xi_mat = calculate_xi_matrix(full_sub, train_sub, zeta_space_smooth,
+                                     zeta_space_smooth_nodata).astype("float32")
+        lam = None
+    else:
+        xi_mat, lam = location_index.weights(ko.ix[:, 0].values, zeta_space_smooth,
+                                             zeta_space_smooth_nodata,
+                                             lambda_time_smooth,
+                                             lambda_time_smooth_nodata)
+        xi_mat, lam = xi_mat[indices], lam[indices]
     Wat = timeW(full_sub, train_sub, omega_age_smooth, lambda_time_smooth,
-                lambda_time_smooth_nodata, year_start, year_end).astype("float32")
+                lambda_time_smooth_nodata, year_start, year_end,
+                lam).astype("float32")
     NR, SN, C, R, SR = matCRS(full_sub, train_sub)
-    xi_mat = calculate_xi_matrix(full_sub, train_sub, zeta_space_smooth,
-                                 zeta_space_smooth_nodata).astype("float32")
     NR = weight_matrix(NR, xi_mat[:, 0], Wat).astype("float32")
     SN = weight_matrix(SN, xi_mat[:, 1], Wat).astype("float32")
     C = weight_matrix(C, xi_mat[:, 2], Wat).astype("float32")
@@ -247,21 +356,32 @@ def make_2_dimensional(array):
 
 
 def spacetime2(reg, sReg, df, ko, omega_age_smooth, lambda_time_smooth,
-               lambda_time_smooth_nodata, zeta_space_smooth, zeta_space_smooth_nodata):
+               lambda_time_smooth_nodata, zeta_space_smooth, zeta_space_smooth_nodata,
+               location_index=None):
     '''
     Compute the spacetime weight matrix for a super region. Full data set tells
     which values need weights, train data set are the residuals which need
     weighting.
     '''
-    full_sub = df[(df.region == reg)]
+    full_rows = (df.region == reg).values
+    full_sub = df[full_rows]
     train_sub = df[(df.super_region == sReg) & (ko)]
     year_start = np.min(df.year)
     year_end = np.max(df.year)
+    if location_index is None:
+        xi_mat = calculate_xi_matrix(full_sub, train_sub, zeta_space_smooth,
+                                     zeta_space_smooth_nodata).astype("float32")
+        lam = None
+    else:
+        xi_mat, lam = location_index.weights(ko, zeta_space_smooth,
+                                             zeta_space_smooth_nodata,
+                                             lambda_time_smooth,
+                                             lambda_time_smooth_nodata)
+        xi_mat, lam = xi_mat[full_rows], lam[full_rows]
     Wat = timeW(full_sub, train_sub, omega_age_smooth, lambda_time_smooth,
-                lambda_time_smooth_nodata, year_start, year_end).astype("float32")
+                lambda_time_smooth_nodata, year_start, year_end,
+                lam).astype("float32")
     NR, SN, C, R, SR = matCRS(full_sub, train_sub)
-    xi_mat = calculate_xi_matrix(full_sub, train_sub, zeta_space_smooth,
-                                 zeta_space_smooth_nodata).astype("float32")
     NR = weight_matrix(NR, xi_mat[:, 0], Wat).astype("float32")
     SN = weight_matrix(SN, xi_mat[:, 1], Wat).astype("float32")
     C = weight_matrix(C, xi_mat[:, 2], Wat).astype("float32")
@@ -294,7 +414,7 @@ def super_region_positions(reg, sReg, df, ko):
 
 def single_st(reg, sReg, df, res_mat, ko, omega_age_smooth, lambda_time_smooth,
               lambda_time_smooth_nodata, zeta_space_smooth,
-              zeta_space_smooth_nodata):
+              zeta_space_smooth_nodata, location_index=None):
     '''
 
     Applies a single instance of spacetime weighting for a sing super
@@ -304,7 +424,7 @@ def single_st(reg, sReg, df, res_mat, ko, omega_age_smooth, lambda_time_smooth,
     pos = super_region_positions(reg, sReg, df, ko)
     st = spacetime2(reg, sReg, df, ko, omega_age_smooth, lambda_time_smooth,
                     lambda_time_smooth_nodata, zeta_space_smooth,
-                    zeta_space_smooth_nodata)
+                    zeta_space_smooth_nodata, location_index)
     residuals = res_mat[pos["train_rows"], :]
     return np.dot(st.T, residuals)
 
@@ -367,6 +487,7 @@ def spacetime_predictions(df, pred_mat, res_mat, ko, num_threads=1, omega_age_sm
     st_smooth_mat = np.zeros(pred_mat.shape).astype("float32")
     regions = df2[["region", "super_region"]].drop_duplicates()
     regions.reset_index(inplace=True)
+    location_index = LocationIndex(df2)
     for i in range(regions.shape[0]):
         pos = super_region_positions(
             regions["region"][i], regions["super_region"][i], df2, ko)
@@ -374,7 +495,8 @@ def spacetime_predictions(df, pred_mat, res_mat, ko, num_threads=1, omega_age_sm
             continue
         new_res = single_st(regions["region"][i], regions["super_region"][i], df2, res_mat, ko,
                             omega_age_smooth, lambda_time_smooth, lambda_time_smooth_nodata,
-                            zeta_space_smooth, zeta_space_smooth_nodata)
+                            zeta_space_smooth, zeta_space_smooth_nodata,
+                            location_index)
         st_smooth_mat[pos["full_rows"], :] = new_res
     st_smooth_mat = pred_mat + st_smooth_mat
     ne.set_num_threads(prev_num_thread)
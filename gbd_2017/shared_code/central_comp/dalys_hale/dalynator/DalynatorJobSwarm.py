@@ -26,6 +26,8 @@ import dalynator.type_checking as tp
 from dalynator.compute_dalys import ComputeDalys
 from dalynator.compute_summaries import MetricConverter
 from dalynator.constants import STDERR_PHASE_DIR_TEMPLATE
+from dalynator.constants import DRAW_FILE_EXTENSIONS, HDF_FORMAT
+from dalynator.constants import PARQUET_FORMAT
 from dalynator.data_source import GetPopulationDataSource
 from dalynator.get_yld_data import get_como_folder_structure
 from dalynator.makedirs_safely import makedirs_safely
@@ -121,6 +123,10 @@ class DalynatorJobSwarm(object):
             verbose=None,
             raise_on_paf_error=None,
             do_not_execute=None,
+            use_draw_cube=False,
+            streaming=False,
+            memory_budget_gb=None,
+            draw_file_format=HDF_FORMAT,
     ):
 
         # Input validation:
@@ -233,6 +239,14 @@ class DalynatorJobSwarm(object):
         self.do_not_execute = tp.is_boolean(
             do_not_execute, "do not execute"
         )
+        self.use_draw_cube = tp.is_boolean(use_draw_cube, "use draw cube")
+        self.streaming = tp.is_boolean(streaming, "streaming loc agg")
+        if memory_budget_gb is not None and memory_budget_gb <= 0:
+            raise ValueError("memory_budget_gb must be positive, not "
+                             "'{}'".format(memory_budget_gb))
+        self.memory_budget_gb = memory_budget_gb
+        self.draw_file_format = self._validate_draw_file_format(
+            draw_file_format)
 
         self.cache_dir = tp.is_string(cache_dir,
                                       "path to internal cache directory")
@@ -252,6 +266,23 @@ class DalynatorJobSwarm(object):
         # run (mostly for testing)
         self.success = None
 
+    def _validate_draw_file_format(self, draw_file_format):
+        """Only the burdenator's most detailed and loc_agg phases can write
+        and read Parquet draw files, pct_change still reads HDF"""
+        if draw_file_format not in DRAW_FILE_EXTENSIONS:
+            raise ValueError("draw_file_format must be one of {}, not '{}'"
+                             .format(sorted(DRAW_FILE_EXTENSIONS.keys()),
+                                     draw_file_format))
+        if draw_file_format == PARQUET_FORMAT:
+            if self.tool_name != "burdenator":
+                raise ValueError("Parquet draw files are only supported by "
+                                 "the burdenator")
+            if 'pct_change' in self.phases_to_run:
+                raise ValueError("The pct_change phase can not read Parquet "
+                                 "draw files, use --draw_file_format {} or "
+                                 "end before pct_change".format(HDF_FORMAT))
+        return draw_file_format
+
     def _post_to_slack(self, success, channel, null_inf_message, dag_id):
         headers = {'Content-type': 'application/json'}
         if success:
@@ -947,7 +978,8 @@ class DalynatorJobSwarm(object):
                         self.gbd_round_id, self.version, self.daly_version,
                         self.verbose, self.turn_off_null_and_nan_check,
                         self.no_sex_aggr, self.no_age_aggr,
-                        self.raise_on_paf_error)
+                        self.raise_on_paf_error, self.use_draw_cube,
+                        draw_file_format=self.draw_file_format)
                 elif "dalynator" in remote_program:
                     task = DalynatorMostDetailedTask(
                         self.input_data_root, self.out_dir,
@@ -990,7 +1022,10 @@ class DalynatorJobSwarm(object):
                                 self.year_n_draws_map[year_id], self.version,
                                 self.write_out_star_ids, region_locs,
                                 self.verbose, self.gbd_round_id,
-                                self.most_detailed_jobs_by_command)
+                                self.most_detailed_jobs_by_command,
+                                streaming=self.streaming,
+                                memory_budget_gb=self.memory_budget_gb,
+                                draw_file_format=self.draw_file_format)
                             self.task_dag.add_task(task)
                             self.loc_agg_jobs_by_command[task.command] = task
 
@@ -1,9 +1,8 @@
 import logging
 import time
 
-import pandas as pd
-
 from dalynator.computation_element import ComputationElement
+from dalynator.hierarchy_aggregator import HierarchyAggregator
 
 logger = logging.getLogger(__name__)
 
@@ -20,31 +19,15 @@ class AggregateCauses(ComputationElement):
         self.index_columns = index_columns
 
     def aggregate(self):
-        # Get data
+        # Aggregate up cause hierarchy in a single sparse pass
         data = self.data_frame
-        # Aggregate up cause hierarchy
-        max_depth = self.cause_tree.max_depth()
-        level = max_depth - 1
-        while level >= 0:
-            logger.info("  aggregating level {le} of {md}".format(
-                le=level, md=max_depth))
-            aggs = []
-            for cause in self.cause_tree.level_n_descendants(level):
-                child_ids = [c.id for c in cause.children]
-                if len(child_ids) > 0:
-                    agg = data.loc[data['cause_id'].isin(child_ids)
-                                   ].copy(deep=True)
-                    if not agg.empty:
-                        agg['cause_id'] = cause.id
-                        agg = agg.groupby(
-                            self.index_columns).sum().reset_index()
-                        aggs.append(agg)
-            if aggs:
-                aggs = pd.concat(aggs)
-                data = pd.concat([data, aggs])
-            level -= 1
-        data = data.groupby(self.index_columns).sum().reset_index()
-        return data
+        data_columns = [col for col in data.columns
+                        if col not in self.index_columns]
+        aggregator = HierarchyAggregator.from_tree(self.cause_tree)
+        logger.info("  aggregating {} levels".format(
+            self.cause_tree.max_depth()))
+        return aggregator.aggregate(data, self.index_columns, data_columns,
+                                    dimension='cause_id')
 
     def get_data_frame(self):
         # Logging the epoch time makes it easier to extract profile times from a log
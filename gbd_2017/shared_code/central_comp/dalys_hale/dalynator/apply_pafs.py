@@ -6,6 +6,7 @@ import gbd.constants as gbd
 from cluster_utils.pandas_utils import get_index_columns
 
 from dalynator.computation_element import ComputationElement
+from dalynator.draw_cube import DrawCube
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +62,11 @@ class ApplyPAFs(ComputationElement):
 
     The math of applying PAFs is very simple:
         Cause-level data * PAFs = Risk attributable data
+
+    With use_draw_cube, the cause-level draws for each PAF row are looked up
+    in a DrawCube by array indexing instead of merging the two frames. The
+    cause data must then have one row per merge_columns, and its index
+    columns that are not in merge_columns (e.g. metric_id) must be constant.
     """
     def __init__(self, paf_data_frame, cause_data_frame,
                  paf_data_columns, cause_data_columns,
@@ -74,7 +80,8 @@ class ApplyPAFs(ComputationElement):
                                 'age_group_id', 'cause_id', 'measure_id'],
                  index_columns=['location_id', 'year_id', 'sex_id',
                                 'age_group_id', 'cause_id', 'rei_id',
-                                'star_id', 'measure_id', 'metric_id']):
+                                'star_id', 'measure_id', 'metric_id'],
+                 use_draw_cube=False):
         self.paf_data_frame = paf_data_frame
         self.cause_data_frame = cause_data_frame
         self.paf_index_columns = paf_index_columns
@@ -83,6 +90,7 @@ class ApplyPAFs(ComputationElement):
         self.cause_data_columns = cause_data_columns
         self.merge_columns = merge_columns
         self.index_columns = index_columns
+        self.use_draw_cube = use_draw_cube
 
     def generate_data_columns(self, data_columns, prefix):
         new_col_names = {x: '{}_{}'.format(prefix, i)
@@ -91,6 +99,31 @@ class ApplyPAFs(ComputationElement):
                          for i, x in enumerate(data_columns)]
         return new_col_names, new_draw_cols
 
+    def _apply_with_cube(self, pafs_df, paf_cols, cause_data_df, cause_cols):
+        """Multiply each PAF row by the cause-level draws looked up in a
+        DrawCube of the cause data, keeping only the PAF rows that have
+        cause data, as the inner merge does"""
+        cause_index_cols = [col for col in cause_data_df.columns
+                            if col in self.merge_columns or
+                            (col in self.index_columns and
+                             col not in pafs_df.columns)]
+        cause_cube = DrawCube.from_long(
+            cause_data_df[cause_index_cols + cause_cols],
+            self.merge_columns, draw_cols=cause_cols)
+        cause_draws, found = cause_cube.lookup(pafs_df)
+
+        ra_df = pafs_df.loc[found, [col for col in self.index_columns
+                                    if col in pafs_df.columns]]
+        ra_df = ra_df.reset_index(drop=True)
+        for col, value in cause_cube.constants.items():
+            if col in self.index_columns:
+                ra_df[col] = value
+        attributable_burden_df = pd.DataFrame(
+            pafs_df[paf_cols].values[found] * cause_draws[found],
+            columns=cause_cols,
+            index=ra_df.index)
+        return ra_df[self.index_columns].join(attributable_burden_df)
+
     def get_data_frame(self):
         logger.info("BEGIN apply_pafs")
         # Get data
@@ -106,6 +139,12 @@ class ApplyPAFs(ComputationElement):
         new_col_names, cause_cols = self.generate_data_columns(
             self.cause_data_columns, 'draw')
         cause_data_df.rename(columns=new_col_names, inplace=True)
+        if self.use_draw_cube:
+            logger.debug("  look up cause data in a draw cube")
+            ra_df = self._apply_with_cube(pafs_df, paf_cols, cause_data_df,
+                                          cause_cols)
+            logger.info("END apply_pafs")
+            return ra_df
         ra_df = pd.merge(pafs_df, cause_data_df, on=self.merge_columns)
 
         # Apply PAFs
@@ -7,10 +7,12 @@ logger = logging.getLogger(__name__)
 
 
 class ApplyPafsToDf(ComputationElement):
-    def __init__(self, pafs_filter_df, data_frame, n_draws):
+    def __init__(self, pafs_filter_df, data_frame, n_draws,
+                 use_draw_cube=False):
         self.pafs_filter_df = pafs_filter_df
         self.df = data_frame
         self.n_draws = n_draws
+        self.use_draw_cube = use_draw_cube
 
     def get_data_frame(self):
         logger.info("BEGIN apply PAFs")
@@ -21,6 +23,7 @@ class ApplyPafsToDf(ComputationElement):
             self.df,
             paf_data_columns=paf_dcs,
             cause_data_columns=cause_dcs,
+            use_draw_cube=self.use_draw_cube,
         )
         paf_df = ce.get_data_frame()
 
@@ -0,0 +1,102 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ComputationGraph(object):
+    """A small memoizing DAG of DataFrame computations.
+
+    Each node is a function of the values of its dependencies. Evaluating a
+    set of output nodes computes every intermediate at most once, and drops
+    the cached value of a node as soon as the last node (or requested output)
+    that consumes it has been computed, so large draw frames do not linger in
+    memory longer than necessary.
+
+    Usage:
+        graph = ComputationGraph()
+        graph.add_input('num', df)
+        graph.add_node('num_bs', aggregate_sexes, 'num')
+        graph.add_node('num_bs_summ', summarize_draws, 'num_bs')
+        summaries = graph.evaluate(['num_bs_summ'])
+    """
+
+    def __init__(self):
+        self._funcs = {}
+        self._deps = {}
+        self._cache = {}
+
+    def add_input(self, name, value):
+        """Register a precomputed value as a source node"""
+        if name in self._funcs:
+            raise ValueError("Node {} already exists".format(name))
+        self._funcs[name] = None
+        self._deps[name] = ()
+        self._cache[name] = value
+
+    def add_node(self, name, func, *deps):
+        """Register node 'name' computed as func(*[value of d for d in deps])
+        """
+        if name in self._funcs:
+            raise ValueError("Node {} already exists".format(name))
+        missing = [d for d in deps if d not in self._funcs]
+        if missing:
+            raise ValueError("Node {} depends on unknown nodes {}".format(
+                name, missing))
+        self._funcs[name] = func
+        self._deps[name] = tuple(deps)
+
+    def _needed(self, outputs):
+        """Return the nodes required for outputs, in dependency order"""
+        order = []
+        seen = set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for dep in self._deps[name]:
+                visit(dep)
+            order.append(name)
+
+        for name in outputs:
+            if name not in self._funcs:
+                raise ValueError("Unknown node {}".format(name))
+            visit(name)
+        return order
+
+    def evaluate(self, outputs):
+        """Compute the requested output nodes and return their values as a
+        list, in the same order as outputs.
+
+        Intermediates are reference counted against the consumers needed to
+        produce outputs and released once no consumers remain. Input values
+        are released too, so the graph holds no references to them after
+        evaluation.
+        """
+        order = self._needed(outputs)
+        refcounts = dict((name, 0) for name in order)
+        for name in order:
+            for dep in self._deps[name]:
+                refcounts[dep] += 1
+        for name in outputs:
+            refcounts[name] += 1
+
+        results = {}
+        for name in order:
+            if name not in self._cache:
+                logger.debug("Computing node {}".format(name))
+                args = [self._cache[dep] for dep in self._deps[name]]
+                self._cache[name] = self._funcs[name](*args)
+                del args
+            for dep in self._deps[name]:
+                self._release(dep, refcounts)
+            if name in outputs:
+                results[name] = self._cache[name]
+                self._release(name, refcounts)
+        return [results[name] for name in outputs]
+
+    def _release(self, name, refcounts):
+        refcounts[name] -= 1
+        if refcounts[name] == 0:
+            logger.debug("Releasing node {}".format(name))
+            del self._cache[name]
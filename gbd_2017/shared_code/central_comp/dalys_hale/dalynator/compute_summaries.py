@@ -88,6 +88,9 @@ class MetricConverter(ComputationElement):
         """ Convert DataFrame in number-space to rate space
         """
 
+        if getattr(self.data_container, 'use_draw_cube', False):
+            return self._convert_to_rates_with_cube(df, value_cols)
+
         # Get population
         pop_df = self.data_container['pop']
 
@@ -109,6 +112,18 @@ class MetricConverter(ComputationElement):
         # Return with original columns
         return rate_df[df.columns.tolist()]
 
+    def _convert_to_rates_with_cube(self, df, value_cols):
+        """ convert_to_rates, looking population up in the data container's
+        population cube instead of merging it on. Rows without population
+        get NaN rates, as with the left merge
+        """
+        pop, _ = self.data_container.get_cube(
+            'pop', dims=self.data_container.POP_CUBE_DIMS).lookup(df)
+        rate_df = df.reset_index(drop=True)
+        rate_df[value_cols] = rate_df[value_cols].values / pop
+        rate_df['metric_id'] = gbd.metrics.RATE
+        return rate_df
+
     def get_data_frame(self):
         df = self.df
         number_df = df.loc[df['metric_id'] == gbd.metrics.NUMBER
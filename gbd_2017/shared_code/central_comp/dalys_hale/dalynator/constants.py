@@ -5,3 +5,12 @@ UMASK_PERMISSIONS = 0o002
 # STDERR/STDOUT templates
 STDERR_PHASE_DIR_TEMPLATE = "{}/stderr/{}"
 STDERR_FILE_TEMPLATE = "{}/stderr/{}/{}/stderr-$JOB_ID-$JOB_NAME.txt"
+
+# Draw file formats, and the file extension used for each
+HDF_FORMAT = 'hdf'
+PARQUET_FORMAT = 'parquet'
+DRAW_FILE_EXTENSIONS = {HDF_FORMAT: 'h5', PARQUET_FORMAT: 'parquet'}
+
+# Slots and memory (GB) reserved for each location aggregation job
+LOC_AGG_SLOTS = 20
+LOC_AGG_MEMORY_GB = 40
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import os
 import pickle
@@ -11,6 +12,7 @@ from dalynator import get_yld_data
 from dalynator import get_yll_data
 from dalynator import get_daly_data
 from dalynator.data_source import SuperGopherDataSource
+from dalynator.draw_cube import DrawCube
 
 
 logger = logging.getLogger("dalynator.data_container")
@@ -103,7 +105,8 @@ class DataContainer(object):
     def __init__(self, cache_granularity_dict, n_draws, gbd_round_id,
                  epi_dir=None, cod_dir=None, daly_dir=None, paf_dir=None,
                  cache_dir=None, turn_off_null_and_nan_check=False,
-                 yld_metric=gbd.metrics.NUMBER, raise_on_paf_error=False):
+                 yld_metric=gbd.metrics.NUMBER, raise_on_paf_error=False,
+                 use_draw_cube=False):
         """Initialize the DataContainer with proper directories and
         scope as determined in the cache_granularity_dict. Usually these would
         be loc/year.
@@ -125,6 +128,9 @@ class DataContainer(object):
                 and disable null and nan checking when retrieving data. This
                 should always be False when running in Production.
             yld_metric (int): metric_id for the metric-space ylds are stored in
+            use_draw_cube (bool): convert between rate and number space by
+                looking population up in a DrawCube instead of merging it
+                on (see get_cube)
         """
 
         self.valid_indata_types = ['yll', 'yld', 'death', 'pop', 'paf', 'daly',
@@ -132,6 +138,7 @@ class DataContainer(object):
                                    'cause_hierarchy', 'cause_risk_metadata']
         self.resample_types = ['yll', 'yld', 'death', 'daly', 'paf']
         self.cached_values = {}
+        self.cached_cubes = {}
         # self.cached_values is almost always a data_frame - but
         # cause_hierarchy/location_hierarchy is a Tree
 
@@ -146,6 +153,7 @@ class DataContainer(object):
         self.yld_metric = yld_metric
         self.n_draws = n_draws
         self.raise_on_paf_error = raise_on_paf_error
+        self.use_draw_cube = use_draw_cube
 
     def __getitem__(self, key):
         """Allows dict-like retrieval... e.g. my_data_container['pop']"""
@@ -153,12 +161,72 @@ class DataContainer(object):
             self._get_df_by_key(key)
         return self.cached_values[key]
 
+    # Default cube axes for each key, see get_cube
+    CUBE_DIMS = {
+        'yll': ['cause_id', 'age_group_id', 'sex_id'],
+        'yld': ['cause_id', 'age_group_id', 'sex_id'],
+        'death': ['cause_id', 'age_group_id', 'sex_id'],
+        'daly': ['cause_id', 'age_group_id', 'sex_id'],
+        'paf': ['cause_id', 'age_group_id', 'sex_id', 'rei_id'],
+        'pop': ['age_group_id', 'sex_id']}
+
+    # Axes of the population cube used to convert between rate and number
+    # space, the columns population would be merged on
+    POP_CUBE_DIMS = ['location_id', 'year_id', 'age_group_id', 'sex_id']
+
+    def get_cube(self, key, dims=None, measure_id=None, dtype=np.float64):
+        """Return the data for 'key' as a DrawCube, an ndarray indexed by
+        (cause, age, sex, [rei], draw), so the draws for the rows of another
+        frame can be looked up by array indexing (DrawCube.lookup) instead
+        of merged on. Use DrawCube.to_long to get back to the long DataFrame
+        format.
+
+        Args:
+            key (str): one of the keys in CUBE_DIMS
+            dims (list): cube axes, defaults to CUBE_DIMS[key]
+            measure_id (int): restrict the data to one measure first. PAFs
+                contain both yll and yld measures, so this is required to
+                build a cube from them with the default dims
+            dtype: float dtype of the cube values
+
+        star_id is dropped from paf cubes since it is determined by rei_id;
+        add_star_id restores it on the long frame.
+        """
+        if dims is None:
+            if key not in self.CUBE_DIMS:
+                raise KeyError("No default cube dimensions for {}, key must "
+                               "be one of ['{}']".format(
+                                   key, "', '".join(self.CUBE_DIMS)))
+            dims = self.CUBE_DIMS[key]
+        cache_key = (key, tuple(dims), measure_id, np.dtype(dtype).name)
+        if cache_key not in self.cached_cubes:
+            df = self.__getitem__(key)
+            if measure_id is not None:
+                df = df[df['measure_id'] == measure_id]
+            if key == 'paf' and 'star_id' not in dims:
+                df = df.drop('star_id', axis=1)
+            draw_cols = ['pop_scaled'] if key == 'pop' else None
+            self.cached_cubes[cache_key] = DrawCube.from_long(
+                df, dims, draw_cols=draw_cols, dtype=dtype)
+        return self.cached_cubes[cache_key]
+
+    def _pop_lookup(self, df):
+        """Population for each row of df and a boolean array of the rows
+        that have one, looked up in the population cube"""
+        return self.get_cube('pop', dims=self.POP_CUBE_DIMS).lookup(df)
+
     def _convert_num_to_rate(self, num_df):
         """Converts a DataFrame in rate space to number space"""
+        draw_cols = list(num_df.filter(like='draw_').columns)
+        if self.use_draw_cube:
+            pop, found = self._pop_lookup(num_df)
+            rate_df = num_df.loc[found].reset_index(drop=True)
+            rate_df['metric_id'] = gbd.metrics.RATE
+            rate_df[draw_cols] = rate_df[draw_cols].values / pop[found]
+            return rate_df
 
         pop = self.__getitem__('pop')
 
-        draw_cols = list(num_df.filter(like='draw_').columns)
         index_cols = list(set(num_df.columns) - set(draw_cols))
         core_index = ['location_id', 'year_id', 'age_group_id',
                       'sex_id']
@@ -173,10 +241,16 @@ class DataContainer(object):
 
     def _convert_rate_to_num(self, rate_df):
         """Converts a DataFrame in rate space to number space"""
+        draw_cols = list(rate_df.filter(like='draw_').columns)
+        if self.use_draw_cube:
+            pop, found = self._pop_lookup(rate_df)
+            num_df = rate_df.loc[found].reset_index(drop=True)
+            num_df['metric_id'] = gbd.metrics.NUMBER
+            num_df[draw_cols] = num_df[draw_cols].values * pop[found]
+            return num_df
 
         pop = self.__getitem__('pop')
 
-        draw_cols = list(rate_df.filter(like='draw_').columns)
         index_cols = list(set(rate_df.columns) - set(draw_cols))
         core_index = ['location_id', 'year_id', 'age_group_id',
                       'sex_id']
@@ -45,6 +45,57 @@ class CSVDataSink(DataSink):
         data_frame.to_csv(self.file_path, index=should_write_index)
 
 
+class ParquetDataSink(DataSink):
+    """Writes draws to a columnar Parquet file. Id columns are dictionary
+    encoded, draws are stored as float32, and rows are sorted by the id
+    columns so that readers can skip row groups using the per-column
+    statistics (predicate pushdown on e.g. location_id, year_id, rei_id).
+
+    pyarrow is only imported when a ParquetDataSink is written, so it is not
+    required for HDF output.
+    """
+
+    def __init__(self, file_path, draw_dtype='float32',
+                 row_group_size=100000, compression='snappy'):
+        self.file_path = file_path
+        self.dir_name, self.file_name = os.path.split(file_path)
+        self.draw_dtype = draw_dtype
+        self.row_group_size = row_group_size
+        self.compression = compression
+
+    def write(self, data_frame, id_cols=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        logger.info("Writing Parquet file '{}'".format(self.file_path))
+        self.check_paths()
+
+        if 'rei_id' in data_frame.columns:
+            data_frame = data_frame[
+                data_frame.rei_id != risk.TOTAL_ATTRIBUTABLE]
+        draw_cols = [col for col in data_frame.columns
+                     if col.startswith('draw_')]
+        if id_cols is None:
+            id_cols = [col for col in data_frame.columns
+                       if col not in draw_cols]
+        id_cols = list(id_cols)
+        other_cols = [col for col in data_frame.columns
+                      if col not in id_cols and col not in draw_cols]
+
+        data_frame = data_frame[id_cols + draw_cols + other_cols]
+        data_frame = data_frame.sort_values(id_cols).reset_index(drop=True)
+        data_frame = data_frame.astype(
+            dict((col, self.draw_dtype) for col in draw_cols))
+
+        table = pa.Table.from_pandas(data_frame, preserve_index=False)
+        pq.write_table(table, self.file_path,
+                       row_group_size=self.row_group_size,
+                       use_dictionary=id_cols,
+                       compression=self.compression)
+        logger.info("  finished write to Parquet file {}".format(
+            self.file_path))
+
+
 class HDFDataSink(DataSink):
     def __init__(self, file_path, **kwargs):
         self.file_path = file_path
@@ -1,6 +1,9 @@
+import glob
+import os
 import re
 import logging
 import numpy as np
+import pandas as pd
 
 from dataframe_io import exceptions as ex
 from db_queries import get_population
@@ -155,8 +158,12 @@ class SuperGopherDataSource(DataSource):
             logger.debug("    {} == {}".format(key, value))
         self.kwargs.update({'strict_filter_checking': True})
 
+        pattern = self.file_naming_conventions['file_pattern']
+        if pattern.endswith('.parquet'):
+            df = self._load_parquet(pattern)
+            return self._add_n_draws(df)
+
         try:
-            pattern = self.file_naming_conventions['file_pattern']
             draw_dir = self.dir_path
             h5_tablename = self.file_naming_conventions.get('h5_tablename',
                                                             None)
@@ -187,6 +194,78 @@ class SuperGopherDataSource(DataSource):
                      self.file_naming_conventions)))
         return df
 
+    def _load_parquet(self, pattern):
+        """Read the Parquet files matching pattern, pushing the filters in
+        self.kwargs down to the reader so that only the row groups that can
+        match are read.
+
+        Fields of the file pattern with exactly one filter value are
+        substituted, the others are globbed and the matching files are
+        kept. Raises ValueError if no files match, and InvalidFilter if a
+        filter is neither a field of the pattern nor a column of the files.
+        """
+        filters = dict(
+            (key, [v.item() if isinstance(v, np.generic) else v
+                   for v in value])
+            for key, value in self.kwargs.items()
+            if key != 'strict_filter_checking')
+        fields = re.findall(r'{(\w+)}', pattern)
+        substitutions = {}
+        for field in fields:
+            values = filters.get(field, [])
+            substitutions[field] = values[0] if len(values) == 1 else '*'
+        file_glob = os.path.join(self.dir_path,
+                                 pattern.format(**substitutions))
+        files = sorted(glob.glob(file_glob))
+
+        # Globbed fields with several filter values also match files for
+        # other values, so check the field values in each file name
+        globbed = [field for field in fields
+                   if field in filters and substitutions[field] == '*']
+        if globbed:
+            parts = re.split(r'{(\w+)}', os.path.join(self.dir_path,
+                                                      pattern))
+            file_regex = ''
+            for i, part in enumerate(parts):
+                if not i % 2:
+                    file_regex += re.escape(part)
+                elif '(?P<{}>'.format(part) in file_regex:
+                    file_regex += '(?P={})'.format(part)
+                else:
+                    file_regex += '(?P<{}>.*)'.format(part)
+            file_regex = re.compile(file_regex + '$')
+            wanted = dict((field, set(str(v) for v in filters[field]))
+                          for field in globbed)
+            files = [filename for filename in files
+                     if all(file_regex.match(filename).group(field) in
+                            wanted[field] for field in wanted)]
+        if not files:
+            msg = ("Super gopher '{}' found no parquet files matching {} "
+                   "and filters {}".format(self.name, file_glob, filters))
+            logger.info(msg)
+            raise ValueError(msg)
+
+        import pyarrow.parquet as pq
+        schemas = dict((filename, pq.read_schema(filename).names)
+                       for filename in files)
+        unknown = [key for key in filters if key not in fields and
+                   not any(key in columns for columns in schemas.values())]
+        if unknown:
+            raise ex.InvalidFilter(
+                "Super gopher '{}': filters {} are neither fields of "
+                "file_pattern {} nor columns of its files".format(
+                    self.name, unknown, pattern))
+        df = []
+        for filename in files:
+            pushdown = [(key, 'in', value) for key, value in filters.items()
+                        if key in schemas[filename]]
+            df.append(pd.read_parquet(filename, engine='pyarrow',
+                                      filters=pushdown or None))
+        df = pd.concat(df).reset_index(drop=True)
+        logger.info('Super gopher "{}" got parquet content from {} files, '
+                    'shape {}'.format(self.name, len(files), df.shape))
+        return df
+
     @classmethod
     def _add_n_draws(self, df):
         '''Add n_draws column to dataframe to aid in resampling later'''
@@ -0,0 +1,157 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class DrawCube(object):
+    """A dense ndarray representation of a long draw DataFrame.
+
+    values has one axis per dimension (e.g. cause_id, age_group_id, sex_id,
+    rei_id) followed by a final draw axis. Each dimension has a sorted array
+    of labels, and the integer position along that axis is the code for the
+    label. Index columns that are not dimensions must be constant across the
+    frame (e.g. location_id, year_id, measure_id, metric_id) and are kept in
+    constants. mask marks the cells that were present in the long frame, so
+    that to_long() gives back exactly the rows that went in.
+
+    lookup() gathers the draws matching each row of a long frame by array
+    indexing instead of merging the two frames, e.g. applying PAFs to
+    cause-level burden:
+
+        burden = DrawCube.from_long(yll_df, ['cause_id', 'age_group_id',
+                                             'sex_id'])
+        cause_draws, found = burden.lookup(paf_df)
+        attributable = paf_df[paf_cols].values[found] * cause_draws[found]
+    """
+
+    def __init__(self, values, axes, draw_cols, constants=None, mask=None):
+        self.values = values
+        self.axes = OrderedDict(axes)
+        self.draw_cols = list(draw_cols)
+        self.constants = dict(constants) if constants else {}
+        if mask is None:
+            mask = np.ones(values.shape[:-1], dtype=bool)
+        self.mask = mask
+
+    @property
+    def dims(self):
+        return list(self.axes.keys())
+
+    @property
+    def n_draws(self):
+        return self.values.shape[-1]
+
+    @classmethod
+    def from_long(cls, df, dims, draw_cols=None, dtype=np.float64):
+        """Build a cube from a long DataFrame with one row per combination of
+        dims and one column per draw.
+
+        Args:
+            df (DataFrame): long-format draws
+            dims (list): index columns to use as axes of the cube
+            draw_cols (list): value columns, default all 'draw_' columns
+            dtype: float dtype of the cube, e.g. np.float32 to halve memory
+
+        Raises:
+            ValueError: if an index column that is not in dims takes more than
+                one value, or if the frame has duplicate rows for some cell
+        """
+        if draw_cols is None:
+            draw_cols = list(df.filter(like='draw_').columns)
+        index_cols = [col for col in df.columns if col not in draw_cols]
+
+        constants = {}
+        for col in index_cols:
+            if col in dims:
+                continue
+            col_values = df[col].unique()
+            if len(col_values) > 1:
+                raise ValueError("Column {} is not a cube dimension but has "
+                                 "{} distinct values".format(
+                                     col, len(col_values)))
+            if len(col_values) == 1:
+                constants[col] = col_values[0]
+
+        axes = OrderedDict()
+        codes = []
+        for dim in dims:
+            labels, inverse = np.unique(df[dim].values, return_inverse=True)
+            axes[dim] = labels
+            codes.append(inverse)
+        shape = tuple(len(labels) for labels in axes.values())
+        n_cells = int(np.prod(shape))
+
+        if dims:
+            flat = np.ravel_multi_index(codes, shape)
+        else:
+            flat = np.zeros(len(df), dtype=np.int64)
+        if len(np.unique(flat)) != len(flat):
+            raise ValueError("DataFrame has duplicate rows for dimensions "
+                             "{}".format(dims))
+
+        values = np.full((n_cells, len(draw_cols)), np.nan, dtype=dtype)
+        values[flat] = df[draw_cols].values
+        mask = np.zeros(n_cells, dtype=bool)
+        mask[flat] = True
+        return cls(values.reshape(shape + (len(draw_cols),)), axes,
+                   draw_cols, constants, mask.reshape(shape))
+
+    def to_long(self, include_missing=False):
+        """Return the cube as a long DataFrame in the format it was built
+        from. Cells that were not present in the input are dropped unless
+        include_missing is True"""
+        shape = self.values.shape[:-1]
+        if include_missing:
+            flat = np.arange(self.mask.size)
+        else:
+            flat = np.flatnonzero(self.mask)
+        codes = np.unravel_index(flat, shape)
+
+        index = OrderedDict()
+        for dim, code in zip(self.dims, codes):
+            index[dim] = self.axes[dim][code]
+        df = pd.DataFrame(index)
+        for col, value in self.constants.items():
+            df[col] = value
+        draws = pd.DataFrame(
+            self.values.reshape(-1, self.n_draws)[flat],
+            columns=self.draw_cols)
+        return pd.concat([df.reset_index(drop=True), draws], axis=1)
+
+    def lookup(self, df):
+        """Return the draws of the cell matching each row of df, as an
+        (n_rows, n_draws) array, and a boolean array marking the rows that
+        matched a cell present in the cube. Rows are matched on the cube's
+        dims and on any of its constants that are also columns of df, like
+        the keys of an inner merge, but by array indexing. Rows that did not
+        match get NaN draws.
+        """
+        if self.mask.size == 0:
+            return (np.full((len(df), self.n_draws), np.nan,
+                            dtype=self.values.dtype),
+                    np.zeros(len(df), dtype=bool))
+
+        found = np.ones(len(df), dtype=bool)
+        codes = []
+        for dim in self.dims:
+            labels = self.axes[dim]
+            col = df[dim].values
+            pos = np.clip(np.searchsorted(labels, col), 0, len(labels) - 1)
+            found &= labels[pos] == col
+            codes.append(pos)
+        for col, value in self.constants.items():
+            if col in df.columns:
+                found &= df[col].values == value
+
+        if codes:
+            flat = np.ravel_multi_index(codes, self.mask.shape)
+        else:
+            flat = np.zeros(len(df), dtype=np.int64)
+        found &= self.mask.ravel()[flat]
+        values = self.values.reshape(-1, self.n_draws)[flat]
+        values[~found] = np.nan
+        return values, found
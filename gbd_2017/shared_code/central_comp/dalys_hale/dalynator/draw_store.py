@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# tmpfs mount, i.e. shared memory on the node. Used as the default root for
+# stores when available.
+SHARED_MEMORY_DIR = '/dev/shm'
+
+
+class SharedDrawStore(object):
+    """Key-based store of draw DataFrames shared between the processes of a
+    multiprocessing.Pool, so that workers can hand large results back to the
+    parent (and to each other) without pickling them through the pool.
+
+    Each key is a directory holding the draw block as a contiguous .npy
+    array, which readers memory-map, plus a small pickle of the index
+    columns. By default the store lives in shared memory (/dev/shm), so
+    writing and reading a key never touches the shared filesystem.
+
+    The store is created in the parent before the Pool forks, and is just a
+    directory path, so it is inherited by every worker:
+
+        MPGlobals.draw_store = SharedDrawStore()
+        ...in a worker:
+            MPGlobals.draw_store.put('yll', df)
+        ...in the parent:
+            df = MPGlobals.draw_store.get('yll')
+        MPGlobals.draw_store.close()
+    """
+
+    DRAWS_FILE = 'draws.npy'
+    INDEX_FILE = 'index.pkl'
+    META_FILE = 'meta.json'
+
+    def __init__(self, root_dir=None, prefix='draw_store_'):
+        """Create an empty store in a new directory under root_dir, which
+        defaults to shared memory if available and the system temp dir
+        otherwise"""
+        if root_dir is None and os.path.isdir(SHARED_MEMORY_DIR):
+            root_dir = SHARED_MEMORY_DIR
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root_dir)
+        logger.info("Created draw store at {}".format(self.path))
+
+    def _key_path(self, key):
+        return os.path.join(self.path, str(key))
+
+    def __contains__(self, key):
+        return os.path.isdir(self._key_path(key))
+
+    def keys(self):
+        return [k for k in os.listdir(self.path) if not k.endswith('.tmp')]
+
+    def put(self, key, df):
+        """Write df under key, replacing any existing value. Columns whose
+        names start with 'draw_' are stored as one contiguous array, all other
+        columns as the index. The write is atomic: readers see either the old
+        or the new value"""
+        draw_cols = [col for col in df.columns if col.startswith('draw_')]
+        index_cols = [col for col in df.columns if col not in draw_cols]
+        key_path = self._key_path(key)
+        tmp_path = tempfile.mkdtemp(prefix='{}.'.format(key), suffix='.tmp',
+                                    dir=self.path)
+
+        np.save(os.path.join(tmp_path, self.DRAWS_FILE),
+                np.ascontiguousarray(df[draw_cols].values))
+        df[index_cols].reset_index(drop=True).to_pickle(
+            os.path.join(tmp_path, self.INDEX_FILE))
+        with open(os.path.join(tmp_path, self.META_FILE), 'w') as meta_file:
+            json.dump({'columns': list(df.columns),
+                       'draw_cols': draw_cols}, meta_file)
+
+        if os.path.isdir(key_path):
+            shutil.rmtree(key_path)
+        os.rename(tmp_path, key_path)
+        logger.debug("Wrote {} rows to draw store key {}".format(
+            len(df), key))
+
+    def _read_meta(self, key):
+        if key not in self:
+            raise KeyError("Key {} not in draw store {}".format(
+                key, self.path))
+        with open(os.path.join(self._key_path(key), self.META_FILE)) as f:
+            return json.load(f)
+
+    def get_index(self, key):
+        """Return only the index columns stored under key, without reading
+        the draws"""
+        self._read_meta(key)
+        return pd.read_pickle(
+            os.path.join(self._key_path(key), self.INDEX_FILE))
+
+    def get(self, key):
+        """Return the DataFrame stored under key, with its original column
+        order. The draws are not copied: they are a copy-on-write memory map
+        of the stored array, so only pages the caller modifies are copied
+        into its own memory"""
+        meta = self._read_meta(key)
+        index = self.get_index(key)
+        draws = np.load(os.path.join(self._key_path(key), self.DRAWS_FILE),
+                        mmap_mode='c')
+        df = pd.DataFrame(draws, columns=meta['draw_cols'], copy=False)
+        # Inserting the index columns adds blocks next to the draws rather
+        # than reordering (and so copying) them
+        draw_cols = set(meta['draw_cols'])
+        for i, col in enumerate(meta['columns']):
+            if col not in draw_cols:
+                df.insert(i, col, index[col].values)
+        return df
+
+    def delete(self, key):
+        """Remove key from the store, freeing its memory"""
+        if key in self:
+            shutil.rmtree(self._key_path(key))
+
+    def close(self):
+        """Remove the store and everything in it"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        logger.info("Removed draw store at {}".format(self.path))
@@ -8,6 +8,8 @@ from db_tools import ezfuncs
 
 import dalynator.app_common as ac
 from dalynator.constants import FILE_PERMISSIONS, UMASK_PERMISSIONS
+from dalynator.constants import DRAW_FILE_EXTENSIONS, HDF_FORMAT
+from dalynator.constants import LOC_AGG_MEMORY_GB
 from dalynator.makedirs_safely import makedirs_safely
 from dalynator.setup_logger import create_logger_in_memory
 from dalynator.get_yld_data import get_como_folder_structure
@@ -48,9 +50,10 @@ def calculate_filenames(output_dir, log_dir, measure_id, location_id, year_id):
     return output_file, stdout_log
 
 
-def calculate_output_filename(output_dir, measure_id, location_id, year_id):
-    output_file = os.path.join(output_dir, "{}_{}_{}.h5".format(
-        measure_id, location_id, year_id))
+def calculate_output_filename(output_dir, measure_id, location_id, year_id,
+                              file_format=HDF_FORMAT):
+    output_file = os.path.join(output_dir, "{}_{}_{}.{}".format(
+        measure_id, location_id, year_id, DRAW_FILE_EXTENSIONS[file_format]))
     return output_file
 
 
@@ -183,6 +186,18 @@ def add_to_parser_burdenator_specific(parser):
     parser.add_argument('--raise_on_paf_error',
                         action='store_true', default=False,
                         help='Raise if aggregate causes are found in PAFs')
+
+    parser.add_argument('--draw_file_format',
+                        default=HDF_FORMAT,
+                        choices=sorted(DRAW_FILE_EXTENSIONS.keys()),
+                        type=str, action='store',
+                        help='File format for the draw files, hdf or '
+                             'parquet (columnar, float32 draws)')
+
+    parser.add_argument('--use_draw_cube',
+                        action='store_true', default=False,
+                        help='Apply PAFs and convert to rates by array '
+                             'lookups in draw cubes instead of merges')
     return parser
 
 
@@ -396,6 +411,26 @@ def construct_parser_burdenator_loc_agg():
                         help='Write out star_ids',
                         dest="write_out_star_ids")
 
+    parser.add_argument('--streaming',
+                        action='store_true', default=False,
+                        help='Aggregate by streaming bottom-up through the '
+                             'location tree instead of with AggMemEff')
+
+    parser.add_argument('--memory_budget_gb',
+                        type=float, action='store',
+                        default=LOC_AGG_MEMORY_GB,
+                        help='Memory the aggregation may use, in GB. Chunk '
+                             'size and number of processes are chosen from '
+                             'it. Defaults to the memory a location '
+                             'aggregation job reserves')
+
+    parser.add_argument('--draw_file_format',
+                        default=HDF_FORMAT,
+                        choices=sorted(DRAW_FILE_EXTENSIONS.keys()),
+                        type=str, action='store',
+                        help='File format of the most detailed draw files '
+                             'to aggregate, hdf or parquet')
+
     return parser
 
 
@@ -412,6 +447,7 @@ def get_args_burdenator_loc_agg(parser, cli_args=None):
     args.cache_dir = '{}/cache'.format(args.data_root)
     args.log_dir = os.path.join(top_out_dir, 'log_loc_agg',
                                 str(args.year_id), str(args.measure_id))
+    args.memory_budget = args.memory_budget_gb * 1024 ** 3
 
     log_filename = "{}_{}_{}_{}.log".format(
         args.measure_id, args.rei_id, args.year_id, args.sex_id)
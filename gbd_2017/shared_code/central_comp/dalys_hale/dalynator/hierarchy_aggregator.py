@@ -0,0 +1,145 @@
+"""Sparse, single-pass aggregation of draws up a hierarchy.
+
+Shared by the cause aggregation of dalynator, codcorrect and como, which
+import it from here.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+
+class HierarchyAggregator(object):
+    """Aggregate draws up a hierarchy (e.g. causes) in a single pass.
+
+    The hierarchy is compiled once into an id -> ancestors (including self)
+    lookup. aggregate() then builds a sparse matrix mapping each input row
+    onto every (group, ancestor) output row it contributes to, and produces
+    all aggregates with one sparse-dense product over the draw block, instead
+    of a groupby-sum per parent per level.
+
+    An aggregate is produced for every ancestor that has at least one
+    descendant row in the data. Ids that are not in the hierarchy are passed
+    through (summed onto themselves only).
+    """
+
+    def __init__(self, node_ids, parent_ids, leaf_ids=None):
+        """
+        Args:
+            node_ids (list): ids of every node in the hierarchy
+            parent_ids (list): parent id of each node in node_ids. The root's
+                parent is either itself or None
+            leaf_ids (list): most detailed ids, used when aggregating with
+                leaves_only=True. Defaults to nodes with no children
+        """
+        parent_of = dict(zip(node_ids, parent_ids))
+        self.ancestors = {}
+        for node_id in node_ids:
+            lineage = [node_id]
+            parent_id = parent_of[node_id]
+            while (parent_id is not None and parent_id != lineage[-1] and
+                   parent_id in parent_of):
+                if parent_id in lineage:
+                    raise ValueError("Hierarchy has a cycle through "
+                                     "{}".format(parent_id))
+                lineage.append(parent_id)
+                parent_id = parent_of[parent_id]
+            self.ancestors[node_id] = lineage
+
+        if leaf_ids is None:
+            parents = set(p for n, p in parent_of.items() if p != n)
+            leaf_ids = [n for n in node_ids if n not in parents]
+        self.leaf_ids = list(leaf_ids)
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Compile a hierarchies Tree"""
+        node_ids = []
+        parent_ids = []
+        parent_of = {}
+        for node in tree.nodes:
+            for child in node.children:
+                parent_of[child.id] = node.id
+        for node in tree.nodes:
+            node_ids.append(node.id)
+            parent_ids.append(parent_of.get(node.id))
+        return cls(node_ids, parent_ids,
+                   leaf_ids=[node.id for node in tree.leaves()])
+
+    @classmethod
+    def from_hierarchy_df(cls, hierarchy, id_col='cause_id',
+                          parent_col='parent_id',
+                          most_detailed_col='most_detailed'):
+        """Compile a hierarchy DataFrame with one row per node"""
+        leaf_ids = None
+        if most_detailed_col in hierarchy:
+            leaf_ids = hierarchy.loc[hierarchy[most_detailed_col] == 1,
+                                     id_col].tolist()
+        return cls(hierarchy[id_col].tolist(),
+                   hierarchy[parent_col].tolist(), leaf_ids=leaf_ids)
+
+    def aggregate(self, df, index_cols, data_cols, dimension='cause_id',
+                  leaves_only=False):
+        """Return df with every hierarchy aggregate of data_cols added.
+
+        Args:
+            df (DataFrame): data to aggregate
+            index_cols (list): id columns, including dimension. Output has
+                one row per unique index_cols combination
+            data_cols (list): value columns to sum
+            dimension (str): the column holding hierarchy ids
+            leaves_only (bool): drop non-leaf rows before aggregating, so
+                aggregates are recomputed from the most detailed level
+
+        Returns:
+            DataFrame of index_cols + data_cols, ordered by group then id.
+            Input rows that share an index are summed, as with a groupby.
+        """
+        if leaves_only:
+            df = df[df[dimension].isin(self.leaf_ids)]
+        group_cols = [col for col in index_cols if col != dimension]
+        n_rows = len(df)
+        if n_rows == 0:
+            return df[index_cols + data_cols].reset_index(drop=True)
+
+        # Ancestor lists for the ids present, as one flat array + offsets
+        ids, id_codes = np.unique(df[dimension].values, return_inverse=True)
+        lineages = [self.ancestors.get(i, [i]) for i in ids]
+        lengths = np.array([len(l) for l in lineages])
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        flat_ancestors = np.concatenate(lineages)
+
+        # Expand each input row to one entry per ancestor
+        counts = lengths[id_codes]
+        total = counts.sum()
+        row_idx = np.repeat(np.arange(n_rows), counts)
+        starts = np.repeat(offsets[id_codes] - (np.cumsum(counts) - counts),
+                           counts)
+        ancestor_ids = flat_ancestors[starts + np.arange(total)]
+
+        # Output row for each (group, ancestor) pair
+        if group_cols:
+            group_codes = df.groupby(group_cols, sort=False).ngroup().values
+        else:
+            group_codes = np.zeros(n_rows, dtype=np.int64)
+        anc_labels, anc_codes = np.unique(ancestor_ids, return_inverse=True)
+        keys = (group_codes[row_idx].astype(np.int64) * len(anc_labels) +
+                anc_codes)
+        _, first, out_idx = np.unique(keys, return_index=True,
+                                      return_inverse=True)
+
+        logger.debug("Aggregating {} rows into {} rows over {} ids".format(
+            n_rows, len(first), len(anc_labels)))
+        mapping = sparse.csr_matrix(
+            (np.ones(total), (out_idx, row_idx)),
+            shape=(len(first), n_rows))
+        values = mapping.dot(df[data_cols].values)
+
+        out = df[group_cols].iloc[row_idx[first]].reset_index(drop=True)
+        out[dimension] = ancestor_ids[first]
+        out = pd.concat(
+            [out, pd.DataFrame(values, columns=data_cols)], axis=1)
+        return out[index_cols + data_cols]
@@ -3,6 +3,8 @@ import logging
 from jobmon.models import JobStatus
 from jobmon.workflow.executable_task import ExecutableTask
 
+from dalynator.constants import HDF_FORMAT
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,7 +16,8 @@ class BurdenatorMostDetailedTask(ExecutableTask):
                  write_out_star_ids,
                  gbd_round_id,
                  version, daly_version, verbose, turn_off_null_and_nan_check,
-                 no_sex_aggr, no_age_aggr, raise_on_paf_error):
+                 no_sex_aggr, no_age_aggr, raise_on_paf_error,
+                 use_draw_cube=False, draw_file_format=HDF_FORMAT):
         self.command = BurdenatorMostDetailedTask.create_unique_base_command(
             location_id, year_id, write_out_star_ids)
         super(BurdenatorMostDetailedTask, self).__init__(self.command,
@@ -49,6 +52,10 @@ class BurdenatorMostDetailedTask(ExecutableTask):
             params += " --no_age"
         if raise_on_paf_error:
             params += " --raise_on_paf_error"
+        if use_draw_cube:
+            params += " --use_draw_cube"
+        if draw_file_format != HDF_FORMAT:
+            params += " --draw_file_format {}".format(draw_file_format)
 
         self.extended_command = '{c} {p}'.format(c=self.command, p=params)
 
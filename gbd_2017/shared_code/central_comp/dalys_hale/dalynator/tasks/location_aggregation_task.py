@@ -1,8 +1,11 @@
 import logging
+import math
 
 from jobmon.models import JobStatus
 from jobmon.workflow.executable_task import ExecutableTask
 
+from dalynator.constants import HDF_FORMAT, LOC_AGG_MEMORY_GB, LOC_AGG_SLOTS
+
 from dalynator.tasks.burdenator_most_detailed_task import \
     BurdenatorMostDetailedTask
 
@@ -13,7 +16,8 @@ class LocationAggregationTask(ExecutableTask):
     def __init__(self, data_root, location_set_id, location_ids,
                  year_id, rei_id, sex_id, measure_id, n_draws, version,
                  write_out_star_ids, region_locs, verbose, gbd_round_id,
-                 upstream_tasks):
+                 upstream_tasks, streaming=False, memory_budget_gb=None,
+                 draw_file_format=HDF_FORMAT):
         self.command = LocationAggregationTask.create_unique_base_command(
             location_set_id, year_id, rei_id, measure_id, sex_id,
             write_out_star_ids)
@@ -35,6 +39,15 @@ class LocationAggregationTask(ExecutableTask):
                       n=n_draws, rl=' '.join(str(loc) for loc in region_locs)))
         if verbose:
             params += " --verbose"
+        if streaming:
+            params += " --streaming"
+        # The aggregation sizes itself to the memory the job reserves
+        self.mem_free = max(LOC_AGG_MEMORY_GB,
+                            int(math.ceil(memory_budget_gb or 0)))
+        params += " --memory_budget_gb {}".format(
+            memory_budget_gb or self.mem_free)
+        if draw_file_format != HDF_FORMAT:
+            params += " --draw_file_format {}".format(draw_file_format)
 
         self.extended_command = '{c} {p}'.format(c=self.command, p=params)
 
@@ -47,8 +60,8 @@ class LocationAggregationTask(ExecutableTask):
             jobname=self.hash_name,
             job_hash=self.hash,
             command=self.extended_command,
-            slots=20,
-            mem_free=40,
+            slots=LOC_AGG_SLOTS,
+            mem_free=self.mem_free,
             max_runtime=process_timeout + max(2, .1 * process_timeout),
             max_attempts=11
         )
@@ -1,4 +1,5 @@
 from dalynator import DalynatorJobSwarm as djs
+from dalynator.constants import DRAW_FILE_EXTENSIONS, HDF_FORMAT
 from dalynator.tasks import run_all_dalynator as rad
 
 
@@ -55,6 +56,33 @@ class BurdenatorApplication(rad.DalynatorApplication):
                                  action='store_true', default=False,
                                  help='Write out the star_id column',
                                  dest="write_out_star_ids")
+
+        self.parser.add_argument('--use_draw_cube',
+                                 action='store_true', default=False,
+                                 help='Apply PAFs and convert to rates by '
+                                      'array lookups in draw cubes instead '
+                                      'of merges')
+
+        self.parser.add_argument('--streaming',
+                                 action='store_true', default=False,
+                                 help='Aggregate locations by streaming '
+                                      'bottom-up through the location tree '
+                                      'instead of with AggMemEff')
+
+        self.parser.add_argument('--memory_budget_gb',
+                                 type=float, action='store', default=None,
+                                 help='Memory each location aggregation job '
+                                      'may use, and reserves, in GB. '
+                                      'Defaults to the memory a location '
+                                      'aggregation job reserves, 40GB')
+
+        self.parser.add_argument('--draw_file_format',
+                                 default=HDF_FORMAT,
+                                 choices=sorted(DRAW_FILE_EXTENSIONS.keys()),
+                                 type=str, action='store',
+                                 help='File format of the most detailed draw '
+                                      'files, hdf or parquet. Parquet can not '
+                                      'be used with the pct_change phase')
         return self.parser
 
     def parse(self, tool_name="burdenator", cli_args=None):
@@ -151,7 +179,11 @@ def main(cli_args=None):
         sge_project=args.sge_project,
         verbose=args.verbose,
         raise_on_paf_error=args.raise_on_paf_error,
-        do_not_execute=args.do_not_execute
+        do_not_execute=args.do_not_execute,
+        use_draw_cube=args.use_draw_cube,
+        streaming=args.streaming,
+        memory_budget_gb=args.memory_budget_gb,
+        draw_file_format=args.draw_file_format
     )
     swarm.run("run_pipeline_burdenator.py")
     return swarm
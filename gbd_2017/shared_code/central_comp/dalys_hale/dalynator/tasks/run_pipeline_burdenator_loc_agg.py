@@ -3,6 +3,7 @@ import json
 import logging
 import os
 import time
+from multiprocessing import Pool, cpu_count
 
 import pandas as pd
 from aggregator.aggregators import AggMemEff
@@ -14,12 +15,27 @@ from gbd import constants as gbd
 from dalynator import get_input_args
 from dalynator import makedirs_safely as mkds
 from dalynator.computation_element import ComputationElement
+from dalynator.constants import DRAW_FILE_EXTENSIONS, HDF_FORMAT
+from dalynator.constants import LOC_AGG_MEMORY_GB, PARQUET_FORMAT
 from dalynator.data_container import DataContainer
 from dalynator.data_container import remove_unwanted_stars
+from dalynator.data_source import SuperGopherDataSource
 
 # Other programs look for this string.
 SUCCESS_LOG_MESSAGE = "DONE write DF"
 
+# Rough ratio of the in-memory size of a draw DataFrame to the size of the
+# file it was read from, used to size chunks from input file sizes. Parquet
+# draws are compressed float32, read back as float64
+IN_MEMORY_EXPANSION = {HDF_FORMAT: 2.0, PARQUET_FORMAT: 4.0}
+
+# Number of frames the parent process holds at once while summing the
+# results of its workers
+PARENT_FRAMES = 3
+
+# Upper bound on the number of locations a worker reads per chunk
+MAX_CHUNKSIZE = 10
+
 logger = logging.getLogger("dalynator.tasks.run_pipeline_burdenator_loc_agg")
 
 
@@ -32,21 +48,45 @@ def create_default_scalars(location_id, year_id):
     return df
 
 
+def load_regional_scalars(regional_scalar_path, region_locs, year_id):
+    """Read the regional scalars for all region_locs in year_id with a single
+    read of scalars.h5, defaulting to 1.0 if the file does not exist"""
+    path = '{p}/scalars.h5'.format(p=regional_scalar_path)
+    try:
+        scalars = pd.read_hdf(
+            path, 'scalars', where=(["'year_id'=={}".format(year_id)]))
+        scalars = scalars[scalars.location_id.isin(region_locs)]
+    except FileNotFoundError:
+        scalars = pd.DataFrame({'location_id': list(region_locs),
+                                'year_id': year_id, 'scaling_factor': 1.0})
+        logger.info(
+            "Defaulting to 1.0 for pop scalars year {yr}, at "
+            "{path}".format(path=path, yr=year_id))
+    return scalars[['location_id', 'year_id', 'scaling_factor']]
+
+
 def apply_regional_scalars(df, regional_scalar_path, region_locs, value_cols,
-                           year_id):
+                           year_id, scalars=None):
+    """Multiply the draws of region locations by their regional scalar.
+    scalars, if given, is the output of load_regional_scalars for year_id and
+    is used instead of re-reading scalars.h5 for every location"""
     current_loc = df.location_id.unique().item()
     if current_loc in region_locs:
         merge_cols = ['location_id', 'year_id']
-        path = '{p}/scalars.h5'.format(p=regional_scalar_path)
-        try:
-            scalars = pd.read_hdf(
-                path, 'scalars', where=(["'location_id'=={} & 'year_id'=={}"
-                                        .format(current_loc, year_id)]))
-        except FileNotFoundError:
-            scalars = create_default_scalars(current_loc, year_id)
-            logger.info(
-                "Defaulting to 1.0 for pop scalars loc {loc}, year {yr}, at "
-                "{path}".format(path=path, loc=current_loc, yr=year_id))
+        if scalars is None:
+            path = '{p}/scalars.h5'.format(p=regional_scalar_path)
+            try:
+                scalars = pd.read_hdf(
+                    path, 'scalars',
+                    where=(["'location_id'=={} & 'year_id'=={}"
+                            .format(current_loc, year_id)]))
+            except FileNotFoundError:
+                scalars = create_default_scalars(current_loc, year_id)
+                logger.info(
+                    "Defaulting to 1.0 for pop scalars loc {loc}, year {yr}, "
+                    "at {path}".format(path=path, loc=current_loc,
+                                       yr=year_id))
+        scalars = scalars[scalars.location_id == current_loc].copy()
         scalars['year_id'] = year_id
         df = df.merge(scalars, on=merge_cols, how='left')
         df['scaling_factor'].fillna(1, inplace=True)
@@ -59,11 +99,106 @@ def apply_regional_scalars(df, regional_scalar_path, region_locs, value_cols,
     return df
 
 
+def get_n_slots():
+    """Return the number of slots reserved for the job (NSLOTS, set by the
+    scheduler), or the number of cores on the node outside of a scheduled
+    job"""
+    try:
+        return int(os.environ["NSLOTS"])
+    except (KeyError, ValueError):
+        return cpu_count()
+
+
+def choose_chunking(frame_bytes, memory_budget, n_cores,
+                    max_chunksize=MAX_CHUNKSIZE, parent_frames_per_process=0):
+    """Choose (chunksize, n_processes) for location aggregation.
+
+    The parent holds PARENT_FRAMES frames, plus parent_frames_per_process
+    for every worker, and each worker holds its running sum plus chunksize
+    frames it has read. Use as many workers as there are cores, as long as
+    each can hold at least one frame besides its sum, then grow the
+    chunksize into the remaining budget.
+
+    Args:
+        frame_bytes (float): estimated in-memory size of one location's data
+        memory_budget (float): bytes available for the whole aggregation
+        n_cores (int): number of cores available
+        parent_frames_per_process (int): frames the parent holds for each
+            worker, e.g. the running totals of the aggregates the workers
+            are reading leaves for
+
+    Returns:
+        tuple of ints (chunksize, n_processes)
+    """
+    frame_bytes = max(frame_bytes, 1)
+    worker_budget = memory_budget - PARENT_FRAMES * frame_bytes
+    n_processes = int(max(1, min(
+        n_cores,
+        worker_budget // ((2 + parent_frames_per_process) * frame_bytes))))
+    chunksize = int(max(1, min(
+        max_chunksize,
+        worker_budget // (n_processes * frame_bytes) - 1 -
+        parent_frames_per_process)))
+    return chunksize, n_processes
+
+
+class ParquetDrawSource(object):
+    """Reads the most detailed draws written with --draw_file_format parquet.
+    Has the content(filters) method of the draw_sources DrawSource that
+    AggMemEff and LocationAggregator.read_and_sum use, and reads through
+    SuperGopherDataSource so the filters are pushed down to the Parquet
+    reader."""
+
+    def __init__(self, draw_dir, file_pattern, index_cols, data_cols):
+        self.draw_dir = draw_dir
+        self.file_pattern = file_pattern
+        self.index_cols = index_cols
+        self.data_cols = data_cols
+
+    def content(self, filters=None):
+        filters = dict(
+            (key, list(value) if isinstance(value, (list, tuple))
+             else [value])
+            for key, value in (filters or {}).items())
+        source = SuperGopherDataSource(
+            'parquet draws', {'file_pattern': self.file_pattern},
+            self.draw_dir, True, **filters)
+        df = source._load_parquet(self.file_pattern)
+        keep_cols = ['location_id'] + self.index_cols + self.data_cols
+        df = df[[col for col in keep_cols if col in df.columns]]
+        return df.astype(dict((col, 'float64') for col in self.data_cols))
+
+
+class StreamGlobals(object):
+    """Container for the LocationAggregator used by streaming workers, set
+    before the Pool forks"""
+
+
+def sum_locations(task):
+    """Read and sum the draws of a chunk of location_ids in a streaming
+    worker. task is (aggregate location_id, location_ids), and the aggregate
+    location_id is returned with the sum"""
+    aggregate_id, location_ids = task
+    return aggregate_id, StreamGlobals.aggregator.read_and_sum(location_ids)
+
+
 class LocationAggregator(ComputationElement):
 
     def __init__(self, location_set_id, year_id, rei_id, sex_id, measure_id,
                  gbd_round_id, n_draws, data_root, region_locs,
-                 write_out_star_ids):
+                 write_out_star_ids, streaming=False, memory_budget=None,
+                 file_format=HDF_FORMAT):
+        """
+        Args:
+            streaming (bool): aggregate by walking the location tree
+                bottom-up, holding only the aggregates whose parents are
+                still being computed, instead of running AggMemEff
+            memory_budget (float): bytes of memory the aggregation may use,
+                used to choose chunk size and worker count. Defaults to the
+                memory a location aggregation job reserves
+            file_format (str): format of the most detailed draw files,
+                HDF_FORMAT or PARQUET_FORMAT. Aggregates are written as HDF
+        """
         self.location_set_id = location_set_id
         self.year_id = year_id
         self.rei_id = rei_id
@@ -86,6 +221,9 @@ class LocationAggregator(ComputationElement):
         self.out_dir = os.path.join(self.data_root, 'loc_agg_draws/burden')
         mkds.makedirs_safely(self.out_dir)
         self.write_out_star_ids = write_out_star_ids
+        self.streaming = streaming
+        self.memory_budget = memory_budget
+        self.file_format = file_format
 
         # Remove old aggregates in case jobs failed in the middle
         aggregates = [n.id for n in self.loctree.nodes
@@ -111,6 +249,9 @@ class LocationAggregator(ComputationElement):
                              'year_id': self.year_id}
 
         self.operator = self.get_operator()
+        self.scalars = load_regional_scalars(
+            os.path.join(self.data_root, 'cache'), self.region_locs,
+            self.year_id)
         self.draw_source, self.draw_sink = self.get_draw_source_sink()
 
     def get_operator(self):
@@ -121,20 +262,25 @@ class LocationAggregator(ComputationElement):
     def get_draw_source_sink(self):
         ss = SourceSinkPair()
         in_pattern = ('{{location_id}}/'
-                      '{measure_id}_{{location_id}}_{year_id}.h5'
+                      '{measure_id}_{{location_id}}_{year_id}.{ext}'
                       .format(measure_id=self.measure_id,
-                              year_id=self.year_id))
+                              year_id=self.year_id,
+                              ext=DRAW_FILE_EXTENSIONS[self.file_format]))
         out_pattern = ('{location_id}/{measure_id}/'
                        '{measure_id}_{year_id}_{location_id}_'
                        '{rei_id}_{sex_id}.h5')
 
         draw_cols = ["draw_{}".format(i) for i in range(self.n_draws)]
-        draw_source = ss.draw_source(
-            params={'draw_dir': self.in_dir,
-                    'file_pattern': in_pattern,
-                    'h5_tablename': '{n}_draws'.format(n=self.n_draws),
-                    'data_cols': draw_cols,
-                    'index_cols': self.index_cols})
+        if self.file_format == PARQUET_FORMAT:
+            draw_source = ParquetDrawSource(self.in_dir, in_pattern,
+                                            self.index_cols, draw_cols)
+        else:
+            draw_source = ss.draw_source(
+                params={'draw_dir': self.in_dir,
+                        'file_pattern': in_pattern,
+                        'h5_tablename': '{n}_draws'.format(n=self.n_draws),
+                        'data_cols': draw_cols,
+                        'index_cols': self.index_cols})
         draw_sink = ss.draw_sink(
             params={'draw_dir': self.out_dir,
                     'file_pattern': out_pattern,
@@ -143,20 +289,127 @@ class LocationAggregator(ComputationElement):
             apply_regional_scalars,
             regional_scalar_path=os.path.join(self.data_root, 'cache'),
             region_locs=self.region_locs, value_cols=self.value_cols,
-            year_id=self.year_id)
+            year_id=self.year_id, scalars=self.scalars)
         draw_sink.add_transform(
             remove_unwanted_stars,
             write_out_star_ids=self.write_out_star_ids)
         return draw_source, draw_sink
 
+    def get_input_filename(self, location_id):
+        return os.path.join(
+            self.in_dir, str(location_id), '{m}_{loc}_{y}.{ext}'.format(
+                m=self.measure_id, loc=location_id, y=self.year_id,
+                ext=DRAW_FILE_EXTENSIONS[self.file_format]))
+
+    def get_chunking(self):
+        """Choose chunksize and n_processes from the size of the largest
+        input file and the memory budget"""
+        sizes = [os.path.getsize(self.get_input_filename(n.id))
+                 for n in self.loctree.leaves()
+                 if os.path.exists(self.get_input_filename(n.id))]
+        frame_bytes = (IN_MEMORY_EXPANSION[self.file_format] * max(sizes)
+                       if sizes else 1)
+        memory_budget = self.memory_budget
+        if memory_budget is None:
+            memory_budget = LOC_AGG_MEMORY_GB * 1024 ** 3
+        # Streaming holds a running total in the parent for each aggregate
+        # the workers are reading leaves for
+        chunksize, n_processes = choose_chunking(
+            frame_bytes, memory_budget, get_n_slots(),
+            parent_frames_per_process=1 if self.streaming else 0)
+        logger.info("Chunking for frames of ~{f:.0f} bytes in a budget of "
+                    "{b:.0f} bytes: chunksize {c}, n_processes {n}".format(
+                        f=frame_bytes, b=memory_budget, c=chunksize,
+                        n=n_processes))
+        return chunksize, n_processes
+
+    def read_and_sum(self, location_ids):
+        """Read the draws of location_ids one at a time and return their sum,
+        indexed by index_cols"""
+        total = None
+        for location_id in location_ids:
+            filters = dict(self.draw_filters, location_id=location_id)
+            df = self.draw_source.content(filters=filters)
+            df = df.set_index(self.index_cols)[self.value_cols]
+            total = df if total is None else total.add(df, fill_value=0)
+        return total
+
+    def stream_aggregate(self, chunksize, n_processes):
+        """Aggregate by walking the location tree bottom-up. The leaf
+        children of every aggregate are read in chunks by the worker pool.
+        The chunks of all aggregates are submitted at once, in post-order,
+        so workers go on to the next aggregate's leaves instead of waiting
+        for the parent to finish one. Each chunk's sum is added to its
+        aggregate's running total as it arrives. An aggregate is written, and
+        added to its parent's total, as soon as all of its leaf chunks and
+        aggregate children are in, so only the totals of aggregates still
+        being computed are held in memory."""
+        parent_ids = {}
+        pending = {}
+        tasks = []
+        for node in self._postorder(self.loctree.root):
+            if not node.children:
+                continue
+            leaf_ids = [c.id for c in node.children if not c.children]
+            chunks = [leaf_ids[i:i + chunksize]
+                      for i in range(0, len(leaf_ids), chunksize)]
+            tasks.extend((node.id, chunk) for chunk in chunks)
+            pending[node.id] = len(node.children) - len(leaf_ids) + len(chunks)
+            for child in node.children:
+                parent_ids[child.id] = node.id
+
+        totals = {}
+        StreamGlobals.aggregator = self
+        pool = Pool(n_processes)
+        try:
+            for location_id, part in pool.imap_unordered(sum_locations,
+                                                         tasks):
+                while location_id is not None:
+                    if part is not None:
+                        if location_id in totals:
+                            part = totals[location_id].add(part,
+                                                           fill_value=0)
+                        totals[location_id] = part
+                    pending[location_id] -= 1
+                    if pending[location_id] > 0:
+                        break
+                    part = self._write_aggregate(location_id,
+                                                 totals.pop(location_id, None))
+                    location_id = parent_ids.get(location_id)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _write_aggregate(self, location_id, total):
+        """Write the finished total of an aggregate location and return it"""
+        if total is None:
+            raise ValueError("No draws were read for any location below "
+                             "aggregate location {}".format(location_id))
+        logger.info("Writing aggregate location {}".format(location_id))
+        df = total.reset_index()
+        df['location_id'] = location_id
+        self.draw_sink.push(df, append=False)
+        return total
+
+    def _postorder(self, node):
+        for child in node.children:
+            for descendant in self._postorder(child):
+                yield descendant
+        yield node
+
     def get_dataframe(self):
         start_time = time.time()
         logger.info("START aggregate locations, time = {}".format(start_time))
 
-        AggMemEff(self.draw_source, self.draw_sink, self.index_cols,
-                  'location_id', self.operator, chunksize=2
-                  ).run(self.loctree, include_leaves=False, n_processes=8,
-                        draw_filters=self.draw_filters)
+        chunksize, n_processes = self.get_chunking()
+        if self.streaming:
+            self.stream_aggregate(chunksize, n_processes)
+        else:
+            AggMemEff(self.draw_source, self.draw_sink, self.index_cols,
+                      'location_id', self.operator, chunksize=chunksize
+                      ).run(self.loctree, include_leaves=False,
+                            n_processes=n_processes,
+                            draw_filters=self.draw_filters)
 
         end_time = time.time()
         logger.info("location aggregation complete, time = {}"
@@ -176,7 +429,9 @@ def main():
     LocationAggregator(args.location_set_id, args.year_id, args.rei_id,
                        args.sex_id, args.measure_id, args.gbd_round_id,
                        args.n_draws, args.data_root, args.region_locs,
-                       args.write_out_star_ids).get_dataframe()
+                       args.write_out_star_ids, streaming=args.streaming,
+                       memory_budget=args.memory_budget,
+                       file_format=args.draw_file_format).get_dataframe()
 
 
 if __name__ == "__main__":
@@ -17,10 +17,13 @@ from dalynator.apply_pafs import risk_attr_burden_to_paf
 from dalynator.apply_pafs_to_df import ApplyPafsToDf
 from dalynator.compute_dalys import ComputeDalys
 from dalynator.compute_summaries import MetricConverter
+from dalynator.computation_graph import ComputationGraph
 from dalynator.data_container import DataContainer
 from dalynator.data_container import remove_unwanted_stars
 from dalynator.data_filter import PAFInputFilter
-from dalynator.data_sink import HDFDataSink
+from dalynator.constants import HDF_FORMAT, PARQUET_FORMAT
+from dalynator.data_sink import HDFDataSink, ParquetDataSink
+from dalynator.draw_store import SharedDrawStore
 from dalynator.get_rei_type_id import get_rei_type_id_df
 from dalynator.makedirs_safely import makedirs_safely
 from dalynator.sex_aggr import SexAggregator
@@ -117,10 +120,18 @@ def match_with_dimensions(df, dimensions_df):
     return df
 
 
-def aggregate_summaries(meas_df):
-    """Take the base-case DataFrame containing sex-specific, most-detailed-age
-    draws in number space and compute aggregates + paf-back calculations,
-    uploadable results"""
+def drop_age_standardized(df):
+    """Age standardized summaries are calculated in NUMBER space, so drop
+    the duplicates produced by age aggregation in RATE space"""
+    return df[df.age_group_id != gbd.age.AGE_STANDARDIZED]
+
+
+def build_summary_graph(meas_df):
+    """Build the DAG of aggregation, PAF back-calculation, rate conversion
+    and summarization steps for meas_df. Each intermediate is computed once
+    and released as soon as its last consumer has run.
+
+    Returns the graph and the list of summary nodes to evaluate"""
     draw_cols = list(meas_df.filter(like='draw').columns)
     index_cols = list(set(meas_df.columns) - set(draw_cols))
     MPGlobals.logger.info("AS index columns {}".format(repr(index_cols)))
@@ -132,42 +143,44 @@ def aggregate_summaries(meas_df):
                    draw_cols=draw_cols)
     bcp = partial(back_calc_pafs, n_draws=MPGlobals.data_container.n_draws)
 
-    # Number space summaries
-    base_summs = szdr(meas_df)
-    bs_summs = szdr(aggs(meas_df))
-    aa_ss_summs = szdr(agga(meas_df))
-    aa_bs_summs = szdr(agga(aggs(meas_df)))
-
-    # Back-calculated paf summaries
-    MPGlobals.logger.info("Begin bcp(meas_df)")
-    bcp_summs = szdr(bcp(meas_df))
-    MPGlobals.logger.info("Begin bcp(aggs(meas_df))")
-    bcp_bs_summs = szdr(bcp(aggs(meas_df)))
-    MPGlobals.logger.info("Begin bcp(agga(meas_df))")  # THIS
-    bcp_aa_ss_summs = szdr(bcp(agga(meas_df)))  # this includes age std
-    MPGlobals.logger.info("Begin bcp(agga(aggs(meas_df)))")
-    bcp_aa_bs_summs = szdr(bcp(agga(aggs(meas_df))))  # this includes age std
-
-    # Rate space summaries
-    meas_df = convert_to_rates(meas_df)
-    rate_summs = szdr(meas_df)
-    rbs_summs = szdr(aggs(meas_df))
-    raa_ss_summs = szdr(agga(meas_df))
-    raa_bs_summs = szdr(agga(aggs(meas_df)))
-
-    # Age standardized summaries have already been calculated
-    # in the NUMBER space summarization phase
-    raa_ss_summs = raa_ss_summs[raa_ss_summs.age_group_id !=
-                                gbd.age.AGE_STANDARDIZED]
-    raa_bs_summs = raa_bs_summs[raa_bs_summs.age_group_id !=
-                                gbd.age.AGE_STANDARDIZED]
-
-    summs = pd.concat([base_summs, bs_summs, aa_ss_summs, aa_bs_summs,
-                       bcp_summs, bcp_bs_summs, bcp_aa_ss_summs,
-                       bcp_aa_bs_summs, rate_summs, rbs_summs, raa_ss_summs,
-                       raa_bs_summs])
-
-    return summs
+    graph = ComputationGraph()
+    graph.add_input('num', meas_df)
+    graph.add_node('rate', convert_to_rates, 'num')
+
+    # Sex and age aggregates, in number and rate space. The age aggregates of
+    # number-space frames include the age standardized results
+    summary_nodes = []
+    for space in ['num', 'rate']:
+        graph.add_node(space + '_bs', aggs, space)
+        graph.add_node(space + '_aa', agga, space)
+        graph.add_node(space + '_aa_bs', agga, space + '_bs')
+
+        for node in [space, space + '_bs', space + '_aa', space + '_aa_bs']:
+            if space == 'rate' and node.startswith('rate_aa'):
+                graph.add_node(node + '_std', drop_age_standardized, node)
+                graph.add_node(node + '_summ', szdr, node + '_std')
+            else:
+                graph.add_node(node + '_summ', szdr, node)
+            summary_nodes.append(node + '_summ')
+
+        # Back-calculated paf summaries, number space only
+        if space == 'num':
+            for node in ['num', 'num_bs', 'num_aa', 'num_aa_bs']:
+                graph.add_node(node + '_bcp', bcp, node)
+                graph.add_node(node + '_bcp_summ', szdr, node + '_bcp')
+                summary_nodes.append(node + '_bcp_summ')
+
+    return graph, summary_nodes
+
+
+def aggregate_summaries(meas_df):
+    """Take the base-case DataFrame containing sex-specific, most-detailed-age
+    draws in number space and compute aggregates + paf-back calculations,
+    uploadable results"""
+    graph, summary_nodes = build_summary_graph(meas_df)
+    del meas_df
+    summs = graph.evaluate(summary_nodes)
+    return pd.concat(summs)
 
 
 def back_calc_pafs(df, n_draws):
@@ -211,7 +224,8 @@ def burdenate(key):
                          'measure_id', 'star_id']
     my_apply_pafs = ApplyPafsToDf(
         MPGlobals.pafs_filter.get_data_frame(), meas_df,
-        MPGlobals.args.n_draws)
+        MPGlobals.args.n_draws,
+        use_draw_cube=MPGlobals.args.use_draw_cube)
     meas_paf_df = my_apply_pafs.get_data_frame()
     draw_cols = list(meas_paf_df.filter(like='draw').columns)
     index_cols = list(set(meas_paf_df.columns) - set(draw_cols))
@@ -235,12 +249,15 @@ def burdenate(key):
     meas_df = pd.concat([meas_df, back_calc_pafs(meas_df, n_draws)])
     write_draws(meas_df, MPGlobals.args.out_dir, key,
                 MPGlobals.args.location_id, MPGlobals.args.year_id,
-                MPGlobals.args.write_out_star_ids)
+                MPGlobals.args.write_out_star_ids,
+                MPGlobals.args.draw_file_format)
     MPGlobals.logger.info("Done writing draws {}".format(key))
-    # By restricting to just NUMBER this function only returns Attributable
-    # Burden, not back-calculated PAFs
-    return {'key': key,
-            'draws': meas_df[meas_df.metric_id == gbd.metrics.NUMBER]}
+    # By restricting to just NUMBER this function only stores Attributable
+    # Burden, not back-calculated PAFs. Results go to the shared draw store
+    # rather than being pickled back to the parent
+    MPGlobals.draw_store.put(
+        key, meas_df[meas_df.metric_id == gbd.metrics.NUMBER])
+    return key
 
 
 def burdenate_caught(key):
@@ -268,7 +285,8 @@ def compute_dalys(ylds_df, ylls_df):
     daly_df = pd.concat([daly_df, back_calc_pafs(daly_df, n_draws)])
     write_draws(daly_df, MPGlobals.args.out_dir, 'daly',
                 MPGlobals.args.location_id, MPGlobals.args.year_id,
-                MPGlobals.args.write_out_star_ids)
+                MPGlobals.args.write_out_star_ids,
+                MPGlobals.args.draw_file_format)
     MPGlobals.logger.info("Done writing draws daly")
     return daly_df[daly_df.metric_id == gbd.metrics.NUMBER]
 
@@ -308,12 +326,15 @@ def summarize_draws(df, index_cols):
 def summarize_caught(key):
     """Try/except wrapper so that summaries can be produced in a
     multiprocessing.Pool without individual Processes getting hung on
-    exceptions"""
+    exceptions. Reads the draws for key from the shared draw store and
+    writes the summaries back to it, returning the summary key"""
     try:
-        meas_dict = [res for res in MPGlobals.results if res['key'] == key][0]
-        meas_df = meas_dict['draws']
+        meas_df = MPGlobals.draw_store.get(key)
         summs = aggregate_summaries(meas_df)
-        return summs
+        del meas_df
+        summ_key = get_summ_key(key)
+        MPGlobals.draw_store.put(summ_key, summs)
+        return summ_key
     except Exception as e:
         MPGlobals.logger.error("Summarize_caught Caught: {}\n".format(key))
         dump = traceback.format_exc()
@@ -321,6 +342,11 @@ def summarize_caught(key):
         return e
 
 
+def get_summ_key(key):
+    """Return the draw store key for the summaries of measure key"""
+    return '{}_summaries'.format(key)
+
+
 def convert_to_rates(df):
     """Convert the values in df from number to rate space"""
     MPGlobals.logger.info("start converting to rates, time = "
@@ -350,8 +376,9 @@ def get_summ_filename(draw_dir, risk_type, location_id, year_id, measure_id):
 
 
 def write_draws(df, out_dir, measure_label, location_id, year_id,
-                write_out_star_ids):
-    """Write draws to the appropriate file for the given loc-year-measure"""
+                write_out_star_ids, file_format=HDF_FORMAT):
+    """Write draws to the appropriate file for the given loc-year-measure, in
+    HDF or Parquet format"""
     if measure_label == 'death':
         measure_id = gbd.measures.DEATH
     elif measure_label == 'yll':
@@ -361,9 +388,12 @@ def write_draws(df, out_dir, measure_label, location_id, year_id,
     elif measure_label == 'daly':
         measure_id = gbd.measures.DALY
 
-    filename = get_input_args.calculate_output_filename(out_dir, measure_id,
-                                                        location_id, year_id)
-    sink = HDFDataSink(filename)
+    filename = get_input_args.calculate_output_filename(
+        out_dir, measure_id, location_id, year_id, file_format=file_format)
+    if file_format == PARQUET_FORMAT:
+        sink = ParquetDataSink(filename)
+    else:
+        sink = HDFDataSink(filename)
     df = remove_unwanted_stars(df, write_out_star_ids=write_out_star_ids)
     cols = get_index_columns(df)
     sink.write(df, id_cols=cols)
@@ -409,6 +439,7 @@ def run_pipeline_burdenator(args):
         turn_off_null_and_nan_check=args.turn_off_null_and_nan_check,
         cache_dir=args.cache_dir,
         raise_on_paf_error=args.raise_on_paf_error,
+        use_draw_cube=args.use_draw_cube,
     )
 
     # Fetch PAF input from RF team
@@ -437,35 +468,45 @@ def run_pipeline_burdenator(args):
         data_container['death']
 
     MPGlobals.data_container = data_container
-    pool_size = len(measures)
-    pool = Pool(pool_size)
-    results = map_and_raise(pool, burdenate_caught, measures)
-
-    # Compute DALYs and associated summaries, if requested
-    if args.write_out_dalys_paf:
-        if not (args.write_out_ylls_paf and args.write_out_ylds_paf):
-            raise ValueError("Can't compute risk-attributable DALYs unless "
-                             "both ylls and ylds are also provided")
-        measures.append('daly')
-        yld_df = [i['draws'] for i in results if i['key'] == 'yld'][0]
-        yll_df = [i['draws'] for i in results if i['key'] == 'yll'][0]
-        daly_df = compute_dalys(yld_df[yld_df.measure_id == gbd.measures.YLD],
-                                yll_df)
-        results.append({'key': 'daly', 'draws': daly_df})
-
-    # Write out meta-information for downstream aggregation step
-    meta_df = pd.concat([get_dimensions(r['draws']) for r in results])
-    meta_df = aggregate_dimensions(meta_df)
-
-    # Set the results as a Global, for use in summarization Pool
-    MPGlobals.results = results
-
-    # Summarize
-    pool_size = len(measures)
-    pool = Pool(pool_size)
-    summ_df = map_and_raise(pool, summarize_caught, measures)
-
-    summ_df = pd.concat(summ_df)
+
+    # Workers exchange draws through a store in shared memory instead of
+    # pickling them back through the Pool
+    draw_store = SharedDrawStore()
+    MPGlobals.draw_store = draw_store
+    try:
+        pool_size = len(measures)
+        pool = Pool(pool_size)
+        map_and_raise(pool, burdenate_caught, measures)
+
+        # Compute DALYs and associated summaries, if requested
+        if args.write_out_dalys_paf:
+            if not (args.write_out_ylls_paf and args.write_out_ylds_paf):
+                raise ValueError("Can't compute risk-attributable DALYs "
+                                 "unless both ylls and ylds are also "
+                                 "provided")
+            measures.append('daly')
+            yld_df = draw_store.get('yld')
+            yll_df = draw_store.get('yll')
+            daly_df = compute_dalys(
+                yld_df[yld_df.measure_id == gbd.measures.YLD], yll_df)
+            del yld_df, yll_df
+            draw_store.put('daly', daly_df)
+            del daly_df
+
+        # Write out meta-information for downstream aggregation step
+        meta_df = pd.concat([get_dimensions(draw_store.get_index(key))
+                             for key in measures])
+        meta_df = aggregate_dimensions(meta_df)
+
+        # Summarize
+        pool_size = len(measures)
+        pool = Pool(pool_size)
+        summ_keys = map_and_raise(pool, summarize_caught, measures)
+        summ_df = pd.concat([draw_store.get(summ_key)
+                             for summ_key in summ_keys])
+    finally:
+        draw_store.close()
+
     summ_df = match_with_dimensions(summ_df, meta_df)
     summ_df.reset_index(drop=True, inplace=True)
 
@@ -95,24 +95,55 @@ def df_to_csv(this_df, index_cols, this_out_dir, out_file_basename,
     write_csv(new_df, filename, write_columns_order=write_columns_order)
 
 
+# Number of columns checked at a time for nulls and infs, bounding the size
+# of the temporary boolean arrays for wide draw frames
+REJECT_COLUMN_BLOCK_SIZE = 100
+
+
+def find_rejected_rows(df, block_size=REJECT_COLUMN_BLOCK_SIZE):
+    """Return boolean row masks (has_null, has_inf) for df in one pass over
+    its columns, block by block. Non-numeric columns can only be null."""
+    has_null = np.zeros(len(df), dtype=bool)
+    has_inf = np.zeros(len(df), dtype=bool)
+    numeric_cols = df.select_dtypes(include=[np.number]).columns
+    for col in df.columns.difference(numeric_cols):
+        has_null |= df[col].isnull().values
+
+    numeric_cols = list(numeric_cols)
+    for start in range(0, len(numeric_cols), block_size):
+        block = df[numeric_cols[start:start + block_size]].values
+        if block.dtype.kind in 'iub':
+            continue
+        bad = ~np.isfinite(block)
+        bad_rows = bad.any(axis=1)
+        if bad_rows.any():
+            bad_block = block[bad_rows]
+            has_null[bad_rows] |= np.isnan(bad_block).any(axis=1)
+            has_inf[bad_rows] |= np.isinf(bad_block).any(axis=1)
+    return has_null, has_inf
+
+
 def separate_rejected_data_to_csv(df, filename):
+    """Write rows of df with nulls to NONE_<filename> and rows with infs to
+    INF_<filename>, and return the remaining rows"""
     a = filename.split("/")
     outpath = filename[0:filename.find(a[-1])]
     logger.debug("in write_csv {} before catch null/inf df shape {}"
                  .format(filename, df.shape))
 
-    nan_rows = df[df.isnull().T.any().T]
-    inf_rows = df[np.isinf(df).T.any().T]
+    has_null, has_inf = find_rejected_rows(df)
 
-    if not nan_rows.empty:
+    if has_null.any():
         logger.debug("find NaN value in df when write summaries")
-        df = pd.concat([df, nan_rows]).drop_duplicates(keep=False)
-        nan_rows.to_csv("{}NONE_{}".format(outpath, a[-1]), index=False)
+        df[has_null].to_csv("{}NONE_{}".format(outpath, a[-1]), index=False)
 
-    if not inf_rows.empty:
+    if has_inf.any():
         logger.debug("find inf value in df when write summaries")
-        df = pd.concat([df, inf_rows]).drop_duplicates(keep=False)
-        inf_rows.to_csv("{}INF_{}".format(outpath, a[-1]), index=False)
+        df[has_inf].to_csv("{}INF_{}".format(outpath, a[-1]), index=False)
+
+    rejected = has_null | has_inf
+    if rejected.any():
+        df = df[~rejected]
 
     logger.debug("in write_csv after catch null/inf df shape {}"
                  .format(df.shape))
@@ -5,53 +5,39 @@ import numpy as np
 import pandas as pd
 
 
-def old_Tx(df):
-    ###############################################
-    #Return Tx for terminal age group, nLx
-    #otherwise
-    ###############################################
-    if df['age_group_id'] == 24:
-        return df['Tx']
-    return df['nLx']
-
-
-def adjust_Lx(df):
-    ###############################################
-    #Calculate adjusted Lx uing nLx and YLD rate
-    ###############################################
-    adj_Lx = df['nLx'] * (1 - df['yld_rate'])
-    return adj_Lx
-
-
-def adjust_Tx(df):
-    ###############################################
-    #Helper function for calculating adjusted Tx,
-    #is applied to each age group consecutively
-    #starting with oldest
-    ###############################################
-    if ~np.isnan(df['tmp_Tx']):
-        return df['tmp_Tx']
-    else:
-        return df['adj_Tx']
+# HALE age groups in order of actual age. The last is the terminal age
+# group, whose Tx is used in place of nLx
+HALE_AGES = [28] + list(range(5, 21)) + [30, 31, 32, 235]
+AGE_POSITION = {age: pos for pos, age in enumerate(HALE_AGES)}
+TERMINAL_AGE = 235
 
 
 def calc_hale(df):
     ###############################################
-    #Calculate hale from adjusted Tx and lx
+    #Calculate HALE for each row of the merged life
+    #table and YLD draws. Lays the draws out as a
+    #(sex/year/location/draw, age) array so that
+    #adjusted Tx is a reverse cumulative sum over
+    #age, then divides by lx
     ###############################################
-    hale = df['adj_Tx'] / df['lx']
-    return hale
+    groups = df.groupby(['sex_id', 'year_id', 'location_id', 'draw'],
+                        sort=False).ngroup().values
+    age_pos = df['age_group_id'].map(AGE_POSITION).values
+    nLx = np.where(df['age_group_id'] == TERMINAL_AGE, df['Tx'], df['nLx'])
+
+    adj_Lx = np.zeros((groups.max() + 1, len(HALE_AGES)))
+    adj_Lx[groups, age_pos] = nLx * (1 - df['yld_rate'].values)
+    adj_Tx = np.cumsum(adj_Lx[:, ::-1], axis=1)[:, ::-1]
+    return adj_Tx[groups, age_pos] / df['lx'].values
 
 
 def run_hale_calc(hale_tmp, lt_tmp, yld_tmp, location, year):
     ###############################################
     #Pulls in formatted life table and YLD draws
     #generated in compile_lt and compile_yld,
-    #respectively. Renames age groups to be
-    #consecutive based on actual age. Calculates
-    #HALE using helper functions above. Resets age
-    #groups. Converts from long to wide. Saves
-    #formatted draws and summarizes
+    #respectively. Calculates HALE using
+    #calc_hale above. Converts from long to wide.
+    #Saves formatted draws and summarizes
     ###############################################
     index_cols = ['sex_id', 'age_group_id', 'year_id', 'location_id', 'draw']
     
@@ -60,42 +46,11 @@ def run_hale_calc(hale_tmp, lt_tmp, yld_tmp, location, year):
     yld_draws = pd.read_csv('{yld_tmp}/{location}_{year}_draws.csv'.format(
             yld_tmp=yld_tmp, location=location, year=year))
 
-    # Combine draws, rename/subset as necessary
+    # Combine draws, subset as necessary
     combo_draws = yld_draws.merge(lt_draws, on=index_cols)
-    ages = list(range(5, 21)) + list(range(30, 33)) + [28, 235]
-    combo_draws = combo_draws.loc[combo_draws['age_group_id'].isin(ages)]
-    combo_draws.loc[combo_draws['age_group_id'] == 28, 'age_group_id'] = 4
-    combo_draws.loc[combo_draws['age_group_id'] == 30, 'age_group_id'] = 21
-    combo_draws.loc[combo_draws['age_group_id'] == 31, 'age_group_id'] = 22
-    combo_draws.loc[combo_draws['age_group_id'] == 32, 'age_group_id'] = 23
-    combo_draws.loc[combo_draws['age_group_id'] == 235, 'age_group_id'] = 24
-    
-    # Start actual math
-    combo_draws['nLx'] = combo_draws.apply(old_Tx, axis=1)
-    combo_draws['adj_Lx'] = combo_draws.apply(adjust_Lx, axis=1)
-    combo_draws['adj_Tx'] = None
-    for age in list(range(24, 3, -1)):
-        temp = combo_draws.loc[combo_draws['age_group_id'] >= age]
-        temp = temp.groupby(['year_id', 'sex_id', 'draw',
-                             'location_id']).sum().reset_index()
-        temp['tmp_Tx'] = temp['adj_Lx']
-        temp['age_group_id'] = age
-        temp = temp[index_cols + ['tmp_Tx']]
-        combo_draws = combo_draws.merge(temp, on=index_cols, how='left')
-        ###############################################
-        #This is where adjust_Tx gets applied
-        ###############################################
-        combo_draws['adj_Tx'] = combo_draws.apply(adjust_Tx, axis=1)
-        combo_draws.drop('tmp_Tx', axis=1, inplace=True)
-    combo_draws['HALE'] = combo_draws.apply(calc_hale, axis=1)
-    # End actual math
-    
-    combo_draws.loc[combo_draws['age_group_id'] == 4, 'age_group_id'] = 28
-    combo_draws.loc[combo_draws['age_group_id'] == 21, 'age_group_id'] = 30
-    combo_draws.loc[combo_draws['age_group_id'] == 22, 'age_group_id'] = 31
-    combo_draws.loc[combo_draws['age_group_id'] == 23, 'age_group_id'] = 32
-    combo_draws.loc[combo_draws['age_group_id'] == 24, 'age_group_id'] = 235
-    
+    combo_draws = combo_draws.loc[combo_draws['age_group_id'].isin(HALE_AGES)]
+    combo_draws['HALE'] = calc_hale(combo_draws)
+
     combo_long = combo_draws[index_cols + ['HALE']].copy(deep=True)
     combo_wide = combo_long.pivot_table(index=['sex_id', 'age_group_id',
                                                'year_id', 'location_id'],
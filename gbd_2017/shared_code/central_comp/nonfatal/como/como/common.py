@@ -7,6 +7,8 @@ import tblib.pickling_support
 
 from dataframe_io.io_control.h5_io import read_hdf
 
+from dalynator.hierarchy_aggregator import HierarchyAggregator
+
 tblib.pickling_support.install()
 
 
@@ -54,36 +56,10 @@ def propagate_hierarchy(tree, df, dimension):
 
 
 def agg_hierarchy(tree, df, index_cols, data_cols, dimension):
-    # keep only the most detailed
-    thisdf = df.copy()
-    thisdf = thisdf[index_cols + data_cols]
-    leaves = [node.id for node in tree.leaves()]
-    thisdf = thisdf[thisdf[dimension].isin(leaves)]
-
-    # loop through levels from the most detailed
-    group_cols = [col for col in index_cols if col != dimension]
-    md = tree.max_depth()
-    lvl = md - 1
-    while lvl >= 0:
-        aggs = []
-        for node in tree.level_n_descendants(lvl):
-            child_ids = [c.id for c in node.children]
-            if len(child_ids) > 0:
-                agg = thisdf[thisdf[dimension].isin(child_ids)]
-                group_cols = [col for col in index_cols if col != dimension]
-                if not group_cols:
-                    group_cols = [dimension]
-                    agg[dimension] = node.id
-                agg = agg.groupby(group_cols).sum().reset_index()
-                agg[dimension] = node.id
-                aggs.append(agg)
-        aggs = pd.concat(aggs)
-        thisdf = pd.concat([thisdf, aggs])
-        lvl = lvl - 1
-
-    # combine
-    thisdf = thisdf.groupby(index_cols).sum().reset_index()
-    return thisdf
+    # keep only the most detailed and sum them up the hierarchy in one pass
+    aggregator = HierarchyAggregator.from_tree(tree)
+    return aggregator.aggregate(df, index_cols, data_cols, dimension,
+                                leaves_only=True)
 
 
 def maximize_hierarchy(tree, df, index_cols, data_cols, dimension):
@@ -1,14 +1,35 @@
-from multiprocessing import Process, Queue
+import os
+import shutil
+from multiprocessing import Process, Queue, cpu_count
 
 import numpy as np
 import pandas as pd
 from copy import deepcopy
+from scipy import sparse
 
 from como.cython_modules import fast_random
 
 
 sentinel = None
 
+# Maximum number of (draw, simulant, sequela) cells simulated at once by the
+# batched kernel. Bounds the memory of each tile to a few hundred MB.
+MAX_TILE_CELLS = 2 ** 24
+
+# Disability weights are capped just below 1 so that log(1 - dw) is finite
+MAX_DW = 1 - 1e-12
+
+
+def default_n_processes():
+    """Number of simulation processes to use when none is given: the slots
+    reserved for the job (NSLOTS, set by the scheduler), or the cores on the
+    node outside of a scheduled job, less two for the parent process"""
+    try:
+        n_slots = int(os.environ["NSLOTS"])
+    except (KeyError, ValueError):
+        n_slots = cpu_count()
+    return max(1, n_slots - 2)
+
 
 class IndependentComorbidity(object):
 
@@ -42,7 +63,12 @@ class IndependentComorbidity(object):
         self._ylds = []
         self._dw_counts = []
         self._sim_people = []
-        self._agg_causes = []
+
+        # aggregate cause tracking, set up once per simulation by
+        # _init_aggregate_causes
+        self._agg_cause_ids = None
+        self._agg_cause_mat = None
+        self._agg_cause_prev = None
 
         # Set random seed
         np.random.seed()
@@ -69,7 +95,12 @@ class IndependentComorbidity(object):
 
     @property
     def agg_causes(self):
-        df = pd.concat(self._agg_causes, axis=1)
+        if self._agg_cause_prev is None:
+            return pd.DataFrame(columns=["cause_id"])
+        draw_cols = ['draw_{}'.format(i)
+                     for i in range(self._agg_cause_prev.shape[1])]
+        df = pd.DataFrame(data=self._agg_cause_prev,
+                          index=self._agg_cause_ids, columns=draw_cols)
         df.index.rename("cause_id", inplace=True)
         return df.reset_index()
 
@@ -103,18 +134,32 @@ class IndependentComorbidity(object):
         self._ylds.append(
             pd.DataFrame(data={'draw_' + str(draw_num): yld_rate}))
 
+    def _init_aggregate_causes(self, n_agg_draws):
+        """Compile agg_cause_map into a sparse (cause, sequela) membership
+        matrix over the columns of the simulant matrix, and preallocate the
+        (cause, draw) prevalence array. Done once per simulation, after skip
+        logic has fixed the simulated sequela."""
+        acm = self.agg_cause_map
+        cause_ids, cause_idx = np.unique(acm.cause_id.values,
+                                         return_inverse=True)
+        in_sim = acm.sequela_id.isin(self.sim_df.index).values
+        seq_idx = np.searchsorted(self.sim_df.index.values,
+                                  acm.sequela_id.values[in_sim])
+        self._agg_cause_ids = cause_ids
+        self._agg_cause_mat = sparse.csr_matrix(
+            (np.ones(len(seq_idx)), (cause_idx[in_sim], seq_idx)),
+            shape=(len(cause_ids), len(self.sim_df)))
+        self._agg_cause_prev = np.zeros((len(cause_ids), n_agg_draws))
+
+    def _count_aggregate_causes(self, sim_people):
+        """Number of simulants with any sequela of each aggregate cause"""
+        has_cause = self._agg_cause_mat.dot(sim_people.T) > 0
+        return has_cause.sum(axis=1)
+
     def _track_aggregate_causes(self, sim_people, draw_num):
-        cause_prev = []
-        for cause_id, cframe in self.agg_cause_map.groupby('cause_id'):
-            cmask = self.sim_df.index.isin(cframe.sequela_id).astype(int)
-            cbool = np.where(cmask == 1)[0]
-            prev = (np.count_nonzero(sim_people[:, cbool].sum(axis=1)) /
-                    float(sim_people.shape[0]))
-            df = pd.DataFrame(
-                data={'draw_{}'.format(str(draw_num)): prev},
-                index=[cause_id])
-            cause_prev.append(df)
-        self._agg_causes.append(pd.concat(cause_prev))
+        self._agg_cause_prev[:, draw_num] = (
+            self._count_aggregate_causes(sim_people) /
+            float(sim_people.shape[0]))
 
     def _track_comos(self, sim_people, draw_num):
         """Keep track of # of comorbidities for diagnostic purposes"""
@@ -168,16 +213,106 @@ class IndependentComorbidity(object):
                   'dw_' + str(draw_num): combined_dw})
         self._sim_people.append(df)
 
+    def _simulate_draw_block(self, n_simulants, sim_mat, sim_dws_mat, draws,
+                             yld_sums, agg_counts):
+        """Simulate the draws in the slice 'draws' for all simulants at once,
+        tile by tile over simulants, and add the results into the
+        preallocated arrays in place:
+
+            yld_sums[sequela, draw] += sum over simulants with the sequela of
+                combined_dw / sum(dw)
+            agg_counts[cause, draw] += number of simulants with any sequela
+                of the cause
+
+        The combined disability weight 1 - prod(1 - dw) of each simulant is
+        computed as 1 - exp(sum(log(1 - dw))), so that both it and the sum
+        of dws are matrix products of the simulant matrix with the dws.
+        """
+        p = sim_mat[:, draws].T
+        dw = sim_dws_mat[:, draws].T
+        log_keep = np.log1p(-np.minimum(dw, MAX_DW))[:, :, np.newaxis]
+        dw = dw[:, :, np.newaxis]
+        n_draws, n_sequela = p.shape
+        chunk_size = max(1, MAX_TILE_CELLS // max(1, n_draws * n_sequela))
+        # aggregate causes are only tracked for the first few draws
+        n_agg = max(0, min(draws.stop, agg_counts.shape[1]) - draws.start)
+
+        for start in range(0, n_simulants, chunk_size):
+            n = min(chunk_size, n_simulants - start)
+            # (draw, simulant, sequela) boolean simulant matrices
+            sim_people = (np.random.random_sample((n_draws, n, n_sequela)) <
+                          p[:, np.newaxis, :])
+            people = sim_people.astype(np.float64)
+
+            # Combined dw of each simulant, attributed back to each sequela in
+            # proportion to its dw
+            denom = np.matmul(people, dw)
+            combined_dw = 1 - np.exp(np.matmul(people, log_keep))
+            denom[denom == 0] = 1
+            ratio = combined_dw / denom
+            yld_sums[:, draws] += np.matmul(
+                people.transpose(0, 2, 1), ratio)[:, :, 0].T
+            del people
+
+            for i in range(n_agg):
+                agg_counts[:, draws.start + i] += (
+                    self._count_aggregate_causes(sim_people[i]))
+
+    def simulate_batched(self, n_simulants, ylds=True, agg_causes=True,
+                         n_all_cause_draws=1000, draw_block_size=10):
+        """Simulate draw_block_size draws at a time with the vectorized
+        kernel in _simulate_draw_block, writing into preallocated result
+        arrays. Produces the same ylds and agg_causes results as simulate."""
+        sim_mat = self.sim_df.reset_index()[self.draw_cols].as_matrix()
+        sim_dws_mat = self.sim_dws_df.reset_index()[self.draw_cols].as_matrix()
+        n_draws = len(self.draw_cols)
+
+        # aggregate cause counts accumulate in the prevalence array
+        if agg_causes:
+            self._init_aggregate_causes(min(n_draws, n_all_cause_draws + 1))
+            agg_counts = self._agg_cause_prev
+        else:
+            agg_counts = np.zeros((0, 0))
+
+        yld_sums = np.zeros((sim_mat.shape[0], n_draws))
+        for start in range(0, n_draws, draw_block_size):
+            draws = slice(start, min(start + draw_block_size, n_draws))
+            print("simulating draws: {} to {}".format(
+                draws.start, draws.stop - 1))
+            self._simulate_draw_block(n_simulants, sim_mat, sim_dws_mat,
+                                      draws, yld_sums, agg_counts)
+
+        draw_names = ['draw_{}'.format(i) for i in range(n_draws)]
+        if ylds:
+            yld_sums *= sim_dws_mat
+            yld_sums /= n_simulants
+            self._ylds.append(pd.DataFrame(data=yld_sums, columns=draw_names))
+        if agg_causes:
+            agg_counts /= float(n_simulants)
+
     def simulate(self, n_simulants, ylds=True, agg_causes=True,
                  n_all_cause_draws=1000, comos=False,
-                 disability_distribution=False, sequela_by_simulant=False):
+                 disability_distribution=False, sequela_by_simulant=False,
+                 draw_block_size=None):
 
         # default skip logic
         if self.skip_df is None:
             self.compute_skips(2. / n_simulants)
 
+        if draw_block_size:
+            if comos or disability_distribution or sequela_by_simulant:
+                raise ValueError("The batched simulation kernel only tracks "
+                                 "ylds and aggregate causes")
+            return self.simulate_batched(
+                n_simulants, ylds=ylds, agg_causes=agg_causes,
+                n_all_cause_draws=n_all_cause_draws,
+                draw_block_size=draw_block_size)
+
         sim_mat = self.sim_df.reset_index()[self.draw_cols].as_matrix()
         sim_dws_mat = self.sim_dws_df.reset_index()[self.draw_cols].as_matrix()
+        if agg_causes:
+            self._init_aggregate_causes(
+                min(len(self.draw_cols), n_all_cause_draws + 1))
 
         for draw_num in range(len(self.draw_cols)):
             print("simulating draw: {}".format(draw_num))
@@ -206,10 +341,14 @@ class DependentComorbidity(object):
 
 class SimulationRunner(object):
 
-    def __init__(self, simulations={}):
+    def __init__(self, simulations={}, result_dir=None):
         self.simulations = simulations
         self.simulation_results = {}
 
+        # if set, each simulation's results are written here as soon as it
+        # finishes and only the path is kept in simulation_results
+        self.result_dir = result_dir
+
     def add_simulation_to_queue(self, simkey, sim, *args, **kwargs):
         self.simulations[simkey] = (sim, args, kwargs)
 
@@ -225,14 +364,72 @@ class SimulationRunner(object):
             try:
                 sim = self.run_single_simulation(simkey)
                 result = self.get_simulation_results(sim)
-                outq.put((simkey, result))
+                rows = self.result_rows(result)
+                result = self.sink_simulation_results(simkey, result)
+                outq.put((simkey, result, rows))
             except Exception as e:
                 outq.put(('simkey: {} '.format(simkey), e))
+            finally:
+                # this is the worker's copy, drop it so finished simulations
+                # don't accumulate in the worker
+                self.simulations[simkey] = None
 
     def get_simulation_results(self, simulation):
         return simulation.ylds, simulation.agg_causes
 
-    def run_all_simulations_mp(self, n_processes=23):
+    @staticmethod
+    def result_rows(result):
+        """Number of rows in each frame of a simulation's results"""
+        return tuple(len(df) for df in result)
+
+    def estimated_cost(self, simkey):
+        """Relative cost of a simulation, simulated sequela x draws"""
+        sim = self.simulations[simkey][0]
+        return len(sim.sim_df) * len(sim.draw_cols)
+
+    def scheduled_keys(self):
+        """Simulation keys, most expensive first. Idle workers pull the
+        next key off the shared queue, so the long simulations start early
+        and the short ones fill in around them at the end."""
+        return sorted(self.simulations.keys(), key=self.estimated_cost,
+                      reverse=True)
+
+    def _result_path(self, simkey):
+        if not isinstance(simkey, tuple):
+            simkey = (simkey,)
+        return os.path.join(
+            self.result_dir,
+            "sim_{}.pkl".format("_".join(str(k) for k in simkey)))
+
+    def sink_simulation_results(self, simkey, result):
+        """Write result to result_dir and return its path, or return
+        result unchanged if results are kept in memory"""
+        if self.result_dir is None:
+            return result
+        path = self._result_path(simkey)
+        pd.to_pickle(result, path)
+        return path
+
+    def load_simulation_results(self, simkey):
+        """Return the (ylds, agg_causes) results of simkey, reading them
+        from result_dir if they were written there"""
+        result = self.simulation_results[simkey][0]
+        if self.result_dir is not None:
+            result = pd.read_pickle(result)
+        return result
+
+    def simulation_result_rows(self, simkey):
+        """Number of rows in each of the (ylds, agg_causes) results of
+        simkey, without reading them"""
+        return self.simulation_results[simkey][1]
+
+    def remove_simulation_results(self):
+        if self.result_dir is not None:
+            shutil.rmtree(self.result_dir, ignore_errors=True)
+
+    def run_all_simulations_mp(self, n_processes=None):
+        if n_processes is None:
+            n_processes = default_n_processes()
         inq = Queue()
         outq = Queue()
 
@@ -246,7 +443,7 @@ class SimulationRunner(object):
             p.start()
 
         # run the silulations
-        for simkey in self.simulations.keys():
+        for simkey in self.scheduled_keys():
             inq.put(simkey)
 
         # make the workers die after
@@ -263,10 +460,69 @@ class SimulationRunner(object):
             p.join()
 
     def run_all_simulations_sp(self):
-        for simkey in self.simulations.keys():
+        for simkey in self.scheduled_keys():
             sim = self.run_single_simulation(simkey)
             result = self.get_simulation_results(sim)
-            self.simulation_results[simkey] = (result,)
+            rows = self.result_rows(result)
+            result = self.sink_simulation_results(simkey, result)
+            self.simulation_results[simkey] = (result, rows)
+            if self.result_dir is not None:
+                self.simulations[simkey] = None
+
+
+class _FrameStack(object):
+    """Stacks frames, whose total number of rows is known up front, into
+    arrays allocated once, so building the stacked frame holds it plus one
+    part in memory, rather than every part and their concatenation. Draw
+    columns are stacked into one 2d array that the stacked frame is built
+    on without copying. Parts must all have the same columns"""
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.n_filled = 0
+        self.columns = None
+        self.draw_cols = None
+        self.draws = None
+        self.index = None
+
+    def append(self, df, labels=()):
+        """Add the rows of df, with (column, value) pairs in labels added
+        as constant columns in front of df's own"""
+        labels = list(labels)
+        if self.columns is None:
+            self.columns = [col for col, _ in labels] + list(df.columns)
+        if len(df) == 0:
+            return
+        if self.draws is None:
+            self.draw_cols = [col for col in df.columns
+                              if col.startswith('draw_')]
+            self.draws = np.empty((self.n_rows, len(self.draw_cols)),
+                                  dtype=df[self.draw_cols].values.dtype)
+            self.index = dict(
+                [(col, np.empty(self.n_rows, dtype=np.asarray(val).dtype))
+                 for col, val in labels] +
+                [(col, np.empty(self.n_rows, dtype=df[col].dtype))
+                 for col in df.columns if col not in self.draw_cols])
+        rows = slice(self.n_filled, self.n_filled + len(df))
+        self.draws[rows] = df[self.draw_cols].values
+        for col, val in labels:
+            self.index[col][rows] = val
+        for col in df.columns:
+            if col not in self.draw_cols:
+                self.index[col][rows] = df[col].values
+        self.n_filled += len(df)
+
+    def frame(self):
+        """The stacked frame, with a fresh index"""
+        if self.draws is None:
+            return pd.DataFrame(columns=self.columns)
+        df = pd.DataFrame(self.draws[:self.n_filled], columns=self.draw_cols,
+                          copy=False)
+        draw_cols = set(self.draw_cols)
+        for i, col in enumerate(self.columns):
+            if col not in draw_cols:
+                df.insert(i, col, self.index[col][:self.n_filled])
+        return df
 
 
 class ComoSimulator(object):
@@ -286,30 +542,44 @@ class ComoSimulator(object):
 
     @property
     def ylds(self):
-        results = self.runner.simulation_results
-        df_list = []
-        for element in results.keys():
-            ylds = results[element][0][0].copy()
-            idx = pd.MultiIndex.from_tuples(
-                [element] * len(ylds), names=self._sim_idx)
-            ylds.index = idx
-            df_list.append(ylds.reset_index())
-        df = pd.concat(df_list)
-        df["measure_id"] = 3
-        df["sequela_id"] = df.sequela_id.astype(int)
-        return df
+        return self._collect_results(ylds=True, agg_causes=False)[0]
 
     @property
     def agg_causes(self):
-        results = self.runner.simulation_results
-        df_list = []
-        for element in results.keys():
-            agg_causes = results[element][0][1].copy()
-            idx = pd.MultiIndex.from_tuples(
-                [element] * len(agg_causes), names=self._sim_idx)
-            agg_causes.index = idx
-            df_list.append(agg_causes.reset_index())
-        return pd.concat(df_list)
+        return self._collect_results(ylds=False, agg_causes=True)[1]
+
+    def collect_results(self):
+        """Return (ylds, agg_causes) of all simulations, reading each
+        simulation's results only once"""
+        return self._collect_results(ylds=True, agg_causes=True)
+
+    def _collect_results(self, ylds, agg_causes):
+        """Stack the requested results of every simulation, with the
+        simulation's dimensions as columns. Results are read one simulation
+        at a time into frames allocated up front, so peak memory is the
+        stacked results plus one simulation's. Results that were not
+        requested are returned as None"""
+        elements = list(self.runner.simulation_results.keys())
+        rows = [self.runner.simulation_result_rows(element)
+                for element in elements]
+        ylds_stack = _FrameStack(sum(r[0] for r in rows))
+        agg_causes_stack = _FrameStack(sum(r[1] for r in rows))
+        for element in elements:
+            result = self.runner.load_simulation_results(element)
+            labels = list(zip(self._sim_idx, element))
+            if ylds:
+                ylds_stack.append(result[0], labels)
+            if agg_causes:
+                agg_causes_stack.append(result[1], labels)
+            del result
+
+        ylds_df = None
+        if ylds:
+            ylds_df = ylds_stack.frame()
+            ylds_df["measure_id"] = 3
+            ylds_df["sequela_id"] = ylds_df.sequela_id.astype(int)
+        agg_causes_df = agg_causes_stack.frame() if agg_causes else None
+        return ylds_df, agg_causes_df
 
     def create_simulations(self, simulation=IndependentComorbidity,
                            *args, **kwargs):
@@ -358,8 +628,21 @@ class ComoSimulator(object):
                 self.como_version.agg_cause_map)
             self.runner.add_simulation_to_queue(element, sim, *args, **kwargs)
 
-    def run_all_simulations(self, n_processes=23):
+    def run_all_simulations(self, n_processes=None, result_dir=None):
+        """Run every simulation. If result_dir is given, results are
+        streamed to files there as each simulation finishes, instead of
+        being held in memory, and read back one at a time by
+        collect_results. n_processes defaults to default_n_processes()"""
+        if n_processes is None:
+            n_processes = default_n_processes()
+        if result_dir is not None and not os.path.exists(result_dir):
+            os.makedirs(result_dir)
+        self.runner.result_dir = result_dir
         if n_processes > 1:
             self.runner.run_all_simulations_mp(n_processes=n_processes)
         else:
             self.runner.run_all_simulations_sp()
+
+    def remove_results(self):
+        """Delete results streamed to disk by run_all_simulations"""
+        self.runner.remove_simulation_results()
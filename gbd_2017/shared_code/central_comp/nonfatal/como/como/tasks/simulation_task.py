@@ -1,5 +1,7 @@
 import os
 import argparse
+import shutil
+import tempfile
 
 import pandas as pd
 
@@ -18,6 +20,11 @@ from como.tasks.simulation_input_task import SimulationInputTaskFactory
 
 this_file = os.path.realpath(__file__)
 
+# Slots reserved for each simulation task, and the simulation processes it
+# runs, leaving room for the parent process
+SIMULATION_SLOTS = 25
+SIMULATION_PROCESSES = SIMULATION_SLOTS - 2
+
 
 class SimulationTaskFactory(object):
 
@@ -31,7 +38,8 @@ class SimulationTaskFactory(object):
                                       "sex_id": sex_id,
                                       "year_id": year_id})
 
-    def get_task(self, location_id, sex_id, year_id, n_simulants, n_processes):
+    def get_task(self, location_id, sex_id, year_id, n_simulants,
+                 n_processes=SIMULATION_PROCESSES):
         # get upstream
         dep_name = SimulationInputTaskFactory.get_task_name(location_id,
                                                             sex_id)
@@ -51,7 +59,7 @@ class SimulationTaskFactory(object):
             ],
             name=name,
             upstream_tasks=[dep],
-            slots=25,
+            slots=SIMULATION_SLOTS,
             mem_free=100,
             max_attempts=5,
             max_runtime=(60 * 60 * 3),
@@ -123,21 +131,37 @@ class SimulationTask(object):
         dws_inputs.get_id_dws()
         return dws_inputs
 
-    def run_task(self, n_simulants, n_processes):
+    @property
+    def scratch_dir(self):
+        """Directory in the COMO version's scratch space for the results of
+        each simulation, before they are combined"""
+        return os.path.join(self.como_version.como_dir, "scratch")
+
+    def run_task(self, n_simulants, n_processes=None, draw_block_size=None):
         # compile inputs
         long_en_prev = self.injuries_long_term_prev
         short_en_prev = self.injuries_short_term_prev
         seq_prev = self.sequela_prev
 
-        # run simulation
+        # run simulation, keeping each simulation's results on the shared
+        # scratch space rather than in memory or on the node's local disk
         prevalence_df = pd.concat(
             [seq_prev, self._prepare_ncode_aggregates(long_en_prev.copy())])
         prevalence_df["measure_id"] = 5
-        como = self.simulate(prevalence_df, n_simulants, n_processes)
-
-        # get the inputs for final ylds
-        seq_dim = self.dimensions.get_sequela_dimensions(3)
-        simulated_ylds = como.ylds[seq_dim.index_names + seq_dim.data_list()]
+        if not os.path.exists(self.scratch_dir):
+            os.makedirs(self.scratch_dir)
+        result_dir = tempfile.mkdtemp(prefix="sim_", dir=self.scratch_dir)
+        try:
+            como = self.simulate(prevalence_df, n_simulants, n_processes,
+                                 draw_block_size, result_dir=result_dir)
+
+            # get the inputs for final ylds
+            seq_dim = self.dimensions.get_sequela_dimensions(3)
+            simulated_ylds, simulated_agg_causes = como.collect_results()
+            simulated_ylds = simulated_ylds[
+                seq_dim.index_names + seq_dim.data_list()]
+        finally:
+            shutil.rmtree(result_dir, ignore_errors=True)
         en_ylds = self._compute_en_ylds(
             simulated_ylds, long_en_prev, self.injuries_short_term_ylds)
 
@@ -163,18 +187,21 @@ class SimulationTask(object):
 
         # final cause prevalence
         df = self._compute_cause_prev(prevalence_df, long_en_prev,
-                                      short_en_prev, como.agg_causes)
+                                      short_en_prev, simulated_agg_causes)
         self._ss_factory.cause_result_sink.push(
             df, append=False, complib='blosc:zstd', complevel=1)
 
-    def simulate(self, prevalence_df, n_simulants, n_processes):
+    def simulate(self, prevalence_df, n_simulants, n_processes=None,
+                 draw_block_size=None, result_dir=None):
         sim_idx = self.dimensions.get_simulation_dimensions(5)
 
         # simulate
         como_sim = ComoSimulator(
             self.como_version, sim_idx, prevalence_df, self.disability_weights)
-        como_sim.create_simulations(n_simulants=n_simulants)
-        como_sim.run_all_simulations(n_processes=n_processes)
+        como_sim.create_simulations(n_simulants=n_simulants,
+                                    draw_block_size=draw_block_size)
+        como_sim.run_all_simulations(n_processes=n_processes,
+                                     result_dir=result_dir)
         return como_sim
 
     def _compute_en_ylds(self, simulated_ylds, long_term_en_prev,
@@ -334,11 +361,17 @@ if __name__ == "__main__":
     parser.add_argument(
         "--n_processes",
         type=int,
-        default=23,
-        help="how many subprocesses to use")
+        default=None,
+        help="how many subprocesses to use, defaults to the slots reserved "
+             "for the job less two")
+    parser.add_argument(
+        "--draw_block_size",
+        type=int,
+        default=None,
+        help="simulate this many draws at once with the batched kernel")
     args = parser.parse_args()
 
     cv = ComoVersion(args.como_dir)
     cv.load_cache()
     task = SimulationTask(cv, args.location_id, args.sex_id, args.year_id)
-    task.run_task(args.n_simulants, args.n_processes)
+    task.run_task(args.n_simulants, args.n_processes, args.draw_block_size)
@@ -72,8 +72,7 @@ class ComoWorkFlow(object):
                 location_id=slices[0],
                 sex_id=slices[1],
                 year_id=slices[2],
-                n_simulants=n_simulants,
-                n_processes=23)
+                n_simulants=n_simulants)
             self.dag.add_task(sim_task)
 
     def _add_loc_aggregation_tasks(self, agg_loc_set_versions):
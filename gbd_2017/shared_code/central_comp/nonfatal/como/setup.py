@@ -27,9 +27,11 @@ setup(
         "pandas",
         "sqlalchemy",
         "numpy",
+        "scipy",
         "pymysql",
         "hierarchies",
-        "db_tools"],
+        "db_tools",
+        "dalynator"],
     package_data={
         'como': ['config/*', 'dws/combine/*', '__version__.txt']},
     include_package_data=True,
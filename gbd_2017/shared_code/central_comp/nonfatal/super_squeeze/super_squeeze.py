@@ -3,9 +3,9 @@ import argparse
 from multiprocessing import Pool
 from functools import partial
 
+import numpy as np
 import pandas as pd
 
-from core_maths.scale_split import scale
 from get_draws.sources.epi import Epi
 from get_draws.transforms.automagic import automagic_age_sex_agg
 from gbd_artifacts.exceptions import NoBestVersionError
@@ -24,22 +24,32 @@ stage_key = {
     'blind': 'blind_noepi_noid'}
 
 
-def squeeze_draws(to_squeeze, envelope, scale_up):
-    for draw in drawcols:
-        if (to_squeeze[draw].sum() > envelope[draw]) or scale_up:
-            to_squeeze = scale(
-                to_squeeze,
-                draw,
-                scalar=envelope[draw])
-    return to_squeeze
+def scale_draws(draws, envelope, scale_up):
+    """Rescale each column of the (rows, draws) array so that it sums to
+    envelope, for the draws where the column sum exceeds the envelope, or
+    for every draw if scale_up. Draws that sum to zero are left at zero."""
+    totals = draws.sum(axis=0)
+    if scale_up:
+        exceeded = np.ones(len(totals), dtype=bool)
+    else:
+        exceeded = totals > envelope
+    rescale = exceeded & (totals > 0)
+    factors = np.ones(len(totals))
+    factors[rescale] = envelope[rescale] / totals[rescale]
+    return draws * factors
 
 
 def squeeze_age_group(age_group_id, unsqueezed, env_dict):
 
     try:
-        # Get envelope
-        sqzd = unsqueezed[unsqueezed['age_group_id'] == age_group_id]
-        sqzd["locked"] = False
+        # Get envelope. The draws are squeezed in place in a single array,
+        # with the locked/squeezable partition kept as boolean masks
+        sqzd = unsqueezed[unsqueezed['age_group_id'] == age_group_id].copy()
+        draws = sqzd[drawcols].values.astype(float)
+        locked = np.zeros(len(sqzd), dtype=bool)
+        dropped = np.zeros(len(sqzd), dtype=bool)
+        squeeze_yes = (sqzd['squeeze'] == "yes").values
+        squeeze_no = (sqzd['squeeze'] == "no").values
         for imp in ['blind', 'epi', 'id_bord', 'id_mild', 'id_mod', 'id_sev',
                     'id_prof']:
             print('Running %s %s' % (age_group_id, imp))
@@ -55,25 +65,24 @@ def squeeze_age_group(age_group_id, unsqueezed, env_dict):
                 scale_up = True
 
             # Squeeze to envelope if exceeded
-            imp_bin = (sqzd['i_%s' % imp] == 1)
-            imp_prev = sqzd[imp_bin]
-            other_prev = sqzd[~imp_bin]
-
-            squeezable = imp_prev[~(imp_prev.locked) &
-                                  (imp_prev['squeeze'] == "yes")]
-            locked = imp_prev[(imp_prev.locked) |
-                              (imp_prev['squeeze'] == "no")]
+            imp_bin = (sqzd['i_%s' % imp] == 1).values & ~dropped
+            squeezable = imp_bin & ~locked & squeeze_yes
+            fixed = imp_bin & (locked | squeeze_no)
+            # rows of this impairment that are neither are not carried on
+            dropped |= imp_bin & ~(squeezable | fixed)
 
             env = env_dict[imp].copy()
             env = env[env.age_group_id.astype(float).astype(int) ==
                       int(float(age_group_id))]
-            env = env[drawcols].squeeze() * env_frac - locked[drawcols].sum()
-            env = env.clip(lower=0)
-            squeezable = squeeze_draws(squeezable, env, scale_up)
-            squeezable["locked"] = True
-            sqzd = pd.concat([other_prev, locked, squeezable])
-
-        return sqzd
+            env = (env[drawcols].squeeze().values * env_frac -
+                   draws[fixed].sum(axis=0))
+            env = env.clip(min=0)
+            draws[squeezable] = scale_draws(draws[squeezable], env, scale_up)
+            locked |= squeezable
+
+        sqzd[drawcols] = draws
+        sqzd["locked"] = locked
+        return sqzd[~dropped]
     except Exception as e:
         return ('error', e)
 
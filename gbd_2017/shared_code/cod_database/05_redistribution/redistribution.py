@@ -1,6 +1,8 @@
 
 import pandas as pd
 import numpy as np
+from scipy import sparse
+import hashlib
 import json
 import os
 from cod_process import CodProcess
@@ -13,57 +15,121 @@ def get_cause_restrictions(cause_map):
     return restrictions.set_index('cause').to_dict()
 
 
-def eval_condition(x):
-    age = x['age']
-    sex = x['sex']
-    super_region = x['super_region']
-    year_id = x['year_id']
-
-    country = x['country']
-    region = x['region']
-    nid = x['nid']
-
-    condition = x['restrictions']
-    return eval(condition)
+# proportion metadata columns that cause restrictions can refer to
+RESTRICTION_VARIABLES = [
+    'age', 'sex', 'super_region', 'year_id', 'country', 'region', 'nid'
+]
+
+
+def compile_restriction(condition):
+    """Compile a cause restriction into a function of proportion metadata.
+
+    The function returns a boolean array with one value per metadata row.
+    The condition is evaluated once per distinct combination of the
+    variables it uses, on whole columns at a time when it only uses
+    operators that work on arrays. Conditions that need scalars (e.g. 'and',
+    'not', chained comparisons or function calls) are evaluated one
+    combination at a time.
+    """
+    code = compile(condition, '<restriction>', 'eval')
+    names = [n for n in RESTRICTION_VARIABLES if n in code.co_names]
+    vectorize = set(code.co_names) <= set(names)
+
+    def evaluate(values):
+        if vectorize:
+            try:
+                result = eval(code, {}, {n: values[n].values for n in names})
+                if np.ndim(result) == 0:
+                    return np.repeat(bool(result), len(values))
+                result = np.asarray(result)
+                if result.dtype == bool and result.shape == (len(values),):
+                    return result
+            except (TypeError, ValueError):
+                pass
+        return np.array([
+            bool(eval(code, globals(), dict(zip(names, row))))
+            for row in values[names].itertuples(index=False)
+        ], dtype=bool)
+
+    def predicate(proportion_metadata):
+        if not names:
+            return np.repeat(bool(eval(code, globals(), {})),
+                             len(proportion_metadata))
+        values = proportion_metadata[names].drop_duplicates()
+        values = values.reset_index(drop=True)
+        values['eval'] = evaluate(values)
+        return proportion_metadata[names].merge(
+            values, on=names, how='left')['eval'].values
+
+    return predicate
 
 
 def evaluate_cause_restrictions(cause_map, proportion_metadata):
-
-    prop_metadata = proportion_metadata.copy()
-    cmap = cause_map.copy()
-
-    restrictions = cause_map[['restrictions']].drop_duplicates()
-    restrictions = restrictions.reset_index(drop=True)
-    restrictions['restriction_id'] = restrictions.index
-
-    restrictions['join_key'] = 1
-    prop_metadata['join_key'] = 1
-    prop_restrictions = prop_metadata.merge(
-        restrictions,
-        on='join_key'
-    ).drop('join_key', axis=1)
-
-    prop_restrictions['eval'] = prop_restrictions.apply(
-        lambda x: eval_condition(x), axis=1
-    )
-
-    restrict_dict = restrictions.set_index(
-        'restrictions', verify_integrity=True
-    ).to_dict()['restriction_id']
-
-    cmap['restriction_id'] = cmap['restrictions'].map(restrict_dict)
-    cmap = cmap[['cause', 'restriction_id']]
-    prop_ids = prop_metadata[['proportion_id']]
-    cmap['join_key'] = 1
-    prop_ids['join_key'] = 1
-    cm_eval = cmap.merge(prop_ids, on='join_key').drop('join_key', axis=1)
-
-    cm_eval = cm_eval.merge(
-        prop_restrictions, on=['proportion_id', 'restriction_id']
+    """Evaluate the restrictions of every cause for every proportion_id.
+
+    Each distinct restriction is compiled and evaluated once. Returns one
+    row per cause map row and proportion_id, with the boolean 'eval'.
+    """
+    restrictions = cause_map['restrictions'].unique()
+    evaluated = {
+        r: compile_restriction(r)(proportion_metadata) for r in restrictions
+    }
+    cause_eval = np.array([evaluated[r] for r in cause_map['restrictions']])
+
+    proportion_ids = proportion_metadata['proportion_id'].values
+    cm_eval = pd.DataFrame({
+        'cause': np.repeat(cause_map['cause'].values, len(proportion_ids)),
+        'proportion_id': np.tile(proportion_ids, len(cause_map)),
+        'eval': cause_eval.ravel()
+    })
+    return cm_eval[['cause', 'proportion_id', 'eval']]
+
+
+def cause_restrictions_key(cause_map, proportion_metadata):
+    """Hash of everything that evaluate_cause_restrictions depends on: the
+    cause map restrictions and the proportion metadata they are evaluated
+    against"""
+    hasher = hashlib.sha1()
+    meta_cols = ['proportion_id'] + [
+        col for col in RESTRICTION_VARIABLES if col in proportion_metadata
+    ]
+    for df in [cause_map[['cause', 'restrictions']],
+               proportion_metadata[meta_cols]]:
+        text = df.to_csv(index=False)
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        hasher.update(text)
+    return hasher.hexdigest()
+
+
+def get_cause_restrictions_evaluated(cause_map, proportion_metadata,
+                                     cache_dir=None, cache_name='all',
+                                     force_rerun=False):
+    """Evaluated cause restrictions, from a cache in cache_dir if available.
+
+    There is one cache file per cache_name (e.g. per nid and extract type),
+    overwritten in place whenever it goes stale. It stores the
+    cause_restrictions_key it was evaluated for, and is only reused when
+    the cause map restrictions and proportion metadata still hash to it.
+    """
+    if cache_dir is None:
+        return evaluate_cause_restrictions(cause_map, proportion_metadata)
+    cache_file = os.path.join(
+        cache_dir, "cause_restrictions_{}.pkl".format(cache_name)
     )
-    assert cm_eval['eval'].notnull().all()
-    cm_eval = cm_eval[['cause', 'proportion_id', 'eval']]
-
+    key = cause_restrictions_key(cause_map, proportion_metadata)
+    if not force_rerun and os.path.isfile(cache_file):
+        cached_key, cm_eval = pd.read_pickle(cache_file)
+        if cached_key == key:
+            print_log_message("Reading evaluated cause restrictions from "
+                              "{}".format(cache_file))
+            return cm_eval
+    cm_eval = evaluate_cause_restrictions(cause_map, proportion_metadata)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+    pd.to_pickle((key, cm_eval), tmp_file)
+    os.rename(tmp_file, cache_file)
     return cm_eval
 
 
@@ -502,8 +568,18 @@ def data_has_any_package_garbage(data, package):
 def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
                        package_folder, residual_cause='cc_code',
                        diagnostic_output=False, first_and_last_only=False,
-                       rerun_cause_map=True):
-    """Most granular method of whole redistribution process."""
+                       rerun_cause_map=False, sparse_engine=True,
+                       cause_map_cache_dir=None):
+    """Most granular method of whole redistribution process.
+
+    With sparse_engine, packages are applied by a SparseRedistributor
+    instead of get_proportions and redistribute_garbage, which gives the
+    same results without regrouping the data after each package.
+
+    Evaluated cause restrictions are cached in cause_map_cache_dir, one
+    file per nid and extract type that is reevaluated whenever the cause
+    map or proportion metadata change; rerun_cause_map ignores the cache.
+    """
     data, signature_metadata, proportion_metadata = prep_data(
         input_data,
         signature_ids,
@@ -513,18 +589,18 @@ def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
     print_log_message("Importing packages")
     packages = get_packages(package_folder, cause_map)
     print_log_message("Evaluating cause map restrictions")
-    nid = int(input_data.nid.unique().item())
-    extract_type_id = int(input_data.extract_type_id.unique().item())
-    cm_file = "FILEPATH".format(nid, extract_type_id)
-    if not os.path.isfile(cm_file):
-        rerun_cause_map = True
-    if rerun_cause_map:
-        cause_map_evaluated = evaluate_cause_restrictions(
-            cause_map,
-            proportion_metadata
-        )
-    else:
-        cause_map_evaluated = pd.read_csv(cm_file)
+    cache_name = 'all'
+    if cause_map_cache_dir is not None:
+        nid = int(input_data.nid.unique().item())
+        extract_type_id = int(input_data.extract_type_id.unique().item())
+        cache_name = "{}_{}".format(nid, extract_type_id)
+    cause_map_evaluated = get_cause_restrictions_evaluated(
+        cause_map,
+        proportion_metadata,
+        cache_dir=cause_map_cache_dir,
+        cache_name=cache_name,
+        force_rerun=rerun_cause_map
+    )
     print_log_message("Run redistribution!")
     diagnostics_all = []
     seq = 0
@@ -532,9 +608,17 @@ def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
         first = packages[0]
         last = packages[-1]
         packages = [first, last]
+    engine = None
+    if sparse_engine:
+        engine = SparseRedistributor(data, proportion_metadata, packages,
+                                     cause_map_evaluated,
+                                     residual_cause=residual_cause)
     for package in packages:
 
-        if not data_has_any_package_garbage(data, package):
+        if engine is not None:
+            if not engine.has_garbage(package):
+                continue
+        elif not data_has_any_package_garbage(data, package):
             continue
 
         print_log_message(
@@ -544,25 +628,31 @@ def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
             "    package_description: {}".format(
                 package['package_description'])
         )
-        print_log_message("        Deaths before = " + str(data.freq.sum()))
-        print_log_message("        Rows before = " + str(len(data)))
-        print_log_message("            ... calculating proportions")
-        proportions = get_proportions(
-            data,
-            proportion_metadata,
-            package,
-            cause_map_evaluated,
-            residual_cause=residual_cause
-        )
-        print_log_message("            ... redistributing data")
-        data, diagnostics = redistribute_garbage(
-            data,
-            proportions,
-            package
-        )
-        data = data.loc[(data['freq'] > 0) | (data['cause'] == residual_cause)]
-        data = data.groupby(['proportion_id', 'signature_id', 'cause']
-                            ).sum().reset_index()
+        if engine is not None:
+            print_log_message("        Deaths before = " + str(engine.freq.sum()))
+            print_log_message("        Rows before = " + str(len(engine.freq)))
+            print_log_message("            ... redistributing data")
+            diagnostics = engine.redistribute(package)
+        else:
+            print_log_message("        Deaths before = " + str(data.freq.sum()))
+            print_log_message("        Rows before = " + str(len(data)))
+            print_log_message("            ... calculating proportions")
+            proportions = get_proportions(
+                data,
+                proportion_metadata,
+                package,
+                cause_map_evaluated,
+                residual_cause=residual_cause
+            )
+            print_log_message("            ... redistributing data")
+            data, diagnostics = redistribute_garbage(
+                data,
+                proportions,
+                package
+            )
+            data = data.loc[(data['freq'] > 0) | (data['cause'] == residual_cause)]
+            data = data.groupby(['proportion_id', 'signature_id', 'cause']
+                                ).sum().reset_index()
         if diagnostic_output:
             diagnostics['seq'] = seq
             add_cols = ['shared_package_version_id',
@@ -571,9 +661,15 @@ def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
                 diagnostics[add_col] = package[add_col]
             seq += 1
             diagnostics_all.append(diagnostics)
-        print_log_message("        Deaths after = " + str(data.freq.sum()))
-        print_log_message("        Rows after = " + str(len(data)))
+        if engine is not None:
+            print_log_message("        Deaths after = " + str(engine.freq.sum()))
+            print_log_message("        Rows after = " + str(len(engine.freq)))
+        else:
+            print_log_message("        Deaths after = " + str(data.freq.sum()))
+            print_log_message("        Rows after = " + str(len(data)))
     print_log_message("Done!")
+    if engine is not None:
+        data = engine.get_data()
     data = pd.merge(data, signature_metadata, on='signature_id')
     if diagnostic_output:
         diagnostics = pd.concat(diagnostics_all).reset_index(drop=True)
@@ -581,12 +677,264 @@ def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
         signature_metadata, proportion_metadata
 
 
+class SparseRedistributor(object):
+    """Apply redistribution packages to integer coded data.
+
+    The data is held as arrays of (proportion_id, signature_id) pair codes,
+    cause codes and deaths, sorted by pair then cause, so the whole dataset
+    is never regrouped with pandas. The cause map restrictions are compiled
+    once into a proportion_id x cause mask, and each package the first time
+    it is applied into target group, weight and weight group membership
+    matrices. Proportions for every proportion_id then come from a few
+    matrix products over the deaths on the target causes, and the garbage
+    of every signature is split onto its targets with one sparse multiply.
+
+    Gives the same data and diagnostics as running get_proportions and
+    redistribute_garbage for each package.
+    """
+
+    def __init__(self, data, proportion_metadata, packages,
+                 cause_map_evaluated, residual_cause='cc_code'):
+        self.proportion_metadata = proportion_metadata
+        self.residual_cause = residual_cause
+        self.n_proportions = proportion_metadata['proportion_id'].max() + 1
+
+        # every cause that can appear in the data, sorted so that cause
+        # codes sort the same way as the causes
+        causes = set(data['cause']) | set([residual_cause])
+        for package in packages:
+            for tg in package['target_groups'].values():
+                causes.update(tg['target_codes'])
+        self.causes = pd.Index(sorted(causes))
+        self.residual_code = self.causes.get_loc(residual_cause)
+
+        pairs = data[['proportion_id', 'signature_id']].drop_duplicates()
+        pairs = pairs.sort_values(['proportion_id', 'signature_id'])
+        self.pair_proportion = pairs['proportion_id'].values
+        self.pair_signature = pairs['signature_id'].values
+        pair_keys = self._pair_key(self.pair_proportion, self.pair_signature)
+        pair = np.searchsorted(pair_keys, self._pair_key(
+            data['proportion_id'].values, data['signature_id'].values))
+        self._set_data(pair, self.causes.get_indexer(data['cause']),
+                       data['freq'].values.astype('float64'))
+
+        cm = cause_map_evaluated.loc[
+            cause_map_evaluated['cause'].isin(self.causes)]
+        rows = cm['proportion_id'].values
+        cols = self.causes.get_indexer(cm['cause'])
+        self.allowed = np.zeros((self.n_proportions, len(self.causes)),
+                                dtype=bool)
+        self.allowed[rows, cols] = cm['eval'].values.astype(bool)
+        self.evaluated = np.zeros(self.allowed.shape, dtype=bool)
+        self.evaluated[rows, cols] = True
+
+        self.compiled = {}
+
+    def _pair_key(self, proportion_id, signature_id):
+        return (proportion_id.astype('int64') *
+                (self.pair_signature.max() + 1) + signature_id)
+
+    def _set_data(self, pair, cause, freq):
+        """Sum deaths for each (pair, cause) and sort by pair then cause"""
+        keys, rows = np.unique(pair.astype('int64') * len(self.causes) + cause,
+                               return_inverse=True)
+        self.pair = keys // len(self.causes)
+        self.cause = keys % len(self.causes)
+        self.freq = np.bincount(rows, weights=freq)
+
+    def get_data(self):
+        """Current data as proportion_id, signature_id, cause, freq"""
+        return pd.DataFrame({
+            'proportion_id': self.pair_proportion[self.pair],
+            'signature_id': self.pair_signature[self.pair],
+            'cause': self.causes[self.cause],
+            'freq': self.freq
+        })[['proportion_id', 'signature_id', 'cause', 'freq']]
+
+    def garbage_mask(self, package):
+        return self.causes.isin(package['garbage_codes'])
+
+    def has_garbage(self, package):
+        return self.garbage_mask(package)[self.cause].any()
+
+    def compile_package(self, package):
+        """Matrices describing a package, reused whenever it is applied.
+
+        targets is a target group x target cause indicator matrix, and
+        target_causes the cause codes of its columns. membership counts the
+        weight groups that each proportion_id falls in, and weights holds
+        the weight of each target group in each of those weight groups,
+        with 0 where a target group has no weight.
+        """
+        if package['package_id'] in self.compiled:
+            return self.compiled[package['package_id']]
+
+        weight_groups = find_weight_groups(
+            package, self.proportion_metadata, filter_impossible=True,
+            verify_integrity=False
+        )
+        wg_names = sorted(weight_groups['weight_group'].unique(), key=int)
+        wg_index = {wg: i for i, wg in enumerate(wg_names)}
+        membership = np.zeros((self.n_proportions, len(wg_names)))
+        membership[weight_groups['proportion_id'].values,
+                   weight_groups['weight_group'].map(wg_index).values] = 1
+
+        tg_names = list(package['target_groups'])
+        target_causes = np.unique(np.concatenate(
+            [self.causes.get_indexer(package['target_groups'][tg]['target_codes'])
+             for tg in tg_names] + [[]]).astype('int64'))
+        targets = np.zeros((len(tg_names), len(target_causes)))
+        weights = np.zeros((len(wg_names), len(tg_names)))
+        for t, tg in enumerate(tg_names):
+            codes = self.causes.get_indexer(
+                package['target_groups'][tg]['target_codes'])
+            targets[t, np.searchsorted(target_causes, codes)] = 1
+            tg_weights = package['target_groups'][tg]['weights']
+            for w, wg in enumerate(wg_names):
+                if int(wg) < len(tg_weights):
+                    weights[w, t] = float(tg_weights[int(wg)])
+
+        # the same check as the cause restriction merge in get_proportions
+        in_groups = np.nonzero(membership.sum(axis=1))[0]
+        known = self.evaluated[np.ix_(in_groups, target_causes)]
+        if not known.all():
+            missing = np.nonzero(~known)
+            report_if_merge_fail(pd.DataFrame({
+                'proportion_id': in_groups[missing[0]],
+                'cause': self.causes[target_causes[missing[1]]],
+                'eval': np.nan
+            }), 'eval', ['proportion_id', 'cause'])
+
+        compiled = {
+            'garbage': self.garbage_mask(package),
+            'target_causes': target_causes,
+            'targets': targets,
+            'membership': membership,
+            'weights': weights,
+        }
+        self.compiled[package['package_id']] = compiled
+        return compiled
+
+    def _target_deaths(self, target_causes):
+        """Deaths and number of rows for each proportion_id and target cause"""
+        column = np.full(len(self.causes), -1, dtype='int64')
+        column[target_causes] = np.arange(len(target_causes))
+        col = column[self.cause]
+        is_target = col >= 0
+        cells = (self.pair_proportion[self.pair[is_target]] *
+                 len(target_causes) + col[is_target])
+        size = self.n_proportions * len(target_causes)
+        shape = (self.n_proportions, len(target_causes))
+        deaths = np.bincount(cells, weights=self.freq[is_target],
+                             minlength=size).reshape(shape)
+        rows = np.bincount(cells, minlength=size).reshape(shape)
+        return deaths, rows
+
+    def get_proportions(self, package):
+        """Proportion_id x cause sparse matrix of the share of garbage that
+        goes to each cause. Rows sum to 1, or are empty for proportion_ids
+        that get no redistribution."""
+        c = self.compile_package(package)
+        targets = c['targets']
+        n_groups = c['membership'].sum(axis=1)
+        deaths, rows = self._target_deaths(c['target_causes'])
+
+        base = 0.001 if package['create_targets'] == 1 else 0
+        freq = base * n_groups[:, np.newaxis] + deaths
+        # target groups with no deaths give every row a small weight
+        no_deaths = freq.dot(targets.T) == 0
+        allowed = self.allowed[:, c['target_causes']]
+        freq_no_deaths = 0.001 * (n_groups[:, np.newaxis] + rows) * allowed
+        freq = freq * allowed
+        total = np.where(no_deaths, freq_no_deaths.dot(targets.T),
+                         freq.dot(targets.T))
+
+        weight = c['membership'].dot(c['weights'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(total != 0, weight / total, 0)
+        proportions = ((share * no_deaths).dot(targets) * freq_no_deaths +
+                       (share * ~no_deaths).dot(targets) * freq)
+
+        # target groups left empty by restrictions go to the residual
+        # cause, counting each distinct weight once as get_proportions does
+        residual_weight = weight.copy()
+        for pid in np.nonzero(n_groups > 1)[0]:
+            groups = c['weights'][c['membership'][pid] > 0]
+            residual_weight[pid] = [np.unique(w).sum() for w in groups.T]
+        to_residual = (total == 0) & (targets.sum(axis=1) > 0)
+        residual = (residual_weight * to_residual).sum(axis=1)
+
+        sums = proportions.sum(axis=1) + residual
+        keep = (n_groups > 0) & (sums > 0)
+        proportions[~keep] = 0
+        residual[~keep] = 0
+        sums[~keep] = 1
+        proportions = sparse.hstack([
+            sparse.csr_matrix(proportions / sums[:, np.newaxis]),
+            sparse.csr_matrix((residual / sums)[:, np.newaxis])
+        ]).tocsr()
+        columns = np.append(c['target_causes'], self.residual_code)
+        mapping = sparse.csr_matrix(
+            (np.ones(len(columns)), (np.arange(len(columns)), columns)),
+            shape=(len(columns), len(self.causes)))
+        return proportions.dot(mapping)
+
+    def redistribute(self, package):
+        """Split the package garbage of every signature onto its targets and
+        return diagnostics like redistribute_garbage"""
+        proportions = self.get_proportions(package)
+        garbage = self.compile_package(package)['garbage'][self.cause]
+
+        n_pairs = len(self.pair_proportion)
+        pair_garbage = np.bincount(self.pair[garbage],
+                                   weights=self.freq[garbage],
+                                   minlength=n_pairs)
+        has_garbage = np.nonzero(pair_garbage)[0]
+        split = sparse.csr_matrix(
+            (pair_garbage[has_garbage],
+             (has_garbage, self.pair_proportion[has_garbage])),
+            shape=(n_pairs, self.n_proportions))
+        additions = split.dot(proportions).tocoo()
+        added = additions.data > 0
+        add_pair = additions.row[added]
+        add_cause = additions.col[added]
+        add_freq = additions.data[added]
+
+        diagnostics = self._diagnostics(
+            np.concatenate([self.pair[garbage], add_pair]),
+            np.concatenate([np.ones(garbage.sum()), np.zeros(added.sum())]),
+            np.concatenate([self.cause[garbage], add_cause]),
+            np.concatenate([self.freq[garbage], add_freq]))
+
+        freq = np.where(garbage, 0, self.freq)
+        keep = (freq > 0) | (self.cause == self.residual_code)
+        self._set_data(np.concatenate([self.pair[keep], add_pair]),
+                       np.concatenate([self.cause[keep], add_cause]),
+                       np.concatenate([freq[keep], add_freq]))
+        return diagnostics
+
+    def _diagnostics(self, pair, garbage, cause, freq):
+        """Deaths by proportion_id, garbage and cause"""
+        n_causes = len(self.causes)
+        keys, rows = np.unique(
+            (self.pair_proportion[pair] * 2 + garbage.astype('int64')) *
+            n_causes + cause, return_inverse=True)
+        return pd.DataFrame({
+            'proportion_id': keys // n_causes // 2,
+            'garbage': (keys // n_causes % 2).astype('float64'),
+            'cause': self.causes[keys % n_causes],
+            'freq': np.bincount(rows, weights=freq)
+        })[['proportion_id', 'garbage', 'cause', 'freq']]
+
+
 class GarbageRedistributor(CodProcess):
     """Redistribute garbage."""
 
     conf = Configurator('standard')
     rd_inputs_dir = conf.get_directory('rd_process_inputs')
     package_dir = rd_inputs_dir + "/rdp/{csid}"
+    cause_map_cache_dir = conf.get_directory('rd_process_data') + \
+        "/cause_map_cache/{csid}"
 
     signature_ids = [
         'global', 'dev_status', 'super_region',
@@ -613,9 +961,11 @@ class GarbageRedistributor(CodProcess):
     # whether outputs have been generated
     redistribution_complete = False
 
-    def __init__(self, code_system_id, first_and_last_only=False):
+    def __init__(self, code_system_id, first_and_last_only=False,
+                 sparse_engine=True):
         self.code_system_id = code_system_id
         self.first_and_last_only = first_and_last_only
+        self.sparse_engine = sparse_engine
 
     def get_computed_dataframe(self, df, cause_map):
         """Distribute garbage coded deaths onto non-garbage."""
@@ -629,7 +979,10 @@ class GarbageRedistributor(CodProcess):
                                package_folder,
                                residual_cause=self.residual_cause,
                                diagnostic_output=True,
-                               first_and_last_only=self.first_and_last_only)
+                               first_and_last_only=self.first_and_last_only,
+                               sparse_engine=self.sparse_engine,
+                               cause_map_cache_dir=self.cause_map_cache_dir.format(
+                                   csid=self.code_system_id))
         end_freq = output_data['freq'].sum()
 
         self.redistribution_complete = True
@@ -2,6 +2,10 @@ import pandas as pd
 import numpy as np
 import sys
 import os
+from collections import OrderedDict
+
+from life_table_cleaned import LT_AGES, LT_N, age_array, iter_column_chunks, life_table, read_columns, \
+    sort_for_life_table
 
 def pandas_read_infer_filetype(filepath, limits =None):
     if filepath[-4:] == '.csv':
@@ -16,44 +20,6 @@ def pandas_read_infer_filetype(filepath, limits =None):
 
     return df
 
-def zero_to_one_ax_func(df_row, deathrate_col):
-
-    if df_row['age_group_years_start'] == 0:
-
-        if df_row[deathrate_col] < 0.107:
-            if df_row['sex_id'] == 1:
-                return 0.045 + 2.684*df_row[deathrate_col]
-            elif df_row['sex_id'] == 2:
-                return 0.053 + 2.800*df_row[deathrate_col]
-            elif df_row['sex_id'] == 3:
-                return 0.049 + 2.742*df_row[deathrate_col]
-        else:
-            if df_row['sex_id'] == 1:
-                return 0.330
-            elif df_row['sex_id'] == 2:
-                return 0.350
-            elif df_row['sex_id'] == 3:
-                return 0.340
-
-    elif df_row['age_group_years_start'] == 1:
-
-        if df_row[deathrate_col] < 0.107:
-            if df_row['sex_id'] == 1:
-                return 1.651 - 2.816*df_row['prev_age_deathrate']
-            elif df_row['sex_id'] == 2:
-                return 1.522 - 1.518*df_row['prev_age_deathrate']
-            elif df_row['sex_id'] == 3:
-                return 1.5865 - 2.167*df_row['prev_age_deathrate']
-        else:
-            if df_row['sex_id'] == 1:
-                return 1.352
-            elif df_row['sex_id'] == 2:
-                return 1.361
-            elif df_row['sex_id'] == 3:
-                return 1.3565
-    else:
-        return df_row['ax']
-
 def process_pop(pop_path, pop_prefix, external_cols, truncate=False,
                 index_cols = ['sdi','age_group_id','sex_id']):
     """ Read in population given a path, a prefix to identify the population data, and a list of columns that this pop data will be used to match on
@@ -71,6 +37,10 @@ def process_pop(pop_path, pop_prefix, external_cols, truncate=False,
 
     # Identify columns with pop data
     pop_cols = [col for col in pop.columns if pop_prefix in col]
+    if len(pop_cols) < len(external_cols):
+        raise ValueError("{p} has {n_pop} population columns with prefix '{pre}' but {n_ext} columns need "
+                         "population".format(p=pop_path, n_pop=len(pop_cols), pre=pop_prefix,
+                                             n_ext=len(external_cols)))
 
     # We don't want to actually duplicate data we dont have
     unique_pop_names = pop_cols
@@ -108,7 +78,7 @@ def process_pop(pop_path, pop_prefix, external_cols, truncate=False,
 def calculate_ex(input_frame, deathrate_columns='mx', pop_columns = None, debug_location=0, debug_sex=0,
                  pop_path =None, pop_prefix=None,
                  external_ax=None, ax_prefix='', drop_deathrate=True, deathrate_prefix='nothing',
-                 save_path=None):
+                 save_path=None, chunk_size=100, first_column=0):
     """ Calculate life expectancy from mortality rate. Can accept either a single column or a list of columns (useful
     for draws). If the dataframe has a column called 'pop', it will be used, so make sure the values are accurate.
 
@@ -117,22 +87,28 @@ def calculate_ex(input_frame, deathrate_columns='mx', pop_columns = None, debug_
                       of years
     :param deathrate_columns: A list strings or a single string containing columns with mortality rate.
     :param pop_columns: A list of strings identifying the population columns in the input frame
-    :param external_ax: Optional, a sting containing a filepath with ax values
+    :param external_ax: Optional, a sting containing a filepath with ax values, or a dataframe already read from one
     :param ax_prefix: a prefix present in each ax column in the external_ax data
     :param deathrate_prefix: set this to the prefix that identifies deathrate columns if you want it removed in the ex and ax columns
     :param save_path: if provided, life expectancy will be saved at this path as a csv(csv for easy aggregation in bash)
+    :param chunk_size: number of deathrate columns to compute life tables for at once. Bounds memory use
+    :param first_column: position of deathrate_columns[0] among all deathrate columns, when they are passed in
+                         chunks. Used to pick out the matching external ax columns
     :return: A pandas dataframe containing a column with life expectancy values for every input deathrate_column.
-             Life expectancy columns are named ex_
+             Life expectancy columns are named ex_. The life table of the first deathrate column is kept in the ax, qx,
+             lx, dx, nLx and Tx columns
     """
 
     if not isinstance(deathrate_columns, list):
         deathrate_columns = [deathrate_columns]
 
 
-    print external_ax
     if external_ax is not None:
-        print 'here'
-        ax_data = pandas_read_infer_filetype(external_ax)
+        if isinstance(external_ax, pd.DataFrame):
+            ax_data = external_ax
+        else:
+            print external_ax
+            ax_data = pandas_read_infer_filetype(external_ax)
         ax_columns = [col for col in ax_data.columns if ax_prefix in col]
         print ax_columns
     else:
@@ -145,200 +121,78 @@ def calculate_ex(input_frame, deathrate_columns='mx', pop_columns = None, debug_
     if not isinstance(pop_columns, list):
         pop_columns = [pop_columns]
 
-    # A vectorized solution causes a memory error when doing hundreds of draws for all countries, both sexes,
-    #  and many years
-    for col_num, (deathrate_column, pop_column) in enumerate(zip(deathrate_columns,pop_columns)):
-        # Don't want to alter the input dataframe.
-        dataframe = input_frame.copy()
-        if col_num % 10 == 0:
-            print col_num
-            print deathrate_column
-            print pop_column
-        if col_num == 0:
-            print dataframe[pop_column]
-            print dataframe[deathrate_column]
-
-
-        # Get death counts
-        try:
-            dataframe.loc[:, 'deaths'] = dataframe[pop_column] * dataframe[deathrate_column]
-        except:
-            print dataframe[pop_column]
-            print dataframe[deathrate_column]
-            print dataframe
-            raise
-
-        # Collapse ages < 1
-        less_than_1 = dataframe.query('age_group_years_start < 1 and age_group_years_end <= 1')
-        dataframe = dataframe.query('age_group_years_start >= 1')
-
-        less_than_1 = less_than_1.groupby(['sdi', 'sex_id']).sum()
-
-        less_than_1[[deathrate_column]] = less_than_1['deaths'] / less_than_1[pop_column]
-
-
-        less_than_1 = less_than_1.reset_index()
-        
-        less_than_1.loc[:,'age_group_years_start'] = 0
-        less_than_1.loc[:,'age_group_years_end'] = 1
-
-        less_than_1.loc[:, 'age_group_id'] = np.NaN
-
-        # Dataframe now has a single age below 1
-        dataframe = dataframe.append(less_than_1, ignore_index=True)
-
-        if external_ax is not None:
-            dataframe = dataframe.merge(ax_data, on=['sdi','age_group_years_start','sex_id'])
-        
-        ages = [0, 1]+[5*x for x in range(1, 19+1)]
-
-        # ax = mean age of death
-        ax_map = pd.DataFrame({'age_group_years_start': ages, 'ax': [0] + [0] +[2.5]*19})
-
-        # n = person years in age group
-        n_map = pd.DataFrame({'age_group_years_start': ages, 'n': [1.000000]+[4.0]+[5.0]*19})
-
-        dataframe = dataframe.merge(ax_map)
-        dataframe = dataframe.merge(n_map)
-
-        dataframe = dataframe.sort(['sdi','sex_id','age_group_years_start'])
-        dataframe['prev_age_deathrate'] = dataframe[deathrate_column].shift(1)
-
-        if not ax_columns:
-            dataframe['ax'] = dataframe.apply(lambda x: zero_to_one_ax_func(x, deathrate_column), axis=1)
-        else:
-            dataframe['ax'] = dataframe[ax_columns[col_num]]
-
-        # Add an index to reference ages
-        dataframe = dataframe.set_index(['sdi', 'sex_id', 'age_group_years_start']).sortlevel()
-
-        # Iterate over ax to compute
-        tolerance = 0.0001
-        current_delta = 1.0
-        iteration = 0
-
-        if not ax_columns:
-            while current_delta >= tolerance:
-                if iteration % 10 == 0:
-                    print "iter {i:d}: {cd:f}".format(i=iteration, cd=current_delta)
-
-
-                iteration += 1
-                dataframe.loc[:, 'qx'] = dataframe['n']*dataframe[deathrate_column]/(1+(dataframe['n']-dataframe['ax'])
-                                                                                        *dataframe[deathrate_column])
-                # px = survival probability
-                dataframe.loc[:, 'px'] = 1-dataframe['qx']
-
-                # lx = number alive, initializing entire column here
-                dataframe.loc[:, 'lx'] = 0
-
-                # Initialize first age to arbitrary starting pop
-                idx = pd.IndexSlice
-                dataframe.loc[idx[:, :, 0], idx['lx']] = 100000
-
-                # Update all ages after the first one
-                for a, age in enumerate(ages[1:]):
-
-                    prev_age = ages[a]
-                    # Need to add .values because the result will have a different age index than where it is being stored
-                    dataframe.loc[idx[:, :, age], idx['lx']] = dataframe.loc[idx[:, :, prev_age], idx['lx']].values * \
-                                                                dataframe.loc[idx[:, :, prev_age], idx['px']].values
-
-                # dx = crude death rate
-                dataframe['dx'] = dataframe['lx']*dataframe['qx']
-
-                # Get dx for ages before and after
-                dataframe['next_dx'] = dataframe['dx'].shift(-1).fillna(0)
-                dataframe['prev_dx'] = dataframe['dx'].shift(1).fillna(0)
+    group_cols = ['sdi', 'sex_id']
+    pairs = list(zip(deathrate_columns, pop_columns))
+    mx_cols = [deathrate_column for deathrate_column, _ in pairs]
+    death_cols = ['_deaths_{}'.format(i) for i in range(len(pairs))]
 
-                # Calculate new ax 
-                dataframe['new_ax'] = (-dataframe['n']/24*dataframe['prev_dx'] +
-                        dataframe['n']/2*dataframe['dx'] +
-                        dataframe['n']/24*dataframe['next_dx']) / dataframe['dx']
+    # Don't want to alter the input dataframe.
+    dataframe = input_frame.copy()
 
-                # These ages dont change
-                dataframe.loc[idx[:, :, [0,1,5,ages[-2],ages[-1]]], 'new_ax'] = dataframe.loc[idx[:, :, [0,1,5,ages[-2],ages[-1]]], 'ax']
+    # Get death counts
+    for death_col, (deathrate_column, pop_column) in zip(death_cols, pairs):
+        dataframe[death_col] = dataframe[pop_column] * dataframe[deathrate_column]
 
-                current_delta = np.max(np.abs(dataframe['new_ax'] - dataframe['ax']))
+    # Collapse ages < 1
+    less_than_1 = dataframe.query('age_group_years_start < 1 and age_group_years_end <= 1')
+    dataframe = dataframe.query('age_group_years_start >= 1')
 
-                dataframe['ax'] = dataframe['new_ax']
+    less_than_1 = less_than_1.groupby(group_cols).sum()
+    less_than_1[mx_cols] = less_than_1[death_cols].values / less_than_1[[p for _, p in pairs]].values
 
+    less_than_1 = less_than_1.reset_index()
 
-        dataframe['ax'] = dataframe.apply(lambda x: 1.1 if x['ax'] < 0 else x['ax'], axis=1)
+    less_than_1.loc[:,'age_group_years_start'] = 0
+    less_than_1.loc[:,'age_group_years_end'] = 1
 
-        # Make lifetable
-        
-        # qx = probability of death
-        dataframe.loc[:, 'qx'] = dataframe['n']*dataframe[deathrate_column]/(1+(dataframe['n']-dataframe['ax'])
-                                                                                  *dataframe[deathrate_column])
-        # px = survival probability
-        dataframe.loc[:, 'px'] = 1-dataframe['qx']
+    less_than_1.loc[:, 'age_group_id'] = np.NaN
 
-        # lx = number alive, initializing entire column here
-        dataframe.loc[:, 'lx'] = 0
+    # Dataframe now has a single age below 1
+    dataframe = dataframe.append(less_than_1, ignore_index=True)
+    dataframe = dataframe.drop(death_cols, axis=1)
 
-        # Initialize first age to arbitrary starting pop
-        idx = pd.IndexSlice
-        dataframe.loc[idx[:, :, 0], idx['lx']] = 100000
-
-        # Update all ages after the first one
-        for a, age in enumerate(ages[1:]):
-
-            prev_age = ages[a]
-            # Need to add .values because the result will have a different age index than where it is being stored
-            dataframe.loc[idx[:, :, age], idx['lx']] = dataframe.loc[idx[:, :, prev_age], idx['lx']].values * \
-                                                          dataframe.loc[idx[:, :, prev_age], idx['px']].values
-
-        # dx = crude death rate
-        dataframe['dx'] = dataframe['lx']*dataframe['qx']
-
-        # nLx
-        dataframe
-        dataframe['nLx'] = 0.0
-
-        # Update all ages except the last one
-        for a, age in enumerate(ages[:-1]):
-            next_age = ages[a+1]
-            dataframe.loc[idx[ :, :, age], idx['nLx']] = (dataframe.loc[idx[ :, :, age], idx['n']].values *
-                                                                dataframe.loc[idx[:, :, next_age], idx['lx']].values) +\
-                                                               (dataframe.loc[idx[ :, :, age], idx['ax']].values *
-                                                                dataframe.loc[idx[ :, :, age], idx['dx']].values)
-
-        dataframe.loc[idx[:, :, ages[-1]], idx['nLx']] = dataframe.loc[idx[:, :, ages[-1]], idx['lx']] /\
-                                                                dataframe.loc[idx[:, :, ages[-1]], idx[deathrate_column]]
+    if external_ax is not None:
+        dataframe = dataframe.merge(ax_data, on=['sdi','age_group_years_start','sex_id'])
 
-        # Initial Tx = sum nLx
-        # Reset index to aggregate over ages
-        dataframe = dataframe.reset_index()
-        aggregated = dataframe.groupby(['sdi', 'sex_id']).sum()[['nLx']]
+    # n = person years in age group
+    dataframe = dataframe.loc[dataframe['age_group_years_start'].isin(LT_AGES)]
+    dataframe['n'] = dataframe['age_group_years_start'].map(dict(zip(LT_AGES, LT_N)))
 
-        aggregated = aggregated.rename(columns={'nLx':'Tx'})
-        aggregated = aggregated.reset_index()
+    # One block of ages per sdi/sex, so the deathrates can be laid out as (group, age, draw) arrays
+    dataframe = sort_for_life_table(dataframe, group_cols)
+    sex_id = dataframe['sex_id'].values[::len(LT_AGES)]
 
-        dataframe = dataframe.merge(aggregated)
-        dataframe = dataframe.set_index(['sdi', 'sex_id', 'age_group_years_start'])
-        dataframe = dataframe.sortlevel()
+    life_tables = OrderedDict()
+    for start in range(0, len(mx_cols), chunk_size):
+        chunk = mx_cols[start:start+chunk_size]
+        print "life tables for {c}".format(c=chunk[0])
 
-        # Now Tx for the rest of the ages
-        for a, age in enumerate(ages[1:]):
-            prev_age = ages[a]
-            dataframe.loc[idx[:, :, age], idx['Tx']] = dataframe.loc[idx[:, :, prev_age], idx['Tx']].values -\
-                                                            dataframe.loc[idx[:, :, prev_age], idx['nLx']].values
+        ax = None
+        if ax_columns:
+            ax_start = first_column+start
+            ax = age_array(dataframe, ax_columns[ax_start:ax_start+len(chunk)])
+        tables = life_table(age_array(dataframe, chunk), sex_id, ax=ax)
 
-        if col_num == 0:
-            result = dataframe.copy()
+        # Keep the whole life table of the first column
+        if start == 0:
+            for measure, values in tables.items():
+                if measure != 'ex':
+                    life_tables[measure] = values[:, :, 0].ravel()
 
-        result['ex_'+deathrate_column.replace(deathrate_prefix,'')] = dataframe['Tx']/dataframe['lx']
+        for i, deathrate_column in enumerate(chunk):
+            name = deathrate_column.replace(deathrate_prefix, '')
+            life_tables['ex_'+name] = tables['ex'][:, :, i].ravel()
 
-        # Need lx for probabilities
-        result['lx_'+deathrate_column.replace(deathrate_prefix, '')] = dataframe['lx']
+            # Need lx for probabilities
+            life_tables['lx_'+name] = tables['lx'][:, :, i].ravel()
 
-        if col_num==99:
-            print deathrate_column
+            # Save ax for yll calcs
+            if not ax_columns:
+                life_tables['ax_'+name] = tables['ax'][:, :, i].ravel()
 
-        # Save ax for yll calcs
-        if not ax_columns:
-            result['ax_'+deathrate_column.replace(deathrate_prefix, '')] = dataframe['ax']
+    for col, values in life_tables.items():
+        dataframe[col] = values
+    result = dataframe.set_index(['sdi', 'sex_id', 'age_group_years_start'])
 
     if drop_deathrate:
         result = result.drop(deathrate_columns, axis=1)
@@ -385,6 +239,9 @@ if __name__ == '__main__':
                         type=str)
     parser.set_dUSERts(ax_pre='')
 
+    parser.add_argument("-chunk", help="optional number of deathrate columns to read and compute at a time",
+                        type=int)
+
     args = parser.parse_args()
 
     args.in_path = args.in_path.strip()
@@ -411,15 +268,51 @@ if __name__ == '__main__':
     if args.sex is not None:
         limits += ["sex_id=={s:d}".format(s=args.sex)]
     print limits
-    deathrate_df = pandas_read_infer_filetype(args.in_path, limits=limits)
 
-    deathrate_cols = [col for col in deathrate_df if args.mx_pre in col]
+    if args.chunk is None:
+        deathrate_df = pandas_read_infer_filetype(args.in_path, limits=limits)
 
+        deathrate_cols = [col for col in deathrate_df if args.mx_pre in col]
 
-    if args.exp:
-        for col in deathrate_cols:
-            deathrate_df.loc[:,col] = np.exp(deathrate_df[col])
 
-    calculate_ex(deathrate_df, deathrate_columns=deathrate_cols, external_ax=args.ax_path, ax_prefix=args.ax_pre,
-                 pop_prefix = args.pop_prefix, pop_path = args.pop_path,
-                 drop_deathrate=True, deathrate_prefix='nothing', save_path=args.o)
+        if args.exp:
+            for col in deathrate_cols:
+                deathrate_df.loc[:,col] = np.exp(deathrate_df[col])
+
+        calculate_ex(deathrate_df, deathrate_columns=deathrate_cols, external_ax=args.ax_path, ax_prefix=args.ax_pre,
+                     pop_prefix = args.pop_prefix, pop_path = args.pop_path,
+                     drop_deathrate=True, deathrate_prefix='nothing', save_path=args.o)
+    else:
+        # Stream the deathrate columns through a chunk at a time
+        deathrate_cols = [col for col in read_columns(args.in_path) if args.mx_pre in col]
+        if not deathrate_cols:
+            raise ValueError("No columns with prefix '{pre}' in {p}".format(pre=args.mx_pre, p=args.in_path))
+        pop, pop_cols = process_pop(args.pop_path, args.pop_prefix, deathrate_cols)
+
+        # Read the ax values once rather than once per chunk
+        ax_data = None
+        if args.ax_path is not None:
+            ax_data = pandas_read_infer_filetype(args.ax_path)
+
+        result = None
+        for chunk_num, (chunk, deathrate_df) in enumerate(
+                iter_column_chunks(args.in_path, deathrate_cols, args.chunk, limits=limits)):
+            first_column = chunk_num*args.chunk
+            chunk_pop_cols = pop_cols[first_column:first_column+len(chunk)]
+
+            if args.exp:
+                for col in chunk:
+                    deathrate_df.loc[:,col] = np.exp(deathrate_df[col])
+
+            chunk_pop = pop[[col for col in pop.columns if col not in pop_cols] + chunk_pop_cols]
+            chunk_result = calculate_ex(deathrate_df.merge(chunk_pop), deathrate_columns=chunk,
+                                        pop_columns=chunk_pop_cols, external_ax=ax_data,
+                                        ax_prefix=args.ax_pre, drop_deathrate=True, deathrate_prefix='nothing',
+                                        chunk_size=args.chunk, first_column=first_column)
+            if result is None:
+                result = chunk_result
+            else:
+                new_cols = [col for col in chunk_result.columns if col not in result.columns]
+                result = pd.concat([result, chunk_result[new_cols]], axis=1)
+
+        result.to_csv(args.o)
@@ -0,0 +1,195 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Start of each life table age group, and the number of years in it
+LT_AGES = np.array([0, 1] + [5*x for x in range(1, 19+1)])
+LT_N = np.array([1.0] + [4.0] + [5.0]*19)
+
+# Starting ax before any iteration
+LT_AX = np.array([0.0] + [0.0] + [2.5]*19)
+
+# ax for these ages is never updated by the iterative ax refinement
+FIXED_AX_AGES = [0, 1, 5, LT_AGES[-2], LT_AGES[-1]]
+
+RADIX = 100000
+
+# Deathrate below which ax for ages 0 and 1 is linear in the age 0 deathrate
+INFANT_DEATHRATE_CUTOFF = 0.107
+
+# ax for ages 0 and 1 by sex_id, as (intercept, slope, ax above the cutoff)
+AGE_0_AX = {1: (0.045, 2.684, 0.330),
+            2: (0.053, 2.800, 0.350),
+            3: (0.049, 2.742, 0.340)}
+AGE_1_AX = {1: (1.651, -2.816, 1.352),
+            2: (1.522, -1.518, 1.361),
+            3: (1.5865, -2.167, 1.3565)}
+
+
+def sort_for_life_table(df, group_cols):
+    """ Sort a long life table frame so that each group is a contiguous block with one row per age in LT_AGES
+
+    :param df: Pandas dataframe with group_cols and an 'age_group_years_start' column
+    :param group_cols: columns identifying a single life table, e.g. ['sdi', 'sex_id']
+    :return: the sorted dataframe, with a fresh index
+    :raises ValueError: if some group does not have exactly the ages in LT_AGES
+    """
+    df = df.sort_values(group_cols + ['age_group_years_start']).reset_index(drop=True)
+    n_ages = len(LT_AGES)
+    ages = df['age_group_years_start'].values
+    sizes = df.groupby(group_cols).size().values
+    if (len(ages) % n_ages != 0 or (sizes != n_ages).any() or
+            not (ages.reshape(-1, n_ages) == LT_AGES).all()):
+        raise ValueError("Every {} group must have exactly one row for each of the ages {}".format(
+            group_cols, list(LT_AGES)))
+    return df
+
+
+def age_array(df, value_cols):
+    """ Return value_cols of a frame sorted by sort_for_life_table as a (group, age, column) array
+
+    :param df: Pandas dataframe sorted by sort_for_life_table
+    :param value_cols: list of columns, e.g. one per draw
+    """
+    return df[value_cols].values.astype(float).reshape(-1, len(LT_AGES), len(value_cols))
+
+
+def read_columns(filepath):
+    """ Column names of a csv, or of an hdf file saved in table format under the key 'data', without reading the data """
+    if filepath[-4:] == '.csv':
+        return list(pd.read_csv(filepath, nrows=0).columns)
+    return list(pd.read_hdf(filepath, key='data', start=0, stop=0).columns)
+
+
+def iter_column_chunks(filepath, value_cols, chunk_size, limits=None):
+    """ Read a csv or hdf file a few value columns at a time, so that only chunk_size of them are in memory at once
+
+    :param filepath: path to a csv, or an hdf file saved in table format under the key 'data'
+    :param value_cols: columns to read in chunks, e.g. deathrate draws. All other columns are read with every chunk
+    :param chunk_size: number of value columns per chunk
+    :param limits: optional list of query strings to subset rows by
+    :return: generator of (chunk of value_cols, dataframe)
+    """
+    is_csv = filepath[-4:] == '.csv'
+    id_cols = [col for col in read_columns(filepath) if col not in value_cols]
+
+    for start in range(0, len(value_cols), chunk_size):
+        chunk = value_cols[start:start+chunk_size]
+        if is_csv:
+            df = pd.read_csv(filepath, usecols=id_cols+chunk)
+            for limit in limits or []:
+                df = df.query(limit)
+        else:
+            df = pd.read_hdf(filepath, key='data', where=limits, columns=id_cols+chunk)
+        yield chunk, df[id_cols+chunk]
+
+
+def _lookup_coefficients(sex_id, coefficients):
+    """ (group, 1) arrays of the intercept, slope and constant for each group's sex. Unknown sexes get NaN """
+    coefs = np.array([coefficients.get(sex, (np.nan,)*3) for sex in sex_id], dtype=float)
+    return coefs[:, 0:1], coefs[:, 1:2], coefs[:, 2:3]
+
+
+def initial_ax(mx, sex_id):
+    """ Starting ax for every group and draw. Ages 0 and 1 depend on sex and on the age 0 deathrate, all other ages
+    start at the LT_AX defaults
+
+    :param mx: (group, age, draw) array of deathrates
+    :param sex_id: array with the sex_id of each group
+    """
+    ax = np.empty(mx.shape)
+    ax[:] = LT_AX[np.newaxis, :, np.newaxis]
+
+    intercept, slope, above = _lookup_coefficients(sex_id, AGE_0_AX)
+    ax[:, 0] = np.where(mx[:, 0] < INFANT_DEATHRATE_CUTOFF,
+                        intercept + slope*mx[:, 0], above)
+
+    # Age 1 ax is linear in the age 0 deathrate, but the cutoff applies to its own
+    intercept, slope, above = _lookup_coefficients(sex_id, AGE_1_AX)
+    ax[:, 1] = np.where(mx[:, 1] < INFANT_DEATHRATE_CUTOFF,
+                        intercept + slope*mx[:, 0], above)
+    return ax
+
+
+def calc_qx(mx, ax):
+    """ Probability of death in each age group """
+    n = LT_N[np.newaxis, :, np.newaxis]
+    return n*mx/(1+(n-ax)*mx)
+
+
+def calc_lx(qx):
+    """ Number alive at the start of each age group, out of RADIX. A cumulative product of survival over age """
+    px = 1-qx
+    start = np.full(px.shape[:1] + (1,) + px.shape[2:], float(RADIX))
+    return np.cumprod(np.concatenate([start, px[:, :-1]], axis=1), axis=1)
+
+
+def iterate_ax(mx, ax, tolerance=0.0001):
+    """ Refine ax from the dx of neighbouring age groups until it changes by less than tolerance. Convergence is
+    checked per draw, so each draw stops iterating as soon as its own ax has converged
+
+    :param mx: (group, age, draw) array of deathrates
+    :param ax: (group, age, draw) array of starting ax, e.g. from initial_ax. Updated in place
+    :return: ax
+    """
+    n = LT_N[np.newaxis, :, np.newaxis]
+    fixed = np.array([age in FIXED_AX_AGES for age in LT_AGES])
+    active = np.ones(mx.shape[2], dtype=bool)
+
+    while active.any():
+        draw_mx = mx[:, :, active]
+        draw_ax = ax[:, :, active]
+
+        qx = calc_qx(draw_mx, draw_ax)
+        dx = calc_lx(qx)*qx
+
+        # dx for ages before and after
+        prev_dx = np.zeros(dx.shape)
+        prev_dx[:, 1:] = dx[:, :-1]
+        next_dx = np.zeros(dx.shape)
+        next_dx[:, :-1] = dx[:, 1:]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_ax = (-n/24*prev_dx + n/2*dx + n/24*next_dx) / dx
+        new_ax[:, fixed] = draw_ax[:, fixed]
+
+        # Largest change in each draw, ignoring NaN ax from groups with no deaths
+        delta = np.abs(new_ax - draw_ax).reshape(-1, new_ax.shape[2])
+        delta[np.isnan(delta)] = -np.inf
+        ax[:, :, active] = new_ax
+        active[active] = delta.max(axis=0) >= tolerance
+    return ax
+
+
+def life_table(mx, sex_id, ax=None, tolerance=0.0001):
+    """ Compute life tables for many groups and draws at once
+
+    :param mx: (group, age, draw) array of deathrates, with ages in LT_AGES order
+    :param sex_id: array with the sex_id of each group
+    :param ax: optional (group, age, draw) array of external ax. If not given, ax is initialized with initial_ax and
+               refined with iterate_ax
+    :param tolerance: convergence tolerance for iterate_ax
+    :return: OrderedDict of (group, age, draw) arrays for ax, qx, lx, dx, nLx, Tx and ex
+    """
+    if ax is None:
+        ax = iterate_ax(mx, initial_ax(mx, sex_id), tolerance)
+    ax = np.where(ax < 0, 1.1, ax)
+
+    qx = calc_qx(mx, ax)
+    lx = calc_lx(qx)
+    dx = lx*qx
+
+    # nLx = person years lived in each age group, all of the remaining years for the terminal age group
+    nLx = np.empty(mx.shape)
+    nLx[:, :-1] = LT_N[np.newaxis, :-1, np.newaxis]*lx[:, 1:] + ax[:, :-1]*dx[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nLx[:, -1] = lx[:, -1]/mx[:, -1]
+
+    # Tx = person years lived after the start of each age group
+    Tx = np.cumsum(nLx[:, ::-1], axis=1)[:, ::-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ex = Tx/lx
+
+    return OrderedDict([('ax', ax), ('qx', qx), ('lx', lx), ('dx', dx), ('nLx', nLx), ('Tx', Tx), ('ex', ex)])
@@ -0,0 +1,143 @@
+""" Reading and writing the tables passed between locations in the cascade.
+
+Each location writes tables (child priors, posterior summaries, adjusted
+data) that are read again by every one of its children, and later by
+varnish. This module keeps those tables as HDF5 (fixed format) next to the
+csv path they used to be written to, e.g. child_priors.csv is stored as
+child_priors.h5, so they are read back with their types and without
+parsing text. A csv is only written where something outside of python,
+such as the dismod executables or the effect plots, still needs it.
+
+Tables are also cached in-process, keyed by path and file modification
+time. A parent that reads its tables before forking a pool of child fits
+(see run_children.py) shares them with all of its children.
+"""
+import os
+import warnings
+from collections import OrderedDict
+
+import pandas as pd
+
+BINARY_EXT = '.h5'
+BINARY_KEY = 'table'
+
+# Most tables to hold in the in-process cache at once
+MAX_CACHED_TABLES = 32
+
+_cache = OrderedDict()
+
+
+def binary_path(path):
+    """ Path of the binary copy of the table at path """
+    return os.path.splitext(path)[0] + BINARY_EXT
+
+
+def _file_stamp(path):
+    """ (path, modification time, size) of a file, None if it doesn't
+    exist """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (path, stat.st_mtime, stat.st_size)
+
+
+def _cache_put(stamp, df):
+    """ Cache a table, dropping the least recently used ones over
+    MAX_CACHED_TABLES """
+    _cache.pop(stamp, None)
+    _cache[stamp] = df
+    while len(_cache) > MAX_CACHED_TABLES:
+        _cache.popitem(last=False)
+
+
+def clear_cache():
+    """ Drop all cached tables """
+    _cache.clear()
+
+
+def write_table(df, path, csv=True, **csv_kwargs):
+    """ Write a table in binary form and, if csv is True, as a csv at path
+
+    Args:
+        df (DataFrame): table to write. The index is not kept
+        path (str): csv path of the table. The binary copy is written to
+            binary_path(path)
+        csv (bool): also write the csv, for readers outside of python
+        **csv_kwargs: passed on to DataFrame.to_csv. index=False unless
+            given
+    """
+    df = df.reset_index(drop=True)
+    if csv:
+        csv_kwargs.setdefault('index', False)
+        df.to_csv(path, **csv_kwargs)
+
+    # Written after the csv, so read_table picks it up over the csv
+    bpath = binary_path(path)
+    with warnings.catch_warnings():
+        # Object columns are stored pickled in the fixed format
+        warnings.simplefilter('ignore')
+        df.to_hdf(bpath, key=BINARY_KEY, mode='w', format='fixed')
+
+    stamp = _file_stamp(bpath)
+    if stamp is not None:
+        _cache_put(stamp, df.copy())
+    return df
+
+
+def _source(path):
+    """ Stamp of the file to read the table at path from: the binary copy,
+    unless there is a newer csv (e.g. written by a dismod executable) """
+    bstamp = _file_stamp(binary_path(path))
+    cstamp = _file_stamp(path)
+    if bstamp is not None and (cstamp is None or bstamp[1] >= cstamp[1]):
+        return bstamp
+    return cstamp
+
+
+def table_exists(path):
+    """ Whether the table at path has been written, as csv or binary """
+    return _source(path) is not None
+
+
+def read_table(path, cache=True, **csv_kwargs):
+    """ Read the table written to path, from the in-process cache, the
+    binary copy, or the csv, in that order
+
+    Args:
+        path (str): csv path of the table
+        cache (bool): keep the table in the in-process cache
+        **csv_kwargs: passed on to pd.read_csv if the csv is read
+
+    Returns:
+        DataFrame: a copy, so callers are free to modify it
+
+    Raises:
+        IOError: if the table has not been written
+    """
+    stamp = _source(path)
+    if stamp is None:
+        raise IOError("No table found at {}".format(path))
+    if stamp in _cache:
+        df = _cache[stamp]
+        _cache_put(stamp, df)
+        return df.copy()
+
+    if stamp[0] == path:
+        df = pd.read_csv(path, **csv_kwargs)
+    else:
+        df = pd.read_hdf(stamp[0], key=BINARY_KEY)
+    if cache and not csv_kwargs:
+        _cache_put(stamp, df)
+        return df.copy()
+    return df
+
+
+def preload(paths):
+    """ Read tables into the in-process cache, e.g. before forking child
+    fits, skipping any that have not been written """
+    for path in paths:
+        try:
+            read_table(path)
+        except IOError:
+            pass
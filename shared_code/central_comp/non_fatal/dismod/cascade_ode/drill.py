@@ -9,6 +9,7 @@ import pandas as pd
 import numpy as np
 from scipy import interpolate, stats
 import importer
+import cascade_io
 from hierarchies.dbtrees import loctree
 import warnings
 import logging
@@ -442,7 +443,7 @@ class Cascade_loc(object):
                 self.data_noarea_file, self.data_pred_file,
                 self.child_prior_file]
         for f in reqd_files:
-            if not os.path.isfile(f):
+            if not cascade_io.table_exists(f):
                 reimport = True
 
         if timespan is None:
@@ -462,9 +463,10 @@ class Cascade_loc(object):
             self.data = pd.read_csv(self.data_file)
             self.effects_prior = pd.read_csv(self.effect_file)
             self.effects_prior = self.effects_prior.sort(['effect','integrand','name'])
-            self.predin = pd.read_csv(self.predin_file)
+            self.predin = cascade_io.read_table(self.predin_file)
             self.rate = pd.read_csv(self.rate_file)
-            self.post_summary = pd.read_csv(self.posterior_summ_file)
+            self.post_summary = cascade_io.read_table(
+                self.posterior_summ_file)
 
         # Ensure location columns in data are always strings, types can
         # change when re-importing from CSV
@@ -858,10 +860,10 @@ class Cascade_loc(object):
         return subdata
 
     def get_parent_pred_draws(self):
-        return pd.read_csv(self.parent.child_prior_file)
+        return cascade_io.read_table(self.parent.child_prior_file)
 
     def get_parent_adj_data(self):
-        return pd.read_csv(self.parent.allyadjout_file)
+        return cascade_io.read_table(self.parent.allyadjout_file)
 
     def summarize_draws_for_children(self, draws, burn=0.2):
         # Summarize draws
@@ -882,7 +884,7 @@ class Cascade_loc(object):
         draw_summ.index.name = 'row_name'
         draw_summ = draw_summ.reset_index()
         draw_summ['row_name'] = draw_summ.row_name.astype('int')
-        predin = pd.read_csv(self.predin_file)
+        predin = cascade_io.read_table(self.predin_file)
         predin = predin[predin.for_database==0]
         draw_summ = predin.merge(draw_summ, on='row_name', how='left')
 
@@ -1416,7 +1418,8 @@ class Cascade_loc(object):
         post_summary = post_summary.reset_index()
         post_summary.rename(columns={'index':'effect'}, inplace=True)
         self.post_summary = post_summary
-        post_summary.to_csv(self.posterior_summ_file, index=False)
+        # The effect plots still read the csv
+        cascade_io.write_table(post_summary, self.posterior_summ_file)
 
         # Extract betas for upload
         ps = post_summary.copy()
@@ -1572,12 +1575,14 @@ class Cascade_loc(object):
         subprocess.check_output(['rm', self.drawout_file])
         if len(self.locnode.children)>0:
             child_priors = self.summarize_draws_for_children(draws)
-            child_priors.to_csv(self.child_prior_file, index=False)
+            # Only read by the child locations, so no csv is needed
+            cascade_io.write_table(child_priors, self.child_prior_file,
+                                   csv=False)
         start_idx = int(len(draws)*.2)-1
         draws = draws[start_idx:]
         draws = draws.transpose()
         num_draws = draws.shape[1]
-        parent_predin = pd.read_csv(self.predin_file)
+        parent_predin = cascade_io.read_table(self.predin_file)
 
         # Format draws for writing to file
         draws = draws.reset_index()
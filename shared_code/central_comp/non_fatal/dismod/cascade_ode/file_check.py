@@ -48,6 +48,18 @@ def submit_jobs(run_set, mvid, location_set_version_id):
             dependent_submit(1, [])
 
 
+def summary_file(mvid, loc, sex, year, cv_iter=0):
+    """ Path of the posterior summary a location's fit writes last, so it
+    exists only once the fit has finished """
+    if cv_iter == 0:
+        return ('%s/%s/full/locations/%s/outputs/%s/%s/'
+                'post_pred_draws_summary.csv' % (outdir, mvid, loc, sex,
+                                                 year))
+    return ('%s/%s/cv%s/locations/%s/outputs/%s/%s/'
+            'post_pred_draws_summary.csv' % (outdir, mvid, cv_iter, loc, sex,
+                                             year))
+
+
 def missing_files(mvid, location_set_version_id, cv_iter=0):
     loctree = lt(location_set_version_id)
     missing_files = []
@@ -57,16 +69,7 @@ def missing_files(mvid, location_set_version_id, cv_iter=0):
                 if loc == 1:
                     sex = 'both'
                     year = 2000
-                if cv_iter == 0:
-                    summ_file = (
-                        '%s/%s/full/locations/%s/outputs/%s/%s/'
-                        'post_pred_draws_summary.csv' % (outdir, mvid, loc,
-                                                         sex, year))
-                else:
-                    summ_file = (
-                        '%s/%s/cv%s/locations/%s/outputs/%s/%s/'
-                        'post_pred_draws_summary.csv' % (outdir, mvid, cv_iter,
-                                                         loc, sex, year))
+                summ_file = summary_file(mvid, loc, sex, year, cv_iter)
                 if not os.path.isfile(summ_file):
                     missing_files.append((loc, sex, year, cv_iter))
     return missing_files
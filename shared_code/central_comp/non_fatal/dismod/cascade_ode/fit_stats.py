@@ -6,6 +6,7 @@ import numpy as np
 import logging
 
 from importer import get_model_version
+import cascade_io
 from hierarchies.dbtrees import loctree as lt
 
 # Set dUSERt file mask to readable-for all users
@@ -31,12 +32,11 @@ def read_data_pred_file(fdef):
 
     f = ('{od}/{mv}/{cv}/locations/{l}/outputs/{s}/{y}/'
          'post_data_pred.csv'.format(od=outdir, cv=cv, mv=mvid, l=l, s=s, y=y))
-    fadj = ('{od}/{mv}/{cv}/locations/{l}/outputs/{s}/{y}/'
-            'post_data_pred.csv'.format(od=outdir, cv=cv, mv=mvid, l=l, s=s,
-                                        y=y))
     try:
-        df = pd.read_csv(f)
-        dfadj = pd.read_csv(fadj)
+        # The predictions and the adjusted data are in the same file, so
+        # it's only read once
+        df = cascade_io.read_table(f, cache=False)
+        dfadj = df.copy()
         df = df.drop(['adjust_median', 'adjust_lower', 'adjust_upper'], axis=1)
         dfadj = dfadj[['adjust_median', 'adjust_lower', 'adjust_upper']]
         df = df.join(dfadj)
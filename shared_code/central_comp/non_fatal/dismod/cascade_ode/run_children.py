@@ -3,6 +3,9 @@ from copy import copy
 import sys
 import drill
 from drill import Cascade, Cascade_loc
+import cascade_io
+import file_check
+import scheduler
 import pandas as pd
 import multiprocessing as mp
 import gc
@@ -12,38 +15,85 @@ from jobmon import job
 # Set dUSERt file mask to readable-for all users
 os.umask(0o0002)
 
+# Most fits a tree job runs at once. Tree jobs reserve 20 slots (see
+# run_global.TREE_JOB_SLOTS), two per fit, as the level by level
+# jobs do
+TREE_JOB_WORKERS = 10
+
+
+def fit_loc(cl_parent, loc_id, sex_id, year, full_timespan):
+    if full_timespan:
+        cl = Cascade_loc(loc_id, sex_id, year, c, timespan=50,
+                         parent_loc=cl_parent)
+    else:
+        cl = Cascade_loc(loc_id, sex_id, year, c, parent_loc=cl_parent)
+    cl.run_dismod()
+    cl.summarize_posterior()
+    cl.draw()
+    cl.predict()
+
 
 def run_loc(args):
     gc.collect()
     loc_id, sex_id, year, full_timespan, debug = args
     if debug:
-        if full_timespan:
-            cl = Cascade_loc(loc_id, sex_id, year, c, timespan=50,
-                             parent_loc=cl_parent)
-        else:
-            cl = Cascade_loc(loc_id, sex_id, year, c, parent_loc=cl_parent)
-        cl.run_dismod()
-        cl.summarize_posterior()
-        cl.draw()
-        cl.predict()
+        fit_loc(cl_parent, loc_id, sex_id, year, full_timespan)
         return loc_id, 0
     else:
         try:
-            if full_timespan:
-                cl = Cascade_loc(loc_id, sex_id, year, c, timespan=50,
-                                 parent_loc=cl_parent)
-            else:
-                cl = Cascade_loc(loc_id, sex_id, year, c, parent_loc=cl_parent)
-            cl.run_dismod()
-            cl.summarize_posterior()
-            cl.draw()
-            cl.predict()
+            fit_loc(cl_parent, loc_id, sex_id, year, full_timespan)
             return loc_id, 0
         except Exception as e:
             logging.exception("Failure running location {}".format(loc_id))
             return loc_id, str(e)
 
 
+def run_tree_loc(loc_id, parent_id):
+    """ Fit one location in tree mode, reading its parent's finished fit
+    back in, as a run_children job for the parent would """
+    gc.collect()
+    if parent_id == location_id:
+        parent = cl_parent
+    elif parent_id == 1:
+        parent = Cascade_loc(parent_id, 0, 2000, c, reimport=False)
+    else:
+        parent = Cascade_loc(parent_id, sex_id, y, c, reimport=False)
+    full_timespan = lt.get_nodelvl_by_id(parent_id) < (year_split_lvl-1)
+    fit_loc(parent, loc_id, sex_id, y, full_timespan)
+    return 0
+
+
+def run_subtree(location_id):
+    """ Fit every location below location_id, starting each one as soon
+    as its parent is done. Locations whose outputs already exist, e.g. from
+    an earlier attempt of the job, are not fit again. Returns
+    (location_id, 0 or error) for each location that was fit """
+    children = {}
+    stack = [lt.get_node_by_id(location_id)]
+    while stack:
+        node = stack.pop()
+        children[node.id] = [child.id for child in node.children]
+        stack.extend(node.children)
+    done = set(
+        loc for loc in scheduler.subtree_order(location_id, children)[1:]
+        if os.path.isfile(file_check.summary_file(mvid, loc, sex, y,
+                                                  cv_iter)))
+    if done:
+        logging.info("Skipping {} locations that are already fit".format(
+            len(done)))
+
+    res = scheduler.run_tree(location_id, children, run_tree_loc,
+                             n_workers=min(mp.cpu_count(),
+                                           TREE_JOB_WORKERS),
+                             durations=scheduler.read_fit_times(c.root_dir),
+                             done=done)
+    scheduler.write_fit_times(
+        os.path.join(c.root_dir, 'fit_times_{}_{}_{}.csv'.format(
+            location_id, sex, y)),
+        res)
+    return [(r[0], r[1]) for r in res]
+
+
 if __name__ == "__main__":
 
     mvid = int(sys.argv[1])
@@ -52,13 +102,14 @@ if __name__ == "__main__":
     y = int(sys.argv[4])
     cv_iter = int(sys.argv[5])
 
+    # "debug" runs the children in this process, "tree" fits the whole
+    # subtree below location_id with the critical-path scheduler
     try:
-        if sys.argv[6]=="debug":
-            debug = True
-        else:
-            debug = False
+        mode = sys.argv[6]
     except:
-        debug = False
+        mode = None
+    debug = (mode == "debug")
+    tree = (mode == "tree")
 
     if sex=='male':
         sex_id = 0.5
@@ -82,31 +133,39 @@ if __name__ == "__main__":
         cl_parent = Cascade_loc(location_id, 0, 2000, c, reimport=False)
     else:
         cl_parent = Cascade_loc(location_id, sex_id, y, c, reimport=False)
-    num_children = len(lt.get_node_by_id(location_id).children)
 
-    num_cpus = mp.cpu_count()
+    # Read the parent tables every child needs once, before forking, so the
+    # child fits share them from the cache instead of each reading them
+    cascade_io.preload([cl_parent.child_prior_file, cl_parent.allyadjout_file])
 
-    if not debug:
-        pool = mp.Pool(min(num_cpus, num_children, 10))
+    if tree:
+        res = run_subtree(location_id)
+    else:
+        num_children = len(lt.get_node_by_id(location_id).children)
 
-    # Run child locations
-    arglist = []
-    for child_loc in lt.get_node_by_id(location_id).children:
-        if this_lvl>=(year_split_lvl-1):
-            full_timespan = False
-        else:
-            full_timespan = True
-        arglist.append((
-            child_loc.id, sex_id, y,
-            full_timespan, debug))
+        num_cpus = mp.cpu_count()
 
-    if debug:
-        '..... RUNNING IN SINGLE PROCESS DEBUG MODE .....'
-        res = map(run_loc, arglist)
-    else:
-        res =  pool.map(run_loc, arglist)
-        pool.close()
-        pool.join()
+        if not debug:
+            pool = mp.Pool(min(num_cpus, num_children, 10))
+
+        # Run child locations
+        arglist = []
+        for child_loc in lt.get_node_by_id(location_id).children:
+            if this_lvl>=(year_split_lvl-1):
+                full_timespan = False
+            else:
+                full_timespan = True
+            arglist.append((
+                child_loc.id, sex_id, y,
+                full_timespan, debug))
+
+        if debug:
+            '..... RUNNING IN SINGLE PROCESS DEBUG MODE .....'
+            res = map(run_loc, arglist)
+        else:
+            res =  pool.map(run_loc, arglist)
+            pool.close()
+            pool.join()
 
     errors = ['%s: %s' % (str(r[0]), r[1]) for r in res if r[1] != 0]
 
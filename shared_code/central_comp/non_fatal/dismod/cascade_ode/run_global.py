@@ -28,6 +28,11 @@ else:
     settings = json.load(
         open(os.path.join(drill.this_path, "../config.dUSERt")))
 
+# Slots reserved by each tree job, and the fewest tree jobs to spread the
+# location tree across, see tree_job_roots
+TREE_JOB_SLOTS = 20
+TREE_JOB_MIN_ROOTS = 20
+
 # Set dUSERt file mask to readable-for all users
 os.umask(0o0002)
 
@@ -64,6 +69,42 @@ def run_world(year, cascade, drop_emr=False, reimport=False):
     return cascade
 
 
+def subtree_nodes(node):
+    """Every node in the subtree under node, including node"""
+    nodes = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        nodes.append(n)
+        stack.extend(n.children)
+    return nodes
+
+
+def tree_job_roots(loctree, min_roots=TREE_JOB_MIN_ROOTS):
+    """Locations to root tree jobs at: those with children on the shallowest
+    level of the location tree that has at least min_roots of them (the
+    regions, in the GBD hierarchy), or on the deepest level with any if
+    none has that many. Each tree job runs at most
+    run_children.TREE_JOB_WORKERS fits at once, so spreading the tree
+    across this many jobs keeps as many fits running as the level-by-level
+    jobs do"""
+    level = [loctree.get_node_by_id(1)]
+    while True:
+        parents = [n for n in level if len(n.children) > 0]
+        below = [c for n in parents for c in n.children]
+        if (len(parents) >= min_roots or
+                not any(len(c.children) > 0 for c in below)):
+            return [n.id for n in parents]
+        level = below
+
+
+def tree_jobs_flag(tree_jobs):
+    """Command line flag passing tree_jobs on to resubmitted jobs"""
+    if tree_jobs:
+        return ['--tree_jobs']
+    return []
+
+
 def execute(conn_str, query):
     import sqlalchemy
     eng = sqlalchemy.create_engine(conn_str)
@@ -74,8 +115,9 @@ def execute(conn_str, query):
 
 class JobTreeBootstrapper(object):
 
-    def __init__(self, mvid):
+    def __init__(self, mvid, tree_jobs=False):
         self.mvid = mvid
+        self.tree_jobs = tree_jobs
         self.logdir = '{}/{}'.format(settings['log_dir'], self.mvid)
         self.mvm = get_model_version(mvid)
         self.run_cv = (self.mvm.cross_validate_id.values[0] == 1)
@@ -121,7 +163,7 @@ class JobTreeBootstrapper(object):
                 slots=20,
                 memory=40,
                 parameters=[self.mvid, '--submit_stage', 'jt', '--cv_iter',
-                            cv_iter],
+                            cv_iter] + tree_jobs_flag(self.tree_jobs),
                 conda_env='cascade_ode',
                 prepend_to_path='strDir',
                 stderr='{}/{}.error'.format(self.logdir, jobname))
@@ -155,9 +197,10 @@ class JobTreeBootstrapper(object):
 
 class CascadeJobTree(object):
 
-    def __init__(self, mvid, cv_iter_id):
+    def __init__(self, mvid, cv_iter_id, tree_jobs=False):
         self.mvid = mvid
         self.cv_iter_id = cv_iter_id
+        self.tree_jobs = tree_jobs
         try:
             j = job.Job('%s/%s' % (settings['cascade_ode_out_dir'], mvid))
             j.start()
@@ -207,7 +250,10 @@ class CascadeJobTree(object):
         varn_job = sge.qstat(pattern=varn_jobname)
         varn_jid = int(varn_job.job_id.values[0])
         if len(ijs) > 0:
-            jids = self.submit_cascade_jobs(ijs)
+            if self.tree_jobs:
+                jids = self.submit_cascade_tree_jobs(ijs)
+            else:
+                jids = self.submit_cascade_jobs(ijs)
             pjid = self.resubmit_self_check(jids)
             sge.add_holds(varn_jid, pjid)
 
@@ -349,6 +395,69 @@ class CascadeJobTree(object):
             dependent_submit(1, [])
         return all_jids
 
+    def submit_cascade_tree_jobs(self, incomplete_jobs):
+        """Submits level-by-level jobs, as submit_cascade_jobs does, down to
+        the level where the location tree branches out (tree_job_roots).
+        Below that, submits one job per sex and year for each root with
+        incomplete locations under it, which fits everything under the root
+        with the critical-path scheduler (run_children.py in "tree" mode).
+        Locations then start as soon as their own parent is done, rather
+        than when every job for the level above has finished. Tree jobs
+        skip the locations whose outputs already exist"""
+        loctree = self.cascade.loctree
+        roots = set(tree_job_roots(loctree))
+        all_jids = []
+        for sex in ['male', 'female']:
+            for y in [1990, 1995, 2000, 2005, 2010, 2016]:
+                stack = [(loctree.get_node_by_id(1), [])]
+                while stack:
+                    node, hold_ids = stack.pop()
+                    if len(node.children) == 0:
+                        continue
+                    if node.id in roots:
+                        below = [n.id for n in subtree_nodes(node)
+                                 if len(n.children) > 0]
+                        if any((loc, sex, y, self.cv_iter_id) in
+                               incomplete_jobs for loc in below):
+                            all_jids.append(self.submit_children_job(
+                                node.id, sex, y, hold_ids, TREE_JOB_SLOTS,
+                                tree=True))
+                        continue
+                    child_hold_ids = []
+                    if ((node.id, sex, y, self.cv_iter_id) in
+                            incomplete_jobs):
+                        if node.id == 1:
+                            num_slots = 20
+                        else:
+                            num_slots = min(20, len(node.children)*2)
+                        jid = self.submit_children_job(
+                            node.id, sex, y, hold_ids, num_slots)
+                        all_jids.append(jid)
+                        child_hold_ids = [jid]
+                    stack.extend((c, child_hold_ids) for c in node.children)
+        return all_jids
+
+    def submit_children_job(self, location_id, sex, year, hold_ids,
+                            num_slots, tree=False):
+        """Submits a run_children.py job fitting the children of
+        location_id, or with tree=True everything below it"""
+        job_name = "dm_%s_%s_%s_%s_%s" % (self.mvid, location_id, sex[0],
+                                          str(year)[2:], self.cv_iter_id)
+        params = [self.mvid, location_id, sex, year, self.cv_iter_id]
+        if tree:
+            params.append('tree')
+        return sge.qsub(
+                cfile,
+                job_name,
+                project=self.project,
+                holds=hold_ids,
+                slots=num_slots,
+                memory=int(math.ceil(num_slots*2.5)),
+                parameters=params,
+                conda_env='cascade_ode',
+                prepend_to_path='strDir',
+                stderr='%s/%s.error' % (self.logdir, job_name))
+
     def resubmit_self_check(self, hold_jids):
         """Submits a job that checks that all child location-year-sex groups
         have run succesfully. If any have failed, it resubmits the below-global
@@ -362,7 +471,7 @@ class CascadeJobTree(object):
                 memory=40,
                 holds=hold_jids,
                 parameters=[self.mvid, '--submit_stage', 'jt', '--cv_iter',
-                            self.cv_iter_id],
+                            self.cv_iter_id] + tree_jobs_flag(self.tree_jobs),
                 conda_env='cascade_ode',
                 prepend_to_path='strDir',
                 stderr='{}/{}.error'.format(self.logdir, jobname))
@@ -377,6 +486,9 @@ def main():
     parser.add_argument('mvid', type=int)
     parser.add_argument('--submit_stage', type=str, dUSERt='bootstrap')
     parser.add_argument('--cv_iter', type=int, dUSERt=0)
+    parser.add_argument('--tree_jobs', action='store_true',
+                        help="fit each sex-year below global in one job with "
+                             "the critical-path scheduler")
 
     args = parser.parse_args()
     submit_stage = args.submit_stage
@@ -384,9 +496,9 @@ def main():
     cv_iter = args.cv_iter
 
     if submit_stage == 'bootstrap':
-        JobTreeBootstrapper(mvid)
+        JobTreeBootstrapper(mvid, tree_jobs=args.tree_jobs)
     else:
-        CascadeJobTree(mvid, cv_iter)
+        CascadeJobTree(mvid, cv_iter, tree_jobs=args.tree_jobs)
 
 
 if __name__ == "__main__":
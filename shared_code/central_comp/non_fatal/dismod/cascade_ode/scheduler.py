@@ -0,0 +1,258 @@
+""" Critical-path scheduling of the fits in a subtree of the cascade.
+
+Run level by level, each location's children are fit in one pool that
+has to finish before any grandchild can start, so one slow child (e.g. a
+large subnational) holds up all of its siblings' subtrees. run_tree
+instead treats the location tree as a DAG: every location is started as
+soon as its parent's fit has finished, with at most n_workers fits
+running at once. Fits that are ready are started in order of the longest
+expected remaining work below them, estimated from historical fit times,
+so the deepest and slowest subtrees are started first. Each individual
+fit is unchanged.
+"""
+import glob
+import heapq
+import logging
+import multiprocessing as mp
+import os
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+import pandas as pd
+
+FIT_TIMES_PATTERN = 'fit_times_*.csv'
+
+
+def read_fit_times(root_dir):
+    """ Median historical fit time, in seconds, of each location_id, from
+    the fit_times_*.csv files written to root_dir by earlier runs """
+    dfs = []
+    for f in glob.glob(os.path.join(root_dir, FIT_TIMES_PATTERN)):
+        try:
+            dfs.append(pd.read_csv(f))
+        except Exception:
+            logging.exception("Could not read fit times from {}".format(f))
+    if len(dfs) == 0:
+        return {}
+    df = pd.concat(dfs)
+    return df.groupby('location_id')['seconds'].median().to_dict()
+
+
+def write_fit_times(filepath, results):
+    """ Write the fit time of every successful fit in results, as returned
+    by run_tree, for read_fit_times """
+    fit_times = [(loc, seconds) for loc, error, seconds in results
+                 if error == 0]
+    pd.DataFrame(fit_times, columns=['location_id', 'seconds']).to_csv(
+        filepath, index=False)
+
+
+def subtree_order(root, children):
+    """ Every location in the subtree under root, parents before
+    children """
+    order = []
+    stack = [root]
+    while stack:
+        loc = stack.pop()
+        order.append(loc)
+        stack.extend(children.get(loc, []))
+    return order
+
+
+def remaining_work(root, children, durations, default_duration=None,
+                   done=()):
+    """ Expected time from the start of each location's fit to the end of
+    the last fit below it, with unlimited workers: the location's own fit
+    time plus the largest remaining work of its children, i.e. the critical
+    path through its subtree
+
+    Args:
+        root: location_id at the top of the subtree
+        children (dict): location_id -> list of child location_ids
+        durations (dict): location_id -> expected fit time
+        default_duration (float): fit time for locations without one in
+            durations. Defaults to the median of durations, or 1 if there
+            are none
+        done (set): locations that have already been fit, which take no
+            time
+
+    Returns:
+        dict: location_id -> remaining work, for root and every location
+        below it
+    """
+    if default_duration is None:
+        if len(durations) > 0:
+            default_duration = float(np.median(list(durations.values())))
+        else:
+            default_duration = 1.
+    work = {}
+    for loc in reversed(subtree_order(root, children)):
+        below = [work[c] for c in children.get(loc, [])]
+        own = 0. if loc in done else durations.get(loc, default_duration)
+        work[loc] = own + (max(below) if below else 0)
+    return work
+
+
+_started = None
+
+
+def _init_worker(started):
+    """ Pool initializer: keep the shared dict that workers record the
+    fits they start in """
+    global _started
+    _started = started
+
+
+def _timed_fit(args):
+    """ Run one fit in a worker process, returning (location_id, 0 or an
+    error message, seconds). Never raises, so the scheduler always hears
+    back, unless the worker itself dies """
+    run_fit, location_id, parent_id = args
+    if _started is not None:
+        _started[location_id] = os.getpid()
+    start = time.time()
+    try:
+        error = run_fit(location_id, parent_id)
+    except Exception as e:
+        logging.exception("Failure running location {}".format(location_id))
+        error = str(e)
+    return location_id, error, time.time()-start
+
+
+def _submit(pool, run_fit, location_id, parent_id, finished):
+    """ Start a fit in the pool, putting its result on finished. Errors
+    outside of the fit itself, e.g. a result that can't be pickled, are
+    put on finished as the fit's error where multiprocessing supports an
+    error_callback (python 3) """
+    args = ((run_fit, location_id, parent_id),)
+
+    def failed(err):
+        finished.put((location_id, str(err), 0))
+
+    try:
+        pool.apply_async(_timed_fit, args, callback=finished.put,
+                         error_callback=failed)
+    except TypeError:
+        pool.apply_async(_timed_fit, args, callback=finished.put)
+
+
+def _lost_fits(pool, started, running):
+    """ Fits in running whose worker process has died, so will never
+    finish
+
+    Args:
+        pool (Pool): pool running the fits
+        started (dict): location_id -> pid of the worker process that
+            started its fit, set by each worker
+        running (iterable): location_ids of the fits that have not
+            finished
+
+    Returns:
+        list of (location_id, error message)
+    """
+    # The pool replaces dead workers, so the pids of live ones are enough
+    alive = set(p.pid for p in pool._pool if p.exitcode is None)
+    lost = []
+    for loc in running:
+        pid = started.get(loc)
+        if pid is not None and pid not in alive:
+            lost.append((loc, "Worker process {} running location {} "
+                              "died".format(pid, loc)))
+    return lost
+
+
+def run_tree(root, children, run_fit, n_workers=None, durations=None,
+             poll_seconds=60, done=None):
+    """ Fit every location below root, each as soon as its parent's fit
+    has finished, longest remaining work first
+
+    Args:
+        root: location_id whose own fit has already finished
+        children (dict): location_id -> list of child location_ids
+        run_fit: a picklable function, run_fit(location_id, parent_id),
+            that fits a location and returns 0, or an error message if the
+            fit failed
+        n_workers (int): most fits to run at once. Defaults to the number
+            of cores
+        durations (dict): expected fit time of each location_id, e.g. from
+            read_fit_times
+        poll_seconds (float): how often to check for worker processes that
+            died while waiting for fits to finish. Fits on a dead worker
+            are failed
+        done (set): location_ids below root whose fits have already
+            finished, e.g. in an earlier attempt. They are not run again,
+            and their children are started straight away
+
+    Returns:
+        list of (location_id, 0 or error message, seconds) for every
+        location below root that was not done, in the order they finished.
+        Locations below a failed fit are not run
+    """
+    if n_workers is None:
+        n_workers = mp.cpu_count()
+    done = done or set()
+    work = remaining_work(root, children, durations or {}, done=done)
+
+    ready = []
+
+    def add_children(parent_id):
+        for loc in children.get(parent_id, []):
+            if loc in done:
+                add_children(loc)
+            else:
+                heapq.heappush(ready, (-work[loc], loc, parent_id))
+
+    add_children(root)
+    results = []
+    if len(ready) == 0:
+        return results
+
+    finished = queue.Queue()
+    # Written synchronously, so it survives the worker dying
+    manager = mp.Manager()
+    started = manager.dict()
+    pool = mp.Pool(max(1, min(n_workers, len(work)-1)),
+                   initializer=_init_worker, initargs=(started,))
+    running = set()
+    lost = False
+    try:
+        while ready or running:
+            while ready and len(running) < n_workers:
+                _, loc, parent_id = heapq.heappop(ready)
+                _submit(pool, run_fit, loc, parent_id, finished)
+                running.add(loc)
+
+            try:
+                loc, error, seconds = finished.get(timeout=poll_seconds)
+            except queue.Empty:
+                for loc, error in _lost_fits(pool, started, running):
+                    logging.error(error)
+                    finished.put((loc, error, 0))
+                    lost = True
+                continue
+            if loc not in running:
+                # Already failed as lost
+                continue
+            running.remove(loc)
+            results.append((loc, error, seconds))
+            if error == 0:
+                logging.info("Location {} finished in {:.0f} seconds".format(
+                    loc, seconds))
+                add_children(loc)
+            else:
+                for below in subtree_order(loc, children)[1:]:
+                    results.append((below, "Parent location {} failed".format(
+                        loc), 0))
+    finally:
+        # The pool waits on the results of lost fits when closed
+        if lost:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+        manager.shutdown()
+    return results
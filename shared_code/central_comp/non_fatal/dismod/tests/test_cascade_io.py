@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+# Old style "import" structure based on CWD
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..', 'cascade_ode'))
+import cascade_io
+
+
+def make_table():
+    return pd.DataFrame({
+        'location_id': [102, 102, 0],
+        'atom': ['none', '555', 'none'],
+        'meas_value': [0.1, 1./3, np.inf],
+        'x_sex': [0.5, -0.5, 0]})
+
+
+def test_binary_round_trip(tmpdir):
+    """Tables written without a csv are read back from the binary copy,
+    with their types"""
+    path = str(tmpdir.join('child_priors.csv'))
+    df = make_table()
+    cascade_io.write_table(df, path, csv=False)
+    cascade_io.clear_cache()
+
+    assert not os.path.isfile(path)
+    assert cascade_io.table_exists(path)
+    assert_frame_equal(cascade_io.read_table(path), df)
+
+
+def test_csv_written_for_executables(tmpdir):
+    path = str(tmpdir.join('post_ode_summary.csv'))
+    df = make_table()
+    cascade_io.write_table(df, path)
+    assert_frame_equal(pd.read_csv(path), df, check_dtype=False)
+
+
+def test_newer_csv_is_read(tmpdir):
+    """A csv written after the binary copy, e.g. by a dismod executable,
+    is read instead of the binary"""
+    path = str(tmpdir.join('post_ally_adj.csv'))
+    cascade_io.write_table(make_table(), path, csv=False)
+    newer = make_table().head(1)
+    newer.to_csv(path, index=False)
+    os.utime(path, (time.time() + 10, time.time() + 10))
+
+    assert_frame_equal(cascade_io.read_table(path), newer, check_dtype=False)
+
+
+def test_cached_tables_are_copies(tmpdir):
+    path = str(tmpdir.join('child_priors.csv'))
+    cascade_io.write_table(make_table(), path, csv=False)
+    df = cascade_io.read_table(path)
+    df['atom'] = 'none'
+    assert (cascade_io.read_table(path).atom == make_table().atom).all()
+
+
+def test_missing_table(tmpdir):
+    path = str(tmpdir.join('missing.csv'))
+    assert not cascade_io.table_exists(path)
+    cascade_io.preload([path])
+    try:
+        cascade_io.read_table(path)
+    except IOError:
+        pass
+    else:
+        assert False, "Reading a missing table should raise an IOError"
@@ -0,0 +1,74 @@
+import os
+import sys
+
+# Old style "import" structure based on CWD
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..', 'cascade_ode'))
+import scheduler
+
+# 1 -> 2 -> 4 -> 6
+#   -> 3 -> 5
+children = {1: [2, 3], 2: [4], 3: [5], 4: [6], 5: [], 6: []}
+
+
+def fit(location_id, parent_id):
+    return 0
+
+
+def failing_fit(location_id, parent_id):
+    if location_id == 3:
+        return "fit failed"
+    return 0
+
+
+def test_remaining_work():
+    work = scheduler.remaining_work(1, children, {2: 1., 3: 5., 4: 1.,
+                                                  5: 1., 6: 1.})
+    assert work[6] == 1.
+    assert work[2] == 3.
+    assert work[3] == 6.
+    # the root's own time defaults to the median
+    assert work[1] == 7.
+
+
+def test_run_tree_order():
+    """With one worker, ready fits run longest remaining work first, and
+    never before their parent"""
+    durations = {2: 1., 3: 5., 4: 1., 5: 1., 6: 1.}
+    res = scheduler.run_tree(1, children, fit, n_workers=1,
+                             durations=durations)
+    assert [r[0] for r in res] == [3, 2, 4, 5, 6]
+
+
+def test_run_tree_failures():
+    res = scheduler.run_tree(1, children, failing_fit, n_workers=2)
+    errors = dict((r[0], r[1]) for r in res)
+    assert sorted(errors) == [2, 3, 4, 5, 6]
+    assert errors[2] == errors[4] == errors[6] == 0
+    assert errors[3] == "fit failed"
+    assert errors[5] != 0
+
+
+def dying_fit(location_id, parent_id):
+    if location_id == 3:
+        os._exit(1)
+    return 0
+
+
+def test_run_tree_worker_dies():
+    """A fit whose worker process dies fails, rather than hanging"""
+    res = scheduler.run_tree(1, children, dying_fit, n_workers=2,
+                             poll_seconds=0.1)
+    errors = dict((r[0], r[1]) for r in res)
+    assert sorted(errors) == [2, 3, 4, 5, 6]
+    assert errors[2] == errors[4] == errors[6] == 0
+    assert "died" in errors[3]
+    assert errors[5] != 0
+
+
+def test_run_tree_done():
+    """Locations that are already done are not fit again, but their
+    children are"""
+    res = scheduler.run_tree(1, children, fit, n_workers=2, done={2, 4})
+    assert sorted(r[0] for r in res) == [3, 5, 6]
+    assert scheduler.remaining_work(1, children, {}, done={2, 4})[2] == 1.